@@ -0,0 +1,238 @@
+import heapq
+import math
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+from mysql.connector import Error
+from db import db_connection
+
+# Cadenza minima/massima di aggiornamento di un singolo aeroporto (secondi).
+SCHEDULER_MIN_INTERVAL = int(os.getenv("SCHEDULER_MIN_INTERVAL", "3600"))
+SCHEDULER_MAX_INTERVAL = int(os.getenv("SCHEDULER_MAX_INTERVAL", str(12 * 3600)))
+# Ogni tick aggiorna al massimo SCHEDULER_MAX_PER_TICK aeroporti scaduti, oppure
+# tutti quelli scaduti se conviene coprirli con uno sweep /flights/all.
+SCHEDULER_TICK_SECONDS = int(os.getenv("SCHEDULER_TICK_SECONDS", "60"))
+SCHEDULER_MAX_PER_TICK = int(os.getenv("SCHEDULER_MAX_PER_TICK", "20"))
+# Ogni quanto rileggere iscritti e soglie dalla tabella interests.
+SCHEDULER_SYNC_SECONDS = int(os.getenv("SCHEDULER_SYNC_SECONDS", "300"))
+
+SUBSCRIBER_WEIGHT = 1.0
+TRAFFIC_WEIGHT = 0.5
+PROXIMITY_WEIGHT = 3.0
+# Distanza relativa dalla soglia entro cui l'aeroporto viene accelerato.
+PROXIMITY_BAND = 0.2
+
+
+class AirportEntry:
+    def __init__(self, airport):
+        self.airport = airport
+        self.subscribers = 0
+        self.high_value = None
+        self.low_value = None
+        self.traffic = None          # arrivi + partenze delle ultime 24 ore coperte
+        self.interval = SCHEDULER_MAX_INTERVAL
+        self.next_due = 0.0
+        self.last_run = None
+
+    def score(self):
+        score = 1.0 + SUBSCRIBER_WEIGHT * math.log2(1 + self.subscribers)
+        if self.traffic is not None:
+            score += TRAFFIC_WEIGHT * math.log10(1 + self.traffic)
+            for threshold in (self.high_value, self.low_value):
+                if threshold is None:
+                    continue
+                distance = abs(self.traffic - threshold) / max(threshold, 1)
+                if distance < PROXIMITY_BAND:
+                    score += PROXIMITY_WEIGHT * (1 - distance / PROXIMITY_BAND)
+        return score
+
+    def compute_interval(self):
+        interval = SCHEDULER_MAX_INTERVAL / self.score()
+        self.interval = int(min(SCHEDULER_MAX_INTERVAL, max(SCHEDULER_MIN_INTERVAL, interval)))
+        return self.interval
+
+    def to_dict(self):
+        return {
+            "airport": self.airport,
+            "subscribers": self.subscribers,
+            "high_value": self.high_value,
+            "low_value": self.low_value,
+            "traffic": self.traffic,
+            "score": round(self.score(), 3),
+            "interval_seconds": self.interval,
+            "next_due": datetime.fromtimestamp(self.next_due).isoformat(),
+            "last_run": datetime.fromtimestamp(self.last_run).isoformat() if self.last_run else None,
+        }
+
+
+class AirportScheduler:
+    """
+    Coda a priorità (min-heap su next_due) degli aeroporti da aggiornare.
+
+    Ogni aeroporto ha una propria cadenza, più breve se ha molti iscritti,
+    molto traffico o un traffico vicino alle soglie di allerta. Il primo
+    aggiornamento di un aeroporto è sfasato in modo deterministico dentro il
+    suo intervallo e ogni tick ne serve un numero limitato, così le richieste
+    a OpenSky sono distribuite nel tempo invece che concentrate in un burst.
+
+    Con l'orizzonte predefinito (mezzanotte) le finestre avanzano una volta al
+    giorno: la cadenza è il ritardo massimo con cui l'aeroporto recupera il
+    batch notturno di OpenSky, e i tick intermedi costano solo la lettura dei
+    checkpoint. Con INGESTION_LAG_HOURS le finestre diventano infragiornaliere
+    e la cadenza è la frequenza effettiva di aggiornamento. In entrambi i casi
+    il traffico è il totale delle ultime 24 ore coperte, aggiornato a ogni
+    esecuzione.
+    """
+
+    def __init__(self, refresh_fn, owned_fn=None, sweep_fn=None):
+        # refresh_fn(airports, monitored) -> {airport: (arrivi, partenze)}
+        self.refresh_fn = refresh_fn
+        # se presente, restituisce gli aeroporti assegnati a questa replica
+        self.owned_fn = owned_fn
+        # se presente, sweep_fn(airports, monitored) dice se il batch verrebbe
+        # scaricato con /flights/all: in quel caso il tick prende tutti gli scaduti
+        self.sweep_fn = sweep_fn
+        self.entries = {}
+        self.heap = []
+        self.lock = threading.Lock()
+        self.last_sync = 0.0
+
+    def _push(self, entry):
+        heapq.heappush(self.heap, (entry.next_due, entry.airport))
+
+    def _load_interests(self):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT airport, COUNT(*), MIN(high_value), MAX(low_value)
+                FROM interests
+                GROUP BY airport
+                """
+            )
+            return cursor.fetchall()
+
+    def sync(self, now=None):
+        """Allinea la coda alla tabella interests (aeroporti nuovi, rimossi, soglie)."""
+        now = now or time.time()
+        try:
+            rows = self._load_interests()
+        except Error as e:
+            print(f"Errore database nella sincronizzazione dello scheduler: {e}")
+            return
+
+        owned = self.owned_fn() if self.owned_fn is not None else None
+
+        with self.lock:
+            seen = set()
+            for airport, subscribers, high_value, low_value in rows:
+                if owned is not None and airport not in owned:
+                    continue
+                seen.add(airport)
+                entry = self.entries.get(airport)
+                is_new = entry is None
+                if is_new:
+                    entry = AirportEntry(airport)
+                    self.entries[airport] = entry
+
+                entry.subscribers = subscribers
+                entry.high_value = high_value
+                entry.low_value = low_value
+                entry.compute_interval()
+
+                if is_new:
+                    offset = zlib.crc32(airport.encode("utf-8")) % max(entry.interval, 1)
+                    entry.next_due = now + offset
+                    self._push(entry)
+                elif entry.last_run is not None and entry.last_run + entry.interval < entry.next_due:
+                    # priorità aumentata: anticipo il prossimo aggiornamento
+                    entry.next_due = max(now, entry.last_run + entry.interval)
+                    self._push(entry)
+
+            for airport in list(self.entries):
+                if airport not in seen:
+                    del self.entries[airport]
+
+            self.last_sync = now
+
+    def _pop_due(self, now, limit=None):
+        batch = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now and (limit is None or len(batch) < limit):
+                due, airport = heapq.heappop(self.heap)
+                entry = self.entries.get(airport)
+                # voce obsoleta: aeroporto rimosso o già ripianificato
+                if entry is None or entry.next_due != due:
+                    continue
+                batch.append(entry)
+        return batch
+
+    def _sweeps(self, batch, monitored):
+        try:
+            return self.sweep_fn([entry.airport for entry in batch], monitored)
+        except Exception as e:
+            print(f"Errore nella scelta della strategia per {len(batch)} aeroporti scaduti: {e}")
+            return False
+
+    def _requeue(self, entries):
+        with self.lock:
+            for entry in entries:
+                if self.entries.get(entry.airport) is entry:
+                    self._push(entry)
+
+    def tick(self):
+        now = time.time()
+        if now - self.last_sync >= SCHEDULER_SYNC_SECONDS:
+            self.sync(now)
+
+        limit = None if self.sweep_fn is not None else SCHEDULER_MAX_PER_TICK
+        batch = self._pop_due(now, limit)
+        if not batch:
+            return
+
+        monitored = len(self.entries)
+        if len(batch) > SCHEDULER_MAX_PER_TICK and not self._sweeps(batch, monitored):
+            # uno sweep costa uguale per uno o cento aeroporti: senza sweep
+            # resta il limite per tick, gli altri restano scaduti in coda
+            self._requeue(batch[SCHEDULER_MAX_PER_TICK:])
+            batch = batch[:SCHEDULER_MAX_PER_TICK]
+
+        airports = [entry.airport for entry in batch]
+        if self.owned_fn is not None:
+            # un lease può essere stato perso dall'ultima sync
+            owned = self.owned_fn()
+            airports = [airport for airport in airports if airport in owned]
+
+        try:
+            counts = (self.refresh_fn(airports, monitored) or {}) if airports else {}
+        except Exception as e:
+            # gli aeroporti vanno comunque ripianificati, altrimenti uscirebbero dalla coda
+            print(f"Errore nell'aggiornamento pianificato di {len(batch)} aeroporti: {e}")
+            counts = {}
+
+        with self.lock:
+            for entry in batch:
+                if self.entries.get(entry.airport) is not entry:
+                    continue
+                if entry.airport in counts:
+                    entry.traffic = sum(counts[entry.airport])
+                entry.last_run = now
+                entry.compute_interval()
+                # mantengo la fase dell'aeroporto per non riallineare tutti sullo stesso istante
+                entry.next_due = entry.next_due + entry.interval
+                if entry.next_due <= now:
+                    entry.next_due = now + entry.interval
+                self._push(entry)
+
+    def snapshot(self):
+        with self.lock:
+            entries = sorted(self.entries.values(), key=lambda e: e.next_due)
+            return {
+                "airports": len(entries),
+                "tick_seconds": SCHEDULER_TICK_SECONDS,
+                "max_per_tick": SCHEDULER_MAX_PER_TICK,
+                "last_sync": datetime.fromtimestamp(self.last_sync).isoformat() if self.last_sync else None,
+                "queue": [entry.to_dict() for entry in entries],
+            }
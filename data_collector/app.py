@@ -1,199 +1,61 @@
+import atexit
 import os
-from flask import Flask, request, jsonify
-import requests
+import re
+from datetime import date
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from mysql.connector import Error
-from db import get_connection, init_db
-from open_sky_token import get_token
-from datetime import datetime, date, timedelta, time
+from db import db_connection, init_db, maintain_partitions, pool
+from open_sky_token import get_token, token_manager
 from apscheduler.schedulers.background import BackgroundScheduler
 from user_manager_client import user_exists
-from circuit_breaker import CircuitBreaker, CircuitBreakerOpenException
-from kafka_producer import publish_flights_update, flush_producer
-app = Flask(__name__)
-
-API_ROOT_URL = "https://opensky-network.org/api"
-
-flights_circuit_breaker = CircuitBreaker(
-    failure_threshold=5,
-    recovery_timeout=60,
-    expected_exception=requests.exceptions.RequestException,
+from ingestion import refresh_airports, plans_sweep
+from airport_scheduler import AirportScheduler, SCHEDULER_TICK_SECONDS
+from work_leases import LeaseManager, LEASE_HEARTBEAT_SECONDS
+from rate_limiter import opensky_rate_limiter
+from circuit_breaker import registry as breaker_registry
+from fetch_engine import strategy_stats
+from response_journal import journal
+from flight_rollup import load_hourly, summarize, rebuild_rollup
+from flight_partitions import PARTITION_MAINTENANCE_HOURS
+from flight_pagination import (
+    DIRECTIONS, FLIGHTS_PAGE_MAX_LIMIT, InvalidCursor, build_filters, decode_cursor, encode_cursor,
+    page_query, parse_time, total_cache,
 )
+from flight_export import EXPORT_FORMATS, export_stream, open_export
+from flight_snapshots import (
+    ARROW_FILE_MIMETYPE, ARROW_STREAM_MIMETYPE, list_snapshots, read_snapshot, snapshot_path,
+    snapshot_scheduler, snapshots_available, table_to_stream,
+)
+from flight_dedup import recent_flights
+from flight_window import hot_window
+from flight_latest import latest_cache
+from backfill import start_backfill, backfill_new_airports, get_backfill_status, BACKFILL_DAYS, BACKFILL_MAX_DAYS
+app = Flask(__name__)
 
-def save_flights_to_db(flights_data):
-    if not flights_data:
-        return 0
-
-    conn = None
-    saved_count = 0
-
-    column_mapping = {
-        'flight_id': 'callsign',
-        'departure_airport': 'estDepartureAirport',
-        'arrival_airport': 'estArrivalAirport',
-        'date_time_arrival': 'lastSeen',
-        'date_time_departure': 'firstSeen'
-    }
-
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        for flight in flights_data:
-            flight_id = (flight.get(column_mapping['flight_id']) or '').strip()
-            dep_airport = flight.get(column_mapping['departure_airport'])
-            arr_airport = flight.get(column_mapping['arrival_airport'])
-            arr_ts = flight.get(column_mapping['date_time_arrival'])
-            dep_ts = flight.get(column_mapping['date_time_departure'])
-
-            if (
-                    not flight_id or
-                    not dep_airport or
-                    not arr_airport or
-                    not isinstance(arr_ts, int) or
-                    not isinstance(dep_ts, int)
-            ):
-                continue
-
-            date_time_arrival = datetime.fromtimestamp(arr_ts)
-            date_time_departure = datetime.fromtimestamp(dep_ts)
-
-            query = """
-                    INSERT IGNORE INTO flights (
-                    flight_id, departure_airport, arrival_airport, date_time_arrival, date_time_departure
-                ) VALUES (%s, %s, %s, %s, %s) 
-                    """
-            values = (
-                flight_id,
-                dep_airport,
-                arr_airport,
-                date_time_arrival,
-                date_time_departure
-            )
-
-            cursor.execute(query, values)
-            saved_count += cursor.rowcount
-
-        conn.commit()
-        return saved_count
-
-    except Error as e:
-        print(f"Errore database durante il salvataggio dei voli: {e}")
-        return 0
-    finally:
-        if conn:
-            conn.close()
-
-
-def get_flights(airport_icao, access_token, flight_type):
-    """
-    flight_type: 'arrival' oppure 'departure'
-    """
-    yesterday = date.today() - timedelta(days=1)
-    begin_time = int(datetime.combine(yesterday, time.min).timestamp())
-    end_time = int(datetime.combine(yesterday, time.max).timestamp())
-
-    params = {
-        "airport": airport_icao,
-        "begin": begin_time,
-        "end": end_time
-    }
-
-    url = f"{API_ROOT_URL}/flights/{flight_type}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    def _do_request():
-        r = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=15
-        )
-        r.raise_for_status()
-        return r
-
-    try:
-        response = flights_circuit_breaker.call(_do_request)
-
-        if response.status_code == 204:
-            return []
-
-        data = response.json()
-        if data == []:
-            return []
-
-        return data
-
-    except CircuitBreakerOpenException:
-        print(f"Circuit breaker OPEN: richiesta {flight_type} per {airport_icao} bloccata")
-        return []
-
-    except requests.exceptions.RequestException as e:
-        print(f"Errore nella richiesta {flight_type} per {airport_icao}: {e}")
-        return []
-
-def get_interests():
-    conn = None
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT DISTINCT airport FROM interests")
-
-        unique_airports = [row[0] for row in cursor.fetchall()]
-        return unique_airports
-    except Error as e:
-        print(f"Errore database nel recuperare interessi unici: {e}")
-        return []
-    finally:
-        if conn:
-            conn.close()
-
-
-def get_open_sky_data():
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    access_token = get_token()
-    if not access_token:
-        print("Impossibile ottenere il token.")
-        return
-
-    airports_to_monitor = get_interests()
-
-    if not airports_to_monitor:
-        print("Nessun aeroporto di interesse.")
-        return
-
-    total_saved_flights = 0
-
-    print(f"  > Richiesta dati per aeroporti d'interesse...")
-
-    for airport_icao in airports_to_monitor:
-        flights_arr = get_flights(airport_icao, access_token, "arrival")
-        flights_dep = get_flights(airport_icao, access_token, "departure")
+# Con INGESTION_ENABLED=false la replica serve solo le API HTTP.
+INGESTION_ENABLED = os.getenv("INGESTION_ENABLED", "true").lower() == "true"
 
-        message = {
-            "airport": airport_icao,
-            "arrivals": len(flights_arr or []),
-            "departures": len(flights_dep or []),
-            "timestamp": timestamp
-        }
-        publish_flights_update(message)
+# /flights/latest cerca prima tra le partizioni degli ultimi giorni.
+LATEST_LOOKBACK_DAYS = int(os.getenv("FLIGHTS_LATEST_LOOKBACK_DAYS", "3"))
 
-        has_flights = False
-        if flights_arr:
-            total_saved_flights += save_flights_to_db(flights_arr)
-            has_flights = True
-        if flights_dep:
-            total_saved_flights += save_flights_to_db(flights_dep)
-            has_flights = True
+# Codici ICAO come li restituisce OpenSky (es. LIRF, K1G4).
+ICAO_CODE_RE = re.compile(r"^[A-Z0-9]{4}$")
 
-        if not has_flights:
-            print(f"    > Nessun volo trovato per {airport_icao}.")
+lease_manager = LeaseManager()
+airport_scheduler = AirportScheduler(refresh_airports, owned_fn=lease_manager.owned_airports, sweep_fn=plans_sweep)
+# la finestra in memoria serve solo gli aeroporti ingeriti da questa replica
+hot_window.owned_fn = lease_manager.owned_airports
+latest_cache.owned_fn = lease_manager.owned_airports
 
-    # flush UNA volta sola
-    flush_producer(5)
 
-    print(f"[{timestamp}] Elaborazione completata. Totale nuovi voli: {total_saved_flights}.")
+def lease_heartbeat():
+    previous = lease_manager.owned_airports()
+    lease_manager.heartbeat()
+    owned = lease_manager.owned_airports()
+    hot_window.retain(owned)
+    latest_cache.retain(owned)
+    # lo storico dei nuovi aeroporti lo recupera la replica che li ingerisce
+    backfill_new_airports(owned - previous)
 
 ###NEW
 @app.route("/users/add-interests", methods=["POST"])
@@ -211,8 +73,8 @@ def add_interests():
     if not user_exists(email):
         return jsonify({"error": "Utente inesistente nel User Manager"}), 404
 
-    conn = None
     inserted_airports = []
+    new_airports = []
 
     def _normalize_entry(entry):
         # Supporta: "LICC" oppure {"airport":"LICC","high_value":120,"low_value":10}
@@ -223,52 +85,57 @@ def add_interests():
         return None, None, None
 
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        for entry in airports:
-            airport_code, high_value, low_value = _normalize_entry(entry)
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-            if not airport_code or not isinstance(airport_code, str) or not airport_code.strip():
-                return jsonify({"error": "Ogni elemento di 'airports' deve essere una stringa o un oggetto con campo 'airport'"}), 400
-            airport_code = airport_code.strip()
+            for entry in airports:
+                airport_code, high_value, low_value = _normalize_entry(entry)
 
-            if high_value is not None and not isinstance(high_value, int):
-                return jsonify({"error": f"high_value deve essere un intero per {airport_code}"}), 400
-            if low_value is not None and not isinstance(low_value, int):
-                return jsonify({"error": f"low_value deve essere un intero per {airport_code}"}), 400
-            if high_value is not None and low_value is not None and high_value <= low_value:
-                return jsonify({"error": f"Per {airport_code}: high_value deve essere > low_value"}), 400
+                if not airport_code or not isinstance(airport_code, str) or not airport_code.strip():
+                    return jsonify({"error": "Ogni elemento di 'airports' deve essere una stringa o un oggetto con campo 'airport'"}), 400
+                airport_code = airport_code.strip().upper()
+                if not ICAO_CODE_RE.match(airport_code):
+                    return jsonify({"error": f"'{airport_code}' non è un codice ICAO valido (4 caratteri alfanumerici)"}), 400
 
-            cursor.execute(
-                "SELECT 1 FROM interests WHERE email = %s AND airport = %s",
-                (email, airport_code)
-            )
-            exists = cursor.fetchone() is not None
+                if high_value is not None and not isinstance(high_value, int):
+                    return jsonify({"error": f"high_value deve essere un intero per {airport_code}"}), 400
+                if low_value is not None and not isinstance(low_value, int):
+                    return jsonify({"error": f"low_value deve essere un intero per {airport_code}"}), 400
+                if high_value is not None and low_value is not None and high_value <= low_value:
+                    return jsonify({"error": f"Per {airport_code}: high_value deve essere > low_value"}), 400
 
-            if not exists:
                 cursor.execute(
-                    "INSERT INTO interests (email, airport, high_value, low_value) VALUES (%s, %s, %s, %s)",
-                    (email, airport_code, high_value, low_value)
+                    "SELECT 1 FROM interests WHERE email = %s AND airport = %s",
+                    (email, airport_code)
                 )
-                inserted_airports.append(airport_code)
-
-        conn.commit()
-
-        return jsonify({
-            "message": "Interessi aggiunti",
-            "inserted_airports": inserted_airports,
-            "total_processed": len(airports)
-        }), 201
+                exists = cursor.fetchone() is not None
+
+                if not exists:
+                    # primo interesse in assoluto per l'aeroporto: serve lo storico, che
+                    # recupera la replica che ne prende il lease (vedi lease_heartbeat)
+                    cursor.execute("SELECT 1 FROM interests WHERE airport = %s LIMIT 1", (airport_code,))
+                    if cursor.fetchone() is None:
+                        new_airports.append(airport_code)
+
+                    cursor.execute(
+                        "INSERT INTO interests (email, airport, high_value, low_value) VALUES (%s, %s, %s, %s)",
+                        (email, airport_code, high_value, low_value)
+                    )
+                    inserted_airports.append(airport_code)
+
+            conn.commit()
+
+            return jsonify({
+                "message": "Interessi aggiunti",
+                "inserted_airports": inserted_airports,
+                "backfill_scheduled": new_airports,
+                "total_processed": len(airports)
+            }), 201
 
     except Error as e:
         print(f"Errore in add_interests: {e}")
         return jsonify({"error": "Errore database"}), 500
 
-    finally:
-        if conn:
-            conn.close()
-
 @app.route("/users/update-thresholds", methods=["POST"])
 def add_thresholds():
     data = request.get_json(silent=True) or {}
@@ -284,76 +151,71 @@ def add_thresholds():
     if not user_exists(email):
         return jsonify({"error": "Utente inesistente nel User Manager"}), 404
 
-    conn = None
     updated = []
     not_found = []
 
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        for item in thresholds:
-            if not isinstance(item, dict):
-                return jsonify({"error": "Ogni elemento di 'thresholds' deve essere un oggetto"}), 400
+            for item in thresholds:
+                if not isinstance(item, dict):
+                    return jsonify({"error": "Ogni elemento di 'thresholds' deve essere un oggetto"}), 400
 
-            airport = item.get("airport")
-            high_value = item.get("high_value", None)
-            low_value = item.get("low_value", None)
+                airport = item.get("airport")
+                high_value = item.get("high_value", None)
+                low_value = item.get("low_value", None)
 
-            if not airport or not isinstance(airport, str) or not airport.strip():
-                return jsonify({"error": "Ogni elemento deve avere 'airport' valido"}), 400
-            airport = airport.strip()
+                if not airport or not isinstance(airport, str) or not airport.strip():
+                    return jsonify({"error": "Ogni elemento deve avere 'airport' valido"}), 400
+                airport = airport.strip()
 
-            if high_value is None and low_value is None:
-                return jsonify({"error": f"Per {airport}: devi specificare almeno high_value o low_value"}), 400
+                if high_value is None and low_value is None:
+                    return jsonify({"error": f"Per {airport}: devi specificare almeno high_value o low_value"}), 400
 
-            if high_value is not None and not isinstance(high_value, int):
-                return jsonify({"error": f"high_value deve essere un intero per {airport}"}), 400
-            if low_value is not None and not isinstance(low_value, int):
-                return jsonify({"error": f"low_value deve essere un intero per {airport}"}), 400
-            if high_value is not None and low_value is not None and high_value <= low_value:
-                return jsonify({"error": f"Per {airport}: high_value deve essere > low_value"}), 400
+                if high_value is not None and not isinstance(high_value, int):
+                    return jsonify({"error": f"high_value deve essere un intero per {airport}"}), 400
+                if low_value is not None and not isinstance(low_value, int):
+                    return jsonify({"error": f"low_value deve essere un intero per {airport}"}), 400
+                if high_value is not None and low_value is not None and high_value <= low_value:
+                    return jsonify({"error": f"Per {airport}: high_value deve essere > low_value"}), 400
 
-            cursor.execute(
-                "SELECT high_value, low_value FROM interests WHERE email = %s AND airport = %s",
-                (email, airport)
-            )
-            row = cursor.fetchone()
-            if not row:
-                not_found.append(airport)
-                continue
+                cursor.execute(
+                    "SELECT high_value, low_value FROM interests WHERE email = %s AND airport = %s",
+                    (email, airport)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    not_found.append(airport)
+                    continue
 
-            current_high, current_low = row
+                current_high, current_low = row
 
-            new_high = high_value if high_value is not None else current_high
-            new_low = low_value if low_value is not None else current_low
+                new_high = high_value if high_value is not None else current_high
+                new_low = low_value if low_value is not None else current_low
 
-            if new_high is not None and new_low is not None and new_high <= new_low:
-                return jsonify({"error": f"Per {airport}: high_value deve essere > low_value (dopo merge)"}), 400
+                if new_high is not None and new_low is not None and new_high <= new_low:
+                    return jsonify({"error": f"Per {airport}: high_value deve essere > low_value (dopo merge)"}), 400
 
-            cursor.execute(
-                "UPDATE interests SET high_value = %s, low_value = %s WHERE email = %s AND airport = %s",
-                (new_high, new_low, email, airport)
-            )
-            updated.append(airport)
+                cursor.execute(
+                    "UPDATE interests SET high_value = %s, low_value = %s WHERE email = %s AND airport = %s",
+                    (new_high, new_low, email, airport)
+                )
+                updated.append(airport)
 
-        conn.commit()
+            conn.commit()
 
-        return jsonify({
-            "message": "Soglie aggiunte/aggiornate",
-            "updated_airports": updated,
-            "not_found": not_found,
-            "total_processed": len(thresholds)
-        }), 200
+            return jsonify({
+                "message": "Soglie aggiunte/aggiornate",
+                "updated_airports": updated,
+                "not_found": not_found,
+                "total_processed": len(thresholds)
+            }), 200
 
     except Error as e:
         print(f"Errore in add_thresholds: {e}")
         return jsonify({"error": "Errore database"}), 500
 
-    finally:
-        if conn:
-            conn.close()
-
 @app.route("/users/remove-thresholds", methods=["POST"])
 def remove_thresholds():
     data = request.get_json(silent=True) or {}
@@ -369,71 +231,66 @@ def remove_thresholds():
     if not user_exists(email):
         return jsonify({"error": "Utente inesistente nel User Manager"}), 404
 
-    conn = None
     updated = []
     not_found = []
 
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        for item in thresholds:
-            if not isinstance(item, dict):
-                return jsonify({"error": "Ogni elemento di 'thresholds' deve essere un oggetto"}), 400
+            for item in thresholds:
+                if not isinstance(item, dict):
+                    return jsonify({"error": "Ogni elemento di 'thresholds' deve essere un oggetto"}), 400
 
-            airport = item.get("airport")
-            remove_fields = item.get("remove")
+                airport = item.get("airport")
+                remove_fields = item.get("remove")
 
-            if not airport or not isinstance(airport, str) or not airport.strip():
-                return jsonify({"error": "Ogni elemento deve avere 'airport' valido"}), 400
-            airport = airport.strip()
+                if not airport or not isinstance(airport, str) or not airport.strip():
+                    return jsonify({"error": "Ogni elemento deve avere 'airport' valido"}), 400
+                airport = airport.strip()
 
-            if not isinstance(remove_fields, list) or not remove_fields:
-                return jsonify({"error": f"Per {airport}: il campo 'remove' deve essere una lista non vuota (es. ['high','low'])"}), 400
+                if not isinstance(remove_fields, list) or not remove_fields:
+                    return jsonify({"error": f"Per {airport}: il campo 'remove' deve essere una lista non vuota (es. ['high','low'])"}), 400
 
-            remove_set = set(remove_fields)
-            allowed = {"high", "low"}
-            if not remove_set.issubset(allowed):
-                return jsonify({"error": f"Per {airport}: 'remove' può contenere solo 'high' e/o 'low'"}), 400
+                remove_set = set(remove_fields)
+                allowed = {"high", "low"}
+                if not remove_set.issubset(allowed):
+                    return jsonify({"error": f"Per {airport}: 'remove' può contenere solo 'high' e/o 'low'"}), 400
 
-            cursor.execute(
-                "SELECT 1 FROM interests WHERE email = %s AND airport = %s",
-                (email, airport)
-            )
-            if cursor.fetchone() is None:
-                not_found.append(airport)
-                continue
+                cursor.execute(
+                    "SELECT 1 FROM interests WHERE email = %s AND airport = %s",
+                    (email, airport)
+                )
+                if cursor.fetchone() is None:
+                    not_found.append(airport)
+                    continue
 
-            sets = []
-            params = []
-            if "high" in remove_set:
-                sets.append("high_value = NULL")
-            if "low" in remove_set:
-                sets.append("low_value = NULL")
+                sets = []
+                params = []
+                if "high" in remove_set:
+                    sets.append("high_value = NULL")
+                if "low" in remove_set:
+                    sets.append("low_value = NULL")
 
-            query = f"UPDATE interests SET {', '.join(sets)} WHERE email = %s AND airport = %s"
-            params.extend([email, airport])
+                query = f"UPDATE interests SET {', '.join(sets)} WHERE email = %s AND airport = %s"
+                params.extend([email, airport])
 
-            cursor.execute(query, tuple(params))
-            updated.append(airport)
+                cursor.execute(query, tuple(params))
+                updated.append(airport)
 
-        conn.commit()
+            conn.commit()
 
-        return jsonify({
-            "message": "Soglie rimosse",
-            "updated_airports": updated,
-            "not_found": not_found,
-            "total_processed": len(thresholds)
-        }), 200
+            return jsonify({
+                "message": "Soglie rimosse",
+                "updated_airports": updated,
+                "not_found": not_found,
+                "total_processed": len(thresholds)
+            }), 200
 
     except Error as e:
         print(f"Errore in remove_thresholds: {e}")
         return jsonify({"error": "Errore database"}), 500
 
-    finally:
-        if conn:
-            conn.close()
-
 @app.route("/users/remove-interests", methods=["DELETE"])
 def remove_interests():
     data = request.get_json(silent=True) or {}
@@ -449,96 +306,214 @@ def remove_interests():
     if not user_exists(email):
         return jsonify({"error": "Utente inesistente nel User Manager"}), 404
 
-    conn = None
-
     removed_airports = []
 
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        for airport_code in airports:
-            cursor.execute(
-                "DELETE FROM interests WHERE email = %s AND airport = %s",
-                (email, airport_code)
-            )
+            for airport_code in airports:
+                cursor.execute(
+                    "DELETE FROM interests WHERE email = %s AND airport = %s",
+                    (email, airport_code)
+                )
 
-            if cursor.rowcount > 0:
-                removed_airports.append(airport_code)
+                if cursor.rowcount > 0:
+                    removed_airports.append(airport_code)
 
-        conn.commit()
+            conn.commit()
 
-        return jsonify({
-            "message": "Interessi rimossi",
-            "removed_airports": removed_airports,
-            "total_processed": len(airports)
-        }), 200
+            return jsonify({
+                "message": "Interessi rimossi",
+                "removed_airports": removed_airports,
+                "total_processed": len(airports)
+            }), 200
 
     except Error as e:
         print(f"Errore in remove_interests: {e}")
         return jsonify({"error": "Errore database"}), 500
 
-    finally:
-        if conn:
-            conn.close()
 ###NEW
 
 @app.route("/interests", methods=["GET"])
 def list_interests():
-    conn = None
-
     try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM interests")
-        interests = cursor.fetchall()
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM interests")
+            interests = cursor.fetchall()
 
-        return jsonify(interests), 200
+            return jsonify(interests), 200
 
     except Error as e:
         print(f"Errore in list_interests: {e}")
         return jsonify({"error": "Errore database"}), 500
 
-    finally:
-        if conn:
-            conn.close()
-
 @app.route("/flights", methods=["GET"])
 def list_flights():
-    conn = None
+    airport = request.args.get("airport")
+    direction = request.args.get("direction", "any")
+    token = request.args.get("cursor")
+
+    if "page" in request.args:
+        # la paginazione per offset è stata sostituita da quella a cursore:
+        # ignorare 'page' restituirebbe sempre la prima pagina
+        return jsonify({
+            "error": "'page' non è più supportato: usare 'cursor' con il valore 'next' della risposta precedente"
+        }), 400
 
     try:
-        page = int(request.args.get("page", 1))
         limit = int(request.args.get("limit", 50))
-        offset = (page - 1) * limit
+        since = parse_time(request.args.get("from"))
+        until = parse_time(request.args.get("to"))
+    except ValueError:
+        return jsonify({"error": "'limit' deve essere un intero, 'from'/'to' epoch o data ISO"}), 400
 
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
+    if limit < 1 or limit > FLIGHTS_PAGE_MAX_LIMIT:
+        return jsonify({"error": f"'limit' deve essere tra 1 e {FLIGHTS_PAGE_MAX_LIMIT}"}), 400
+    if direction not in DIRECTIONS:
+        return jsonify({"error": f"'direction' deve essere uno tra {', '.join(DIRECTIONS)}"}), 400
 
-        cursor.execute("SELECT COUNT(*) AS total FROM flights")
-        total = cursor.fetchone()["total"]
+    try:
+        after = decode_cursor(token) if token else None
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
 
-        cursor.execute(
-            "SELECT * FROM flights LIMIT %s OFFSET %s",
-            (limit, offset)
-        )
-        flights = cursor.fetchall()
+    conditions, params = build_filters(airport.strip().upper() if airport else None, direction, since, until)
 
-        return jsonify({
-            "page": page,
-            "limit": limit,
-            "count": len(flights),
-            "total": total,
-            "results": flights
-        }), 200
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+
+            total, estimate = total_cache.get(cursor, conditions, params)
+
+            query, query_params = page_query(conditions, params, after, limit)
+            cursor.execute(query, query_params)
+            flights = cursor.fetchall()
+
+            has_more = len(flights) > limit
+            flights = flights[:limit]
+
+            return jsonify({
+                "limit": limit,
+                "count": len(flights),
+                "total": total,
+                "total_is_estimate": estimate,
+                "next": encode_cursor(flights[-1]) if has_more else None,
+                "results": flights
+            }), 200
 
     except Error as e:
         print(f"Errore in list_flights: {e}")
         return jsonify({"error": "Errore database"}), 500
 
-    finally:
-        if conn:
-            conn.close()
+@app.route("/flights/export", methods=["GET"])
+def export_flights():
+    airport = request.args.get("airport")
+    direction = request.args.get("direction", "any")
+    fmt = request.args.get("format", "ndjson").lower()
+    compress = request.args.get("gzip", "false").lower() in ("1", "true")
+
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"'format' deve essere uno tra {', '.join(EXPORT_FORMATS)}"}), 400
+    if direction not in DIRECTIONS:
+        return jsonify({"error": f"'direction' deve essere uno tra {', '.join(DIRECTIONS)}"}), 400
+
+    try:
+        since = parse_time(request.args.get("from"))
+        until = parse_time(request.args.get("to"))
+    except ValueError:
+        return jsonify({"error": "'from'/'to' devono essere epoch o data ISO"}), 400
+
+    conditions, params = build_filters(airport.strip().upper() if airport else None, direction, since, until)
+
+    try:
+        conn, cursor = open_export(conditions, params)
+    except Error as e:
+        print(f"Errore in export_flights: {e}")
+        return jsonify({"error": "Errore database"}), 500
+
+    # con gzip=true si scarica un file .gz: niente Content-Encoding, che farebbe
+    # decomprimere il corpo al client lasciandolo sotto un nome .gz
+    response = Response(
+        stream_with_context(export_stream(conn, cursor, fmt, compress)),
+        mimetype="application/gzip" if compress else EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=flights.{fmt}{'.gz' if compress else ''}"},
+    )
+    # se il client se ne va prima che lo stream parta, la connessione torna comunque al pool
+    response.call_on_close(conn.close)
+    return response
+
+
+@app.route("/flights/snapshots", methods=["GET"])
+def flight_snapshots():
+    if not snapshots_available():
+        return jsonify({"error": "Snapshot Arrow non disponibili (pyarrow o FLIGHTS_SNAPSHOT_DIR mancanti)"}), 503
+    return jsonify({"snapshots": list_snapshots()}), 200
+
+
+@app.route("/flights/snapshots/<day>", methods=["GET"])
+def flight_snapshot(day):
+    if not snapshots_available():
+        return jsonify({"error": "Snapshot Arrow non disponibili (pyarrow o FLIGHTS_SNAPSHOT_DIR mancanti)"}), 503
+    try:
+        day = date.fromisoformat(day)
+    except ValueError:
+        return jsonify({"error": "Il giorno deve essere nel formato YYYY-MM-DD"}), 400
+
+    path = snapshot_path(day)
+    if not os.path.exists(path):
+        return jsonify({"error": f"Nessuno snapshot per il {day}"}), 404
+
+    airport = request.args.get("airport")
+    if not airport:
+        # file Arrow IPC così com'è: il client può mapparlo in memoria
+        return send_file(path, mimetype=ARROW_FILE_MIMETYPE, download_name=os.path.basename(path))
+
+    table = read_snapshot(day, airport.strip().upper())
+    return Response(table_to_stream(table).to_pybytes(), mimetype=ARROW_STREAM_MIMETYPE)
+
+
+def _interest_state(email, airport):
+    """
+    None se l'aeroporto non è di interesse dell'utente, altrimenti NOW() del
+    database e l'ultima modifica dei voli fatta fuori dall'ingestion (o None),
+    con cui le cache in memoria capiscono se rileggere l'aeroporto.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT NOW(), l.flights_changed_at
+            FROM interests i
+            LEFT JOIN airport_leases l ON l.airport = i.airport
+            WHERE i.email = %s AND i.airport = %s
+            """,
+            (email, airport)
+        )
+        return cursor.fetchone()
+
+
+def _latest_flight(cursor, airport_column, time_column, airport):
+    # il predicato su date_time_departure limita la ricerca alle partizioni
+    # recenti; solo se lì non c'è nulla si scende in tutta la tabella
+    query = f"""
+        SELECT *
+        FROM flights
+        WHERE {airport_column} = %s {{recent}}
+        ORDER BY {time_column} DESC
+            LIMIT 1;
+    """
+    cursor.execute(
+        query.format(recent="AND date_time_departure >= NOW() - INTERVAL %s DAY"),
+        (airport, LATEST_LOOKBACK_DAYS)
+    )
+    flight = cursor.fetchone()
+    if flight is None:
+        cursor.execute(query.format(recent=""), (airport,))
+        flight = cursor.fetchone()
+    return flight
+
 
 @app.route("/flights/latest", methods=["GET"])
 def latest_flights():
@@ -551,41 +526,30 @@ def latest_flights():
     if not user_exists(email):
         return jsonify({"error": "Utente inesistente nel User Manager"}), 404
 
-    conn = None
     try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute(
-            "SELECT 1 FROM interests WHERE email = %s AND airport = %s",
-            (email, airport)
-        )
-        exists = cursor.fetchone()
-
-        if not exists:
+        interest = _interest_state(email, airport)
+        if interest is None:
             return jsonify({"error": "L'aeroporto non è di interesse dell'utente"}), 404
-
-        cursor.execute("""
-                       SELECT *
-                       FROM flights
-                       WHERE arrival_airport = %s
-                       ORDER BY date_time_arrival DESC
-                           LIMIT 1;
-                       """, (airport,))
-        latest_arrival = cursor.fetchone()
-
-        cursor.execute("""
-                       SELECT *
-                       FROM flights
-                       WHERE departure_airport = %s
-                       ORDER BY date_time_departure DESC
-                           LIMIT 1;
-                       """, (airport,))
-        latest_departure = cursor.fetchone()
+        checked_at, changed_at = interest
+
+        latest = latest_cache.get(airport, changed_at)
+        if latest is None:
+            latest = hot_window.latest(airport, changed_at) or {}
+            if latest.get("arrival") is None or latest.get("departure") is None:
+                with db_connection() as conn:
+                    cursor = conn.cursor(dictionary=True)
+                    latest = {
+                        "arrival": latest.get("arrival") or _latest_flight(
+                            cursor, "arrival_airport", "date_time_arrival", airport),
+                        "departure": latest.get("departure") or _latest_flight(
+                            cursor, "departure_airport", "date_time_departure", airport),
+                    }
+            # cache fredda: da qui in poi la voce resta aggiornata dal writer dei voli
+            latest = latest_cache.fill(airport, latest, checked_at)
 
         return jsonify({
-            "arrival": latest_arrival,
-            "departure": latest_departure
+            "arrival": latest["arrival"],
+            "departure": latest["departure"]
         }), 200
 
     except Error as db_error:
@@ -594,9 +558,70 @@ def latest_flights():
     except Exception as e:
         return jsonify({"error": f"Errore interno: {e}"}), 500
 
-    finally:
-        if conn:
-            conn.close()
+def _parse_days(value):
+    """'7' oppure una lista di finestre come '1,7,30'."""
+    windows = [int(part) for part in value.split(",") if part.strip()]
+    if not windows:
+        raise ValueError(value)
+    return windows
+
+
+def _average_payload(airport, days, summary):
+    return {
+        "airport": airport,
+        "days": days,
+        "arrivals": {
+            "total": summary["arrivals"],
+            "average_per_day": summary["arrivals"] / days if days > 0 else 0
+        },
+        "departures": {
+            "total": summary["departures"],
+            "average_per_day": summary["departures"] / days if days > 0 else 0
+        }
+    }
+
+
+def _stats_payload(airport, days, summary):
+    busiest_day = summary["busiest_day"]
+    busiest_hour = summary["busiest_hour"]
+    return {
+        "airport": airport,
+        "days": days,
+        "totals": {
+            "arrivals": summary["arrivals"],
+            "departures": summary["departures"]
+        },
+        "busiest_day": {
+            "day": busiest_day[0] if busiest_day else None,
+            "flights": busiest_day[1] if busiest_day else None
+        },
+        "busiest_hour": {
+            "hour": busiest_hour[0] if busiest_hour else None,
+            "flights": busiest_hour[1] if busiest_hour else None
+        }
+    }
+
+
+def _rollup_response(airport, windows, email, build_payload):
+    """
+    Statistiche servite dalla finestra in memoria se copre l'aeroporto e le
+    finestre richieste, altrimenti dal rollup orario (una sola lettura).
+    """
+    interest = _interest_state(email, airport)
+    if interest is None:
+        return jsonify({"error": "L'aeroporto non è di interesse dell'utente"}), 404
+
+    summaries = hot_window.summaries(airport, windows, changed_at=interest[1])
+    if summaries is None:
+        with db_connection() as conn:
+            now, hourly = load_hourly(conn.cursor(), airport, max(max(windows), 0))
+        summaries = [summarize(hourly, now, days) for days in windows]
+
+    payloads = [build_payload(airport, days, summary) for days, summary in zip(windows, summaries)]
+    if len(payloads) == 1:
+        return jsonify(payloads[0]), 200
+    return jsonify({"airport": airport, "windows": payloads}), 200
+
 
 @app.route("/flights/avg", methods=["GET"])
 def flights_average():
@@ -611,54 +636,12 @@ def flights_average():
         return jsonify({"error": "Utente inesistente nel User Manager"}), 404
 
     try:
-        days = int(days)
+        windows = _parse_days(days)
     except ValueError:
-        return jsonify({"error": "'days' deve essere un numero intero"}), 400
+        return jsonify({"error": "'days' deve essere un numero intero o una lista come 1,7,30"}), 400
 
-    conn = None
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "SELECT 1 FROM interests WHERE email = %s AND airport = %s",
-            (email, airport)
-        )
-        exists = cursor.fetchone()
-
-        if not exists:
-            return jsonify({"error": "L'aeroporto non è di interesse dell'utente"}), 404
-
-        cursor.execute("""
-                       SELECT COUNT(*)
-                       FROM flights
-                       WHERE arrival_airport = %s
-                         AND date_time_arrival >= NOW() - INTERVAL %s DAY
-                       """, (airport, days))
-        total_arrivals = cursor.fetchone()[0]
-        avg_arrivals = total_arrivals / days if days > 0 else 0
-
-        cursor.execute("""
-                       SELECT COUNT(*)
-                       FROM flights
-                       WHERE departure_airport = %s
-                         AND date_time_departure >= NOW() - INTERVAL %s DAY
-                       """, (airport, days))
-        total_departures = cursor.fetchone()[0]
-        avg_departures = total_departures / days if days > 0 else 0
-
-        return jsonify({
-            "airport": airport,
-            "days": days,
-            "arrivals": {
-                "total": total_arrivals,
-                "average_per_day": avg_arrivals
-            },
-            "departures": {
-                "total": total_departures,
-                "average_per_day": avg_departures
-            }
-        }), 200
+        return _rollup_response(airport, windows, email, _average_payload)
 
     except Error as e:
         print("Errore flights-average:", e)
@@ -668,10 +651,6 @@ def flights_average():
         print("Errore imprevisto flights-average:", e)
         return jsonify({"error": f"Errore interno: {e}"}), 500
 
-    finally:
-        if conn:
-            conn.close()
-
 @app.route("/flights/stats", methods=["GET"])
 def flight_stats():
     airport = request.args.get("airport")
@@ -685,143 +664,131 @@ def flight_stats():
         return jsonify({"error": "Utente inesistente nel User Manager"}), 404
 
     try:
-        days = int(days)
+        windows = _parse_days(days)
     except ValueError:
-        return jsonify({"error": "'days' deve essere un numero intero"}), 400
+        return jsonify({"error": "'days' deve essere un numero intero o una lista come 1,7,30"}), 400
 
-    conn = None
     try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(
-            "SELECT 1 FROM interests WHERE email = %s AND airport = %s",
-            (email, airport)
-        )
-        exists = cursor.fetchone()
+        return _rollup_response(airport, windows, email, _stats_payload)
 
-        if not exists:
-            conn.close()
-            return jsonify({"error": "L'aeroporto non è di interesse dell'utente"}), 404
+    except Error as e:
+        print("[DB ERROR flight_stats]", e)
+        return jsonify({"error": "Errore database"}), 500
 
-        cursor.execute("""
-                       SELECT COUNT(*) AS total_arrivals
-                       FROM flights
-                       WHERE arrival_airport = %s
-                         AND date_time_arrival >= NOW() - INTERVAL %s DAY
-                       """, (airport, days))
-        total_arrivals = cursor.fetchone()["total_arrivals"]
-
-        cursor.execute("""
-                       SELECT COUNT(*) AS total_departures
-                       FROM flights
-                       WHERE departure_airport = %s
-                         AND date_time_departure >= NOW() - INTERVAL %s DAY
-                       """, (airport, days))
-        total_departures = cursor.fetchone()["total_departures"]
-
-        cursor.execute("""
-                       SELECT DATE(date_time_arrival) AS day,
-                           COUNT(*) AS num_flights
-                       FROM flights
-                       WHERE arrival_airport = %s
-                         AND date_time_arrival >= NOW() - INTERVAL %s DAY
-                       GROUP BY day
-
-                       UNION ALL
-
-                       SELECT DATE(date_time_departure) AS day,
-                           COUNT(*) AS num_flights
-                       FROM flights
-                       WHERE departure_airport = %s
-                         AND date_time_departure >= NOW() - INTERVAL %s DAY
-                       GROUP BY day
-                       """, (airport, days, airport, days))
-
-        day_counts = cursor.fetchall()
-
-        busiest_day = None
-        if day_counts:
-            day_map = {}
-            for row in day_counts:
-                day = str(row["day"])
-                day_map[day] = day_map.get(day, 0) + row["num_flights"]
-
-            busiest_day = max(day_map.items(), key=lambda x: x[1])
-
-        cursor.execute("""
-                       SELECT HOUR(date_time_arrival) AS hour, COUNT(*) AS flights
-                       FROM flights
-                       WHERE arrival_airport = %s
-                         AND date_time_arrival >= NOW() - INTERVAL %s DAY
-                       GROUP BY hour
-
-                       UNION ALL
-
-                       SELECT HOUR(date_time_departure) AS hour, COUNT(*) AS flights
-                       FROM flights
-                       WHERE departure_airport = %s
-                         AND date_time_departure >= NOW() - INTERVAL %s DAY
-                       GROUP BY hour
-                       """, (airport, days, airport, days))
-
-        hour_counts = cursor.fetchall()
-
-        busiest_hour = None
-        if hour_counts:
-            hour_map = {}
-            for row in hour_counts:
-                hour = int(row["hour"])
-                hour_map[hour] = hour_map.get(hour, 0) + row["flights"]
-
-            busiest_hour = max(hour_map.items(), key=lambda x: x[1])
-
-        conn.close()
+@app.route("/flights/backfill", methods=["GET"])
+def backfill_status():
+    airport = request.args.get("airport")
 
-        return jsonify({
-            "airport": airport,
-            "days": days,
-            "totals": {
-                "arrivals": total_arrivals,
-                "departures": total_departures
-            },
-            "busiest_day": {
-                "day": busiest_day[0] if busiest_day else None,
-                "flights": busiest_day[1] if busiest_day else None
-            },
-            "busiest_hour": {
-                "hour": busiest_hour[0] if busiest_hour else None,
-                "flights": busiest_hour[1] if busiest_hour else None
-            }
-        }), 200
+    status = get_backfill_status(airport)
+    if airport and status is None:
+        return jsonify({"error": f"Nessun backfill per {airport}"}), 404
+
+    return jsonify(status), 200
+
+@app.route("/flights/backfill", methods=["POST"])
+def backfill_start():
+    data = request.get_json(silent=True) or {}
+    airport = data.get("airport")
+    days = data.get("days", BACKFILL_DAYS)
+
+    if not INGESTION_ENABLED:
+        # le repliche solo HTTP non devono consumare crediti OpenSky
+        return jsonify({"error": "Ingestion disabilitata su questa replica"}), 503
 
+    if not airport or not isinstance(airport, str) or not airport.strip():
+        return jsonify({"error": "Il campo 'airport' è obbligatorio"}), 400
+
+    airport = airport.strip().upper()
+    if not ICAO_CODE_RE.match(airport):
+        return jsonify({"error": f"Codice ICAO non valido: {airport}"}), 400
+
+    if not isinstance(days, int) or isinstance(days, bool) or not 0 < days <= BACKFILL_MAX_DAYS:
+        return jsonify({"error": f"'days' deve essere un intero tra 1 e {BACKFILL_MAX_DAYS}"}), 400
+
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM interests WHERE airport = %s LIMIT 1", (airport,))
+            if not cursor.fetchone():
+                return jsonify({"error": f"Nessun utente interessato a {airport}"}), 404
     except Error as e:
-        print("[DB ERROR flight_stats]", e)
+        print(f"Errore in backfill_start: {e}")
         return jsonify({"error": "Errore database"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+    job = start_backfill(airport, days)
+    return jsonify(job.to_dict()), 202
+
+@app.route("/scheduler/queue", methods=["GET"])
+def scheduler_queue():
+    return jsonify(airport_scheduler.snapshot()), 200
+
+@app.route("/scheduler/leases", methods=["GET"])
+def scheduler_leases():
+    snapshot = lease_manager.snapshot()
+    snapshot["ingestion_enabled"] = INGESTION_ENABLED
+    return jsonify(snapshot), 200
 
 @app.route("/health", methods=["GET"])
 def health():
     return {"status": "ok"}, 200
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify({
+        "db_pool": pool.stats(),
+        "opensky_rate_limiter": opensky_rate_limiter.stats(),
+        "circuit_breakers": breaker_registry.stats(),
+        "opensky_token": token_manager.stats(),
+        "fetch_strategy": strategy_stats(),
+        "response_journal": journal.stats(),
+        "flights_dedup_history": recent_flights.stats() if recent_flights else None,
+        "flights_snapshots": snapshot_scheduler.stats(),
+        "flights_hot_window": hot_window.stats(),
+        "flights_latest_cache": latest_cache.stats()
+    }), 200
+
 if __name__ == "__main__":
     init_db()
-
-    scheduler = BackgroundScheduler()
-
-    scheduler.add_job(
-        get_open_sky_data,
-        'interval',
-        hours=12,
-        id='opensky_data_processing',
-        replace_existing=True
-    )
-    scheduler.start()
-    print("Scheduler APS avviato. Job di aggiornamento OpenSky pianificato ogni 12 ore.")
-
-    get_token()
-    get_open_sky_data()
+    maintain_partitions()
+    rebuild_rollup(only_if_empty=True)
+
+    if INGESTION_ENABLED:
+        scheduler = BackgroundScheduler()
+
+        lease_heartbeat()
+        hot_window.load(lease_manager.owned_airports())
+        get_token()
+        refresh_airports(sorted(lease_manager.owned_airports()))
+        airport_scheduler.sync()
+        snapshot_scheduler.schedule_missing()
+
+        scheduler.add_job(
+            lease_heartbeat,
+            'interval',
+            seconds=LEASE_HEARTBEAT_SECONDS,
+            id='lease_heartbeat',
+            replace_existing=True
+        )
+        scheduler.add_job(
+            airport_scheduler.tick,
+            'interval',
+            seconds=SCHEDULER_TICK_SECONDS,
+            id='opensky_data_processing',
+            replace_existing=True
+        )
+        scheduler.add_job(
+            maintain_partitions,
+            'interval',
+            hours=PARTITION_MAINTENANCE_HOURS,
+            id='flights_partition_maintenance',
+            replace_existing=True
+        )
+        scheduler.start()
+        atexit.register(lease_manager.release_all)
+        print(f"Scheduler APS avviato (replica {lease_manager.replica_id}). "
+              f"Coda per aeroporto controllata ogni {SCHEDULER_TICK_SECONDS} secondi.")
+    else:
+        print("Ingestion disabilitata: la replica serve solo le API HTTP.")
 
     listen_port = int(os.getenv("LISTEN_PORT", "5002"))
     app.run(host="0.0.0.0", port=listen_port)
\ No newline at end of file
@@ -0,0 +1,156 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from mysql.connector import Error
+
+from db import db_connection
+from fetch_engine import FetchTask, FLIGHT_TYPES, run_task
+from flights_writer import save_flights_to_db
+from ingestion_checkpoints import DAY_SECONDS, default_start, ingestion_horizon, split_window
+from open_sky_token import get_token
+from rate_limiter import TokenBucket
+from work_leases import mark_flights_changed
+
+BACKFILL_DAYS = int(os.getenv("BACKFILL_DAYS", "30"))
+# Limite ai giorni richiesti via API: ogni giorno costa due richieste OpenSky.
+BACKFILL_MAX_DAYS = int(os.getenv("BACKFILL_MAX_DAYS", "90"))
+BACKFILL_CONCURRENCY = max(1, int(os.getenv("BACKFILL_CONCURRENCY", "4")))
+# Quota dei backfill dentro il limiter OpenSky globale, per non affamare
+# l'ingestion incrementale.
+BACKFILL_REQUESTS_PER_MINUTE = float(os.getenv("BACKFILL_REQUESTS_PER_MINUTE", "30"))
+
+
+class BackfillJob:
+    def __init__(self, airport, begin, end, tasks):
+        self.airport = airport
+        self.begin = begin
+        self.end = end
+        self.tasks = tasks
+        self.state = "QUEUED"
+        self.done = 0
+        self.failed = 0
+        self.inserted = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        total = len(self.tasks)
+        return {
+            "airport": self.airport,
+            "state": self.state,
+            "from": datetime.fromtimestamp(self.begin).isoformat(),
+            "to": datetime.fromtimestamp(self.end).isoformat(),
+            "windows_total": total,
+            "windows_done": self.done,
+            "windows_failed": self.failed,
+            "progress": round((self.done + self.failed) / total, 3) if total else 1.0,
+            "inserted_flights": self.inserted,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+_budget = TokenBucket(BACKFILL_REQUESTS_PER_MINUTE / 60.0, capacity=1)
+# Pool condiviso: la concorrenza è globale, non per singolo aeroporto.
+_executor = ThreadPoolExecutor(max_workers=BACKFILL_CONCURRENCY, thread_name_prefix="backfill")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _fetch_window(task, access_token):
+    _budget.acquire()
+    return run_task(task, access_token)
+
+
+def _run_job(job):
+    job.state = "RUNNING"
+    job.started_at = datetime.now().isoformat()
+
+    access_token = get_token()
+    if not access_token:
+        print(f"Backfill {job.airport}: impossibile ottenere il token.")
+        job.state = "FAILED"
+        job.finished_at = datetime.now().isoformat()
+        return
+
+    futures = {_executor.submit(_fetch_window, task, access_token): task for task in job.tasks}
+    for future in as_completed(futures):
+        flights = future.result()
+        if flights is None:
+            job.failed += 1
+            continue
+        if flights:
+            inserted = save_flights_to_db(flights)
+            if inserted:
+                # la replica che ingerisce l'aeroporto può essere un'altra
+                mark_flights_changed([job.airport])
+            job.inserted += inserted
+        job.done += 1
+
+    job.state = "DONE" if job.failed == 0 else "PARTIAL"
+    job.finished_at = datetime.now().isoformat()
+    print(f"Backfill {job.airport} completato: {job.inserted} nuovi voli, {job.failed} finestre fallite.")
+
+
+def start_backfill(airport, days=BACKFILL_DAYS):
+    """
+    Avvia in background il recupero degli ultimi `days` giorni per un aeroporto.
+    Il backfill si ferma dove inizia l'ingestion incrementale (ieri), quindi le
+    due non si sovrappongono. Restituisce il job, oppure quello già in corso.
+    """
+    with _jobs_lock:
+        current = _jobs.get(airport)
+        if current and current.state in ("QUEUED", "RUNNING"):
+            return current
+
+        end = default_start(ingestion_horizon())
+        begin = end - days * DAY_SECONDS
+        tasks = [
+            FetchTask(airport, flight_type, w_begin, w_end)
+            for w_begin, w_end in split_window(begin, end, DAY_SECONDS)
+            for flight_type in FLIGHT_TYPES
+        ]
+        job = BackfillJob(airport, begin, end, tasks)
+        _jobs[airport] = job
+
+    threading.Thread(target=_run_job, args=(job,), name=f"backfill-{airport}", daemon=True).start()
+    return job
+
+
+def backfill_new_airports(airports):
+    """
+    Avvia il backfill degli aeroporti appena presi in carico da questa replica
+    che non sono mai stati ingeriti (nessun checkpoint): è la replica
+    proprietaria del lease a spendere i crediti OpenSky, una volta sola, e
+    non quella che ha ricevuto l'interesse via HTTP.
+    """
+    airports = sorted(set(airports))
+    if not airports:
+        return []
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT DISTINCT airport FROM ingestion_checkpoints "
+                f"WHERE airport IN ({', '.join(['%s'] * len(airports))})",
+                airports
+            )
+            ingested = {row[0] for row in cursor.fetchall()}
+    except Error as e:
+        # senza sapere quali sono nuovi meglio non spendere crediti: si riprova al prossimo lease
+        print(f"Errore database nel controllo dei backfill da avviare: {e}")
+        return []
+
+    started = [airport for airport in airports if airport not in ingested]
+    for airport in started:
+        start_backfill(airport)
+    return started
+
+
+def get_backfill_status(airport=None):
+    with _jobs_lock:
+        if airport:
+            job = _jobs.get(airport)
+            return job.to_dict() if job else None
+        return [job.to_dict() for job in _jobs.values()]
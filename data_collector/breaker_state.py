@@ -0,0 +1,93 @@
+import os
+from db import db_connection
+from circuit_breaker import InMemoryBreakerState
+
+# Backend dello stato condiviso dei circuit breaker: "mysql", "memory" o vuoto (solo locale).
+CB_SHARED_STATE = os.getenv("CB_SHARED_STATE", "").lower()
+
+
+class MySQLBreakerState:
+    """
+    Stato dei circuit breaker condiviso tra le repliche tramite la tabella
+    circuit_breaker_state: una replica che apre il circuito lo apre per tutte,
+    e la sonda half-open è un lease acquisito con un UPDATE condizionale,
+    quindi una sola replica alla volta interroga di nuovo OpenSky.
+    Tutti gli istanti usano l'orologio di MySQL, come i lease degli aeroporti:
+    lo sfasamento tra gli orologi delle repliche non conta.
+    """
+
+    def get(self, name):
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                """
+                SELECT state, opened_at, probe_owner, probe_expires,
+                       UNIX_TIMESTAMP(NOW(6)) - opened_at AS open_for
+                FROM circuit_breaker_state
+                WHERE name = %s
+                """,
+                (name,)
+            )
+            return cursor.fetchone()
+
+    def open(self, name):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO circuit_breaker_state (name, state, opened_at) VALUES (%s, 'OPEN', UNIX_TIMESTAMP(NOW(6)))
+                ON DUPLICATE KEY UPDATE
+                    state = 'OPEN', opened_at = VALUES(opened_at), probe_owner = NULL, probe_expires = NULL
+                """,
+                (name,)
+            )
+            conn.commit()
+
+    def close(self, name):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE circuit_breaker_state
+                SET state = 'CLOSED', opened_at = NULL, probe_owner = NULL, probe_expires = NULL
+                WHERE name = %s
+                """,
+                (name,)
+            )
+            conn.commit()
+
+    def try_acquire_probe(self, name, owner, ttl):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE circuit_breaker_state
+                SET probe_owner = %s, probe_expires = UNIX_TIMESTAMP(NOW(6)) + %s
+                WHERE name = %s AND state = 'OPEN'
+                  AND (probe_owner IS NULL OR probe_expires < UNIX_TIMESTAMP(NOW(6)))
+                """,
+                (owner, ttl, name)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def release_probe(self, name, owner):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE circuit_breaker_state SET probe_owner = NULL, probe_expires = NULL "
+                "WHERE name = %s AND probe_owner = %s",
+                (name, owner)
+            )
+            conn.commit()
+
+
+def shared_state_backend():
+    if CB_SHARED_STATE == "mysql":
+        return MySQLBreakerState()
+    if CB_SHARED_STATE == "memory":
+        return InMemoryBreakerState()
+    return None
+
+
+shared_breaker_state = shared_state_backend()
@@ -1,5 +1,8 @@
+import random
 import time
 import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
 
 
 class CircuitBreakerOpenException(Exception):
@@ -7,6 +10,93 @@ class CircuitBreakerOpenException(Exception):
     pass
 
 
+class RetryPolicy:
+    """
+    Retries a call with exponential backoff and full jitter.
+
+    Exceptions carrying an HTTP response (e.g. requests.HTTPError) are retried
+    only for the statuses in retry_on_status, honoring Retry-After when the
+    server sends it; other exceptions matching retry_on (timeouts, connection
+    errors) are always retried. When used inside a CircuitBreaker only the
+    final outcome reaches the breaker.
+    """
+
+    def __init__(
+            self,
+            max_attempts: int = 3,
+            base_delay: float = 1.0,
+            max_delay: float = 30.0,
+            multiplier: float = 2.0,
+            jitter: bool = True,
+            retry_on=Exception,
+            retry_on_status=(429, 500, 502, 503, 504),
+            max_retry_after: float = 60.0,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.retry_on = retry_on
+        self.retry_on_status = set(retry_on_status)
+        self.max_retry_after = max_retry_after
+
+    @staticmethod
+    def _response(exc):
+        return getattr(exc, "response", None)
+
+    def should_retry(self, exc):
+        response = self._response(exc)
+        if response is not None:
+            return response.status_code in self.retry_on_status
+        return True
+
+    def retry_after(self, exc):
+        response = self._response(exc)
+        if response is None:
+            return None
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(seconds, 0.0), self.max_retry_after)
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** (attempt - 1)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def max_duration(self, call_timeout):
+        """Upper bound (seconds) of execute() when every attempt runs for call_timeout."""
+        waits = (self.max_attempts - 1) * max(self.max_delay, self.max_retry_after)
+        return self.max_attempts * call_timeout + waits
+
+    def execute(self, func, *args, **kwargs):
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except self.retry_on as exc:
+                if attempt >= self.max_attempts or not self.should_retry(exc):
+                    raise
+                delay = self.retry_after(exc)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                time.sleep(delay)
+                attempt += 1
+
+
+# Upper bounds (seconds) of the call latency histogram buckets; the last one is +Inf.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, float("inf"))
+
+
 class CircuitBreaker:
     def __init__(
             self,
@@ -15,21 +105,129 @@ class CircuitBreaker:
             expected_exception=Exception,
             half_open_max_calls: int = 1,
             fallback=None,
+            retry_policy: RetryPolicy = None,
+            name: str = None,
+            history_size: int = 50,
+            shared_state=None,
+            shared_owner: str = None,
+            shared_cache_ttl: float = 1.0,
+            shared_probe_ttl: float = None,
     ):
+        self.name = name
+        # optional backend shared by all replicas (see InMemoryBreakerState)
+        self.shared_state = shared_state
+        self.shared_owner = shared_owner
+        self.shared_cache_ttl = shared_cache_ttl
+        # the cluster-wide probe lease must outlive the longest probe call (retries included),
+        # otherwise another replica takes over while the first probe is still running
+        self.shared_probe_ttl = shared_probe_ttl if shared_probe_ttl is not None else recovery_timeout
+        self._shared_cache = None
         self.failure_threshold = failure_threshold
         self.recovery_timeout = recovery_timeout
         self.expected_exception = expected_exception
         self.half_open_max_calls = half_open_max_calls
         self.fallback = fallback
+        self.retry_policy = retry_policy
 
         self.failure_count = 0
         self.last_failure_time = None
         self.state = "CLOSED"
 
+        self.transitions = deque(maxlen=history_size)
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+
         self._half_open_in_flight = 0
         self.lock = threading.Lock()
 
+    def _set_state(self, new_state):
+        # caller must hold self.lock
+        if new_state != self.state:
+            self.transitions.append({
+                "at": time.time(),
+                "from": self.state,
+                "to": new_state,
+                "failure_count": self.failure_count,
+            })
+            self.state = new_state
+
+    def _observe_latency(self, seconds):
+        # caller must hold self.lock
+        self.latency_sum += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+                break
+
+    def _shared(self, op, *args):
+        # the shared backend is best effort: if it is unreachable the breaker keeps working locally
+        try:
+            return op(*args)
+        except Exception as e:
+            print(f"[CircuitBreaker {self.name}] shared state unavailable: {e}")
+            return None
+
+    def _shared_record(self):
+        now = time.monotonic()
+        if self._shared_cache is not None and now - self._shared_cache[0] < self.shared_cache_ttl:
+            return self._shared_cache[1]
+        record = self._shared(self.shared_state.get, self.name)
+        self._shared_cache = (now, record)
+        return record
+
+    def _check_shared_state(self):
+        """
+        Applies the state published by other replicas before a call.
+        Returns True when this call is the (single, cluster-wide) half-open probe.
+        """
+        record = self._shared_record()
+        if not record or record.get("state") != "OPEN":
+            return False
+
+        # open_for is measured by the backend's clock, so replica clock skew does not matter
+        open_for = record.get("open_for")
+        open_for = float(open_for) if open_for is not None else float("inf")
+        if open_for < self.recovery_timeout:
+            with self.lock:
+                if self.state == "CLOSED":
+                    self.last_failure_time = time.time() - open_for
+                    self._set_state("OPEN")
+                self.rejected += 1
+            raise CircuitBreakerOpenException("Circuit is OPEN on another replica. Call denied.")
+
+        acquired = self._shared(
+            self.shared_state.try_acquire_probe, self.name, self.shared_owner, self.shared_probe_ttl
+        )
+        if acquired is None:
+            # backend unreachable: fall back to the local half-open logic
+            return False
+        if acquired:
+            return True
+        with self.lock:
+            self.rejected += 1
+        raise CircuitBreakerOpenException("Circuit is HALF_OPEN, another replica is probing. Call denied.")
+
     def call(self, func, *args, **kwargs):
+        shared_probe = False
+        if self.shared_state is not None:
+            try:
+                shared_probe = self._check_shared_state()
+            except CircuitBreakerOpenException:
+                if self.fallback is not None:
+                    return self.fallback(*args, **kwargs)
+                raise
+
+        try:
+            return self._call(func, shared_probe, *args, **kwargs)
+        finally:
+            if shared_probe:
+                self._shared(self.shared_state.release_probe, self.name, self.shared_owner)
+
+    def _call(self, func, shared_probe, *args, **kwargs):
         with self.lock:
             if self.state == "OPEN":
                 if self.last_failure_time is not None:
@@ -38,15 +236,17 @@ class CircuitBreaker:
                     elapsed = 0
 
                 if elapsed >= self.recovery_timeout:
-                    self.state = "HALF_OPEN"
+                    self._set_state("HALF_OPEN")
                     self._half_open_in_flight = 0
                 else:
+                    self.rejected += 1
                     if self.fallback is not None:
                         return self.fallback(*args, **kwargs)
                     raise CircuitBreakerOpenException("Circuit is OPEN. Call denied.")
 
             if self.state == "HALF_OPEN":
                 if self._half_open_in_flight >= self.half_open_max_calls:
+                    self.rejected += 1
                     if self.fallback is not None:
                         return self.fallback(*args, **kwargs)
                     raise CircuitBreakerOpenException("Circuit is HALF_OPEN (no slots). Call denied.")
@@ -55,32 +255,152 @@ class CircuitBreaker:
             else:
                 took_slot = False
 
+            self.calls += 1
+
+        started = time.monotonic()
         try:
-            result = func(*args, **kwargs)
+            if self.retry_policy is not None:
+                result = self.retry_policy.execute(func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
         except self.expected_exception:
             with self.lock:
+                self.failures += 1
                 self.failure_count += 1
                 self.last_failure_time = time.time()
 
-                if self.state == "HALF_OPEN":
-                    self.state = "OPEN"
+                if self.state == "HALF_OPEN" or shared_probe:
+                    self._set_state("OPEN")
                     self._half_open_in_flight = 0
                 elif self.failure_count >= self.failure_threshold:
-                    self.state = "OPEN"
+                    self._set_state("OPEN")
+                opened = self.state == "OPEN"
+            if opened and self.shared_state is not None:
+                self._shared(self.shared_state.open, self.name)
+                self._shared_cache = None
             raise
         else:
             with self.lock:
+                self.successes += 1
+                closed = self.state == "HALF_OPEN" or shared_probe
                 if self.state == "HALF_OPEN":
-                    self.state = "CLOSED"
+                    self._set_state("CLOSED")
                     self.failure_count = 0
                     self.last_failure_time = None
                     self._half_open_in_flight = 0
                 else:
                     self.failure_count = 0
+            if closed and self.shared_state is not None:
+                self._shared(self.shared_state.close, self.name)
+                self._shared_cache = None
             return result
 
         finally:
-            if took_slot:
-                with self.lock:
-                    if self._half_open_in_flight > 0:
-                        self._half_open_in_flight -= 1
+            with self.lock:
+                self._observe_latency(time.monotonic() - started)
+                if took_slot and self._half_open_in_flight > 0:
+                    self._half_open_in_flight -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "failure_count": self.failure_count,
+                "failure_threshold": self.failure_threshold,
+                "recovery_timeout": self.recovery_timeout,
+                "last_failure_time": self.last_failure_time,
+                "calls": self.calls,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "latency_seconds": {
+                    "buckets": {
+                        ("+Inf" if bound == float("inf") else str(bound)): count
+                        for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)
+                    },
+                    "count": sum(self.latency_buckets),
+                    "sum": round(self.latency_sum, 6),
+                },
+                "transitions": list(self.transitions),
+                "shared_state": type(self.shared_state).__name__ if self.shared_state is not None else None,
+            }
+
+
+class InMemoryBreakerState:
+    """
+    Shared-state backend kept in process memory.
+
+    Stand-in for a real key-value store: breakers sharing one instance behave
+    like replicas sharing a database row. Records are dicts with state,
+    opened_at, probe_owner and probe_expires; get() adds open_for, the
+    seconds since opened_at by the backend's own clock.
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            record = self._records.get(name)
+            if not record:
+                return None
+            record = dict(record)
+            record["open_for"] = time.time() - record["opened_at"] if record["opened_at"] is not None else None
+            return record
+
+    def open(self, name):
+        with self._lock:
+            self._records[name] = {
+                "state": "OPEN", "opened_at": time.time(), "probe_owner": None, "probe_expires": None,
+            }
+
+    def close(self, name):
+        with self._lock:
+            self._records[name] = {
+                "state": "CLOSED", "opened_at": None, "probe_owner": None, "probe_expires": None,
+            }
+
+    def try_acquire_probe(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            record = self._records.get(name)
+            if not record or record["state"] != "OPEN":
+                return False
+            if record["probe_owner"] is not None and record["probe_expires"] > now:
+                return False
+            record["probe_owner"] = owner
+            record["probe_expires"] = now + ttl
+            return True
+
+    def release_probe(self, name, owner):
+        with self._lock:
+            record = self._records.get(name)
+            if record and record["probe_owner"] == owner:
+                record["probe_owner"] = None
+                record["probe_expires"] = None
+
+
+class CircuitBreakerRegistry:
+    """Named CircuitBreaker instances, created on first use with the given settings."""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, **kwargs):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name=name, **kwargs)
+                self._breakers[name] = breaker
+            return breaker
+
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+registry = CircuitBreakerRegistry()
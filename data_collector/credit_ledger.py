@@ -0,0 +1,42 @@
+import os
+from db import db_connection
+
+# Con più repliche i crediti giornalieri sono dell'account OpenSky, non della
+# replica: "true" li conta nella tabella opensky_credits, "false" solo in memoria.
+OPENSKY_CREDITS_SHARED = os.getenv("OPENSKY_CREDITS_SHARED", "true").lower() == "true"
+
+
+class MySQLCreditLedger:
+    """
+    Crediti OpenSky spesi oggi da tutte le repliche, una riga per giorno UTC.
+
+    Il giorno è UTC_DATE() di MySQL, come l'azzeramento di OpenSky, e
+    l'addebito è un UPDATE condizionale: due repliche non possono superare
+    insieme il budget giornaliero.
+    """
+
+    def charge(self, credits, limit):
+        """Addebita `credits` se restano nel budget `limit`; restituisce True se concessi."""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT IGNORE INTO opensky_credits (day, credits_used) VALUES (UTC_DATE(), 0)")
+            cursor.execute(
+                """
+                UPDATE opensky_credits SET credits_used = credits_used + %s
+                WHERE day = UTC_DATE() AND credits_used + %s <= %s
+                """,
+                (credits, credits, limit)
+            )
+            granted = cursor.rowcount == 1
+            conn.commit()
+            return granted
+
+    def used(self):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT credits_used FROM opensky_credits WHERE day = UTC_DATE()")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+
+
+credit_ledger = MySQLCreditLedger() if OPENSKY_CREDITS_SHARED else None
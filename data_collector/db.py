@@ -1,7 +1,13 @@
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 import mysql.connector
 from mysql.connector import Error
-import time
+from mysql.connector.errors import PoolError
+from migrations import migrate
+from flight_partitions import maintain_flight_partitions
 
 # Leggo i parametri dal docker-compose, ma metto anche un DEFAULT
 # così il codice funziona anche se lanciato fuori da Docker.
@@ -12,7 +18,14 @@ DB_NAME = os.getenv("DB_NAME", "data_db")        # default = nome del database
 DB_USER = os.getenv("DB_USER", "data_user")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "data_app_pwd")
 
-def get_connection():
+# Pool di connessioni condiviso da route HTTP e job dello scheduler
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))              # connessioni tenute aperte
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))  # extra temporanee sotto picco
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))      # secondi prima di riaprire una connessione
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))       # attesa massima per un checkout
+
+
+def _connect():
     return mysql.connector.connect(
         host=DB_HOST,
         port=DB_PORT,
@@ -22,38 +35,186 @@ def get_connection():
     )
 
 
+class PoolExhaustedError(PoolError):
+    """Raised when no connection becomes available within the pool timeout."""
+    pass
+
+
+class PooledConnection:
+    """Wrapper di una connessione MySQL: close() la restituisce al pool."""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._raw, self._created_at)
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=5, max_overflow=10, recycle=1800, timeout=5.0):
+        self._connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.timeout = timeout
+
+        self._idle = deque()          # (raw, created_at)
+        self._open = 0                # connessioni aperte (idle + in uso)
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._waits = 0
+        self._exhausted = 0
+        self._health_check_failures = 0
+        self._recycled = 0
+        self._created = 0
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Error:
+            pass
+
+    def _healthy(self, raw, created_at):
+        if time.time() - created_at >= self.recycle:
+            with self._cond:
+                self._recycled += 1
+            return False
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Error:
+            with self._cond:
+                self._health_check_failures += 1
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+
+        with self._cond:
+            if not self._idle and self._open >= self.size + self.max_overflow:
+                self._waits += 1
+            while not self._idle and self._open >= self.size + self.max_overflow:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._exhausted += 1
+                    raise PoolExhaustedError(
+                        f"Pool MySQL esaurito ({self._open} connessioni in uso)"
+                    )
+                self._cond.wait(remaining)
+
+            if self._idle:
+                raw, created_at = self._idle.pop()
+            else:
+                raw, created_at = None, None
+                self._open += 1
+            self._checkouts += 1
+
+        if raw is not None:
+            if self._healthy(raw, created_at):
+                return PooledConnection(self, raw, created_at)
+            # connessione scaduta o morta: la sostituisco mantenendo lo slot
+            self._discard(raw)
+
+        try:
+            raw = self._connect()
+        except Error:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._created += 1
+        return PooledConnection(self, raw, time.time())
+
+    def _release(self, raw, created_at):
+        try:
+            # nessuna transazione lasciata aperta deve passare al prossimo utilizzatore
+            raw.rollback()
+            keep = True
+        except Error:
+            keep = False
+
+        with self._cond:
+            if keep and len(self._idle) < self.size:
+                self._idle.append((raw, created_at))
+                raw = None
+            else:
+                self._open -= 1
+            self._cond.notify()
+
+        if raw is not None:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "open": self._open,
+                "idle": idle,
+                "in_use": self._open - idle,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "exhausted": self._exhausted,
+                "health_check_failures": self._health_check_failures,
+                "recycled": self._recycled,
+                "created": self._created,
+            }
+
+
+pool = ConnectionPool(
+    _connect,
+    size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_MAX_OVERFLOW,
+    recycle=DB_POOL_RECYCLE,
+    timeout=DB_POOL_TIMEOUT,
+)
+
+
+def get_connection():
+    return pool.acquire()
+
+
+@contextmanager
+def db_connection():
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
 def init_db():
-    conn = None
+    """
+    Porta lo schema all'ultima versione applicando le migrazioni mancanti.
+    Se una migrazione fallisce il servizio non parte: con lo schema a metà
+    le API risponderebbero 500 sulle colonne e tabelle mancanti.
+    """
+    try:
+        with db_connection() as conn:
+            migrate(conn)
+
+    except Error as e:
+        print(f" Errore durante init_db, avvio interrotto: {e}")
+        raise SystemExit(1)
 
+
+def maintain_partitions():
+    """Job periodico: partizioni future di flights e retention di quelle vecchie."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-        """ CREATE TABLE IF NOT EXISTS interests (
-                email VARCHAR(255),
-                airport VARCHAR(255),
-                high_value INT NULL,
-                low_value INT NULL,
-                PRIMARY KEY (email, airport)
-            ) """
-        )
-
-        cursor.execute(
-        """ CREATE TABLE IF NOT EXISTS flights (
-             flight_id VARCHAR(255) NOT NULL,
-             departure_airport VARCHAR(255),
-             arrival_airport VARCHAR(255),
-             date_time_arrival DATETIME,
-             date_time_departure DATETIME NOT NULL,
-             PRIMARY KEY (flight_id, date_time_departure)
-            );"""
-        )
-
-        conn.commit()
-        print("Tabelle 'interests' e 'flights' pronte.\n")
+        with db_connection() as conn:
+            maintain_flight_partitions(conn)
 
     except Error as e:
-        print(f" Errore durante init_db: {e}")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        print(f" Errore durante la manutenzione delle partizioni: {e}")
@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from opensky_client import get_flights, get_all_flights
+from open_sky_token import get_token
+from ingestion_checkpoints import split_window
+
+# Numero massimo di richieste OpenSky in volo contemporaneamente.
+FETCH_CONCURRENCY = max(1, int(os.getenv("OPENSKY_FETCH_CONCURRENCY", "8")))
+
+# Strategia di fetch: "airport" (arrival/departure per aeroporto), "sweep"
+# (/flights/all filtrato in locale) oppure "auto" (scelta in base al costo stimato).
+FETCH_STRATEGY = os.getenv("OPENSKY_FETCH_STRATEGY", "auto").lower()
+# Sotto questa soglia di aeroporti la strategia per aeroporto vince sempre.
+SWEEP_MIN_AIRPORTS = int(os.getenv("OPENSKY_SWEEP_MIN_AIRPORTS", "30"))
+# /flights/all accetta intervalli di al massimo due ore.
+SWEEP_WINDOW_SECONDS = 2 * 3600
+# Peso del campione più recente nella media mobile delle latenze.
+LATENCY_EWMA_ALPHA = 0.2
+
+FLIGHT_TYPES = ("arrival", "departure")
+
+FetchTask = namedtuple("FetchTask", ["airport", "flight_type", "begin", "end"])
+
+
+class AirportFetch:
+    """Esito delle richieste di un aeroporto in un ciclo, per direzione e finestra."""
+
+    def __init__(self, airport):
+        self.airport = airport
+        self.windows = {flight_type: [] for flight_type in FLIGHT_TYPES}  # (begin, end, flights|None)
+
+    def add(self, task, flights):
+        self.windows[task.flight_type].append((task.begin, task.end, flights))
+
+    def flights(self, flight_type):
+        result = []
+        for _, _, flights in self.windows[flight_type]:
+            if flights:
+                result.extend(flights)
+        return result
+
+    @property
+    def arrivals(self):
+        return self.flights("arrival")
+
+    @property
+    def departures(self):
+        return self.flights("departure")
+
+    def fetched(self, flight_type):
+        """True se almeno una finestra della direzione è stata scaricata con successo."""
+        return any(flights is not None for _, _, flights in self.windows[flight_type])
+
+    def covered_range(self, flight_type):
+        """
+        Intervallo contiguo scaricato con successo a partire dalla prima finestra:
+        una finestra fallita interrompe la copertura, così al ciclo successivo
+        si riparte da lì.
+        """
+        windows = sorted(self.windows[flight_type], key=lambda w: w[0])
+        if not windows:
+            return None
+        begin = windows[0][0]
+        end = None
+        for w_begin, w_end, flights in windows:
+            if flights is None or (end is not None and w_begin > end):
+                break
+            end = w_end
+        if end is None:
+            return None
+        return begin, end
+
+
+class CallCostModel:
+    """
+    Media mobile esponenziale della durata di una chiamata per strategia.
+
+    I valori iniziali sono stime prudenti (una risposta di /flights/all è
+    molto più grande di una per aeroporto) e vengono sostituiti dalle
+    misure reali man mano che le chiamate vengono eseguite.
+    """
+
+    def __init__(self, initial, alpha=LATENCY_EWMA_ALPHA):
+        self.alpha = alpha
+        self.latency = dict(initial)
+        self.samples = {strategy: 0 for strategy in initial}
+        self.lock = threading.Lock()
+
+    def record(self, strategy, seconds):
+        with self.lock:
+            if self.samples[strategy] == 0:
+                self.latency[strategy] = seconds
+            else:
+                self.latency[strategy] += self.alpha * (seconds - self.latency[strategy])
+            self.samples[strategy] += 1
+
+    def estimate(self, strategy, calls):
+        with self.lock:
+            return calls * self.latency[strategy]
+
+    def stats(self):
+        with self.lock:
+            return {
+                strategy: {"ewma_seconds": round(self.latency[strategy], 3), "samples": self.samples[strategy]}
+                for strategy in self.latency
+            }
+
+
+cost_model = CallCostModel({"airport": 1.0, "sweep": 10.0})
+last_strategy = None
+
+
+def run_task(task, access_token):
+    # il token può essere stato rinnovato in background durante un ciclo lungo
+    access_token = get_token() or access_token
+    started = time.monotonic()
+    try:
+        flights = get_flights(task.airport, access_token, task.flight_type, task.begin, task.end)
+    except Exception as e:
+        print(f"Errore inatteso nel fetch {task.flight_type} per {task.airport}: {e}")
+        return None
+    if flights is not None:
+        cost_model.record("airport", time.monotonic() - started)
+    return flights
+
+
+def _run_sweep_chunk(begin, end, access_token, monitored):
+    access_token = get_token() or access_token
+    started = time.monotonic()
+    try:
+        flights = get_all_flights(
+            access_token, begin, end,
+            keep=lambda row: row.departure_airport in monitored or row.arrival_airport in monitored,
+        )
+    except Exception as e:
+        print(f"Errore inatteso nel fetch /flights/all {begin}-{end}: {e}")
+        return None
+    if flights is not None:
+        cost_model.record("sweep", time.monotonic() - started)
+    return flights
+
+
+def fetch_airports(tasks, access_token, max_workers=None):
+    """
+    Esegue le FetchTask con concorrenza limitata.
+
+    Genera un AirportFetch appena tutte le richieste di un aeroporto sono
+    concluse, così il chiamante può salvare e pubblicare su Kafka aeroporto
+    per aeroporto dal proprio thread.
+    """
+    workers = max_workers or FETCH_CONCURRENCY
+    remaining = {}
+    results = {}
+
+    for task in tasks:
+        remaining[task.airport] = remaining.get(task.airport, 0) + 1
+        if task.airport not in results:
+            results[task.airport] = AirportFetch(task.airport)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="opensky-fetch") as executor:
+        futures = {executor.submit(run_task, task, access_token): task for task in tasks}
+
+        for future in as_completed(futures):
+            task = futures[future]
+            results[task.airport].add(task, future.result())
+
+            remaining[task.airport] -= 1
+            if remaining[task.airport] == 0:
+                yield results.pop(task.airport)
+
+
+def _sweep_span(tasks):
+    return min(task.begin for task in tasks), max(task.end for task in tasks)
+
+
+def sweep_eligible(monitored):
+    """True se lo sweep è ammesso con `monitored` aeroporti ingeriti dalla replica."""
+    if FETCH_STRATEGY in ("airport", "sweep"):
+        return FETCH_STRATEGY == "sweep"
+    return monitored >= SWEEP_MIN_AIRPORTS
+
+
+def choose_strategy(tasks, monitored=None):
+    """
+    Sceglie tra richieste per aeroporto e sweep globale confrontando il
+    costo stimato (numero di chiamate x latenza media misurata).
+
+    La soglia SWEEP_MIN_AIRPORTS si applica a `monitored`, il numero di
+    aeroporti ingeriti dalla replica (interessi o lease), non al singolo
+    batch dello scheduler; senza, vale il numero di aeroporti del piano.
+    """
+    if FETCH_STRATEGY in ("airport", "sweep"):
+        return FETCH_STRATEGY
+    if monitored is None:
+        monitored = len({task.airport for task in tasks})
+    if not tasks or not sweep_eligible(monitored):
+        return "airport"
+
+    sweep_calls = len(split_window(*_sweep_span(tasks), max_span=SWEEP_WINDOW_SECONDS))
+    airport_cost = cost_model.estimate("airport", len(tasks))
+    sweep_cost = cost_model.estimate("sweep", sweep_calls)
+    return "sweep" if sweep_cost < airport_cost else "airport"
+
+
+def _flight_time(row, flight_type):
+    # stessa semantica degli endpoint per aeroporto: arrivo su lastSeen, partenza su firstSeen
+    return row.arrival_ts if flight_type == "arrival" else row.departure_ts
+
+
+def sweep_airports(tasks, access_token, max_workers=None):
+    """
+    Copre le FetchTask con /flights/all a blocchi di due ore.
+
+    Ogni volo viene smistato agli aeroporti monitorati con una ricerca in un
+    set di codici ICAO; alla fine si ricostruisce un AirportFetch per
+    aeroporto con le stesse finestre del piano, così il chiamante non
+    distingue le due strategie. Una finestra che si sovrappone a un blocco
+    fallito risulta fallita (None) e il suo checkpoint non avanza.
+    """
+    workers = max_workers or FETCH_CONCURRENCY
+    monitored = {task.airport for task in tasks}
+    chunks = split_window(*_sweep_span(tasks), max_span=SWEEP_WINDOW_SECONDS)
+
+    routed = {}            # (airport, flight_type) -> voli
+    failed_chunks = []
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="opensky-sweep") as executor:
+        futures = {
+            executor.submit(_run_sweep_chunk, begin, end, access_token, monitored): (begin, end)
+            for begin, end in chunks
+        }
+        for future in as_completed(futures):
+            flights = future.result()
+            if flights is None:
+                failed_chunks.append(futures[future])
+                continue
+            for row in flights:
+                if row.departure_airport in monitored:
+                    routed.setdefault((row.departure_airport, "departure"), []).append(row)
+                if row.arrival_airport in monitored:
+                    routed.setdefault((row.arrival_airport, "arrival"), []).append(row)
+
+    results = {}
+    for task in tasks:
+        result = results.get(task.airport)
+        if result is None:
+            result = results[task.airport] = AirportFetch(task.airport)
+
+        if any(begin < task.end and task.begin < end for begin, end in failed_chunks):
+            result.add(task, None)
+            continue
+
+        flights = [
+            flight for flight in routed.get((task.airport, task.flight_type), [])
+            if task.begin <= (_flight_time(flight, task.flight_type) or 0) < task.end
+        ]
+        result.add(task, flights)
+
+    yield from results.values()
+
+
+def fetch_flights(tasks, access_token, max_workers=None, monitored=None):
+    """Esegue il piano con la strategia più economica; genera un AirportFetch per aeroporto."""
+    global last_strategy
+    strategy = choose_strategy(tasks, monitored)
+    last_strategy = strategy
+    if strategy == "sweep":
+        return sweep_airports(tasks, access_token, max_workers)
+    return fetch_airports(tasks, access_token, max_workers)
+
+
+def strategy_stats():
+    return {
+        "mode": FETCH_STRATEGY,
+        "sweep_min_airports": SWEEP_MIN_AIRPORTS,
+        "last_strategy": last_strategy,
+        "call_cost": cost_model.stats(),
+    }
@@ -0,0 +1,130 @@
+import hashlib
+import math
+import os
+import threading
+
+# Voli per generazione del filtro di storia recente (0 = storia disattivata).
+DEDUP_HISTORY_CAPACITY = int(os.getenv("FLIGHTS_DEDUP_HISTORY_CAPACITY", "200000"))
+# Probabilità di falso positivo per generazione: un falso positivo scarta un volo nuovo.
+DEDUP_FALSE_POSITIVE_RATE = float(os.getenv("FLIGHTS_DEDUP_FP_RATE", "1e-6"))
+
+
+def flight_key(row):
+    """Chiave di un volo, la stessa della primary key di flights: (callsign, firstSeen)."""
+    return row.flight_id, row.departure_ts
+
+
+class BloomFilter:
+    def __init__(self, capacity, false_positive_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(f"{key[0]}|{key[1]}".encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class RecentFlights:
+    """
+    Storia recente dei voli già salvati, in memoria limitata.
+
+    Due filtri di Bloom a generazioni: quando quello corrente raggiunge la
+    capacità diventa il precedente e ne viene aperto uno vuoto, così la
+    memoria resta costante e la storia copre da una a due generazioni di
+    voli. Un falso positivo farebbe scartare un volo mai salvato: il tasso
+    va tenuto molto basso (FLIGHTS_DEDUP_FP_RATE).
+    """
+
+    def __init__(self, capacity=DEDUP_HISTORY_CAPACITY, false_positive_rate=DEDUP_FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.current = BloomFilter(capacity, false_positive_rate)
+        self.previous = None
+        self.rotations = 0
+        self.lock = threading.Lock()
+
+    def add_all(self, keys):
+        with self.lock:
+            for key in keys:
+                if self.current.count >= self.capacity:
+                    self.previous = self.current
+                    self.current = BloomFilter(self.capacity, self.false_positive_rate)
+                    self.rotations += 1
+                self.current.add(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.current or (self.previous is not None and key in self.previous)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "capacity": self.capacity,
+                "false_positive_rate": self.false_positive_rate,
+                "current_generation": self.current.count,
+                "rotations": self.rotations,
+                "memory_bytes": len(self.current.bits) * (2 if self.previous is not None else 1),
+            }
+
+
+class FlightDeduplicator:
+    """
+    Dedup dei voli di un ciclo di scrittura, prima che arrivino a MySQL.
+
+    Un volo tra due aeroporti monitorati torna sia dalla partenza di A sia
+    dall'arrivo di B: la seconda copia viene scartata dal set del ciclo.
+    I voli salvati nei cicli precedenti vengono scartati dalla storia
+    recente; le chiavi entrano nella storia solo dopo il commit, così un
+    rollback o un errore di scrittura non fa perdere voli al ciclo successivo.
+    """
+
+    def __init__(self, history=None):
+        self.history = history
+        self.seen = set()
+        self.pending = []
+        self.cycle_duplicates = 0
+        self.history_duplicates = 0
+
+    def fresh(self, rows):
+        for row in rows:
+            key = flight_key(row)
+            if key in self.seen:
+                self.cycle_duplicates += 1
+                continue
+            if self.history is not None and key in self.history:
+                self.history_duplicates += 1
+                continue
+            self.seen.add(key)
+            yield row
+
+    def written(self, rows):
+        self.pending.extend(flight_key(row) for row in rows)
+
+    def forget(self, rows):
+        """Righe non scritte: devono poter essere riproposte."""
+        self.seen.difference_update(flight_key(row) for row in rows)
+
+    def committed(self):
+        if self.history is not None:
+            self.history.add_all(self.pending)
+        self.pending = []
+
+    def rolled_back(self):
+        self.seen.difference_update(self.pending)
+        self.pending = []
+
+
+recent_flights = RecentFlights() if DEDUP_HISTORY_CAPACITY > 0 else None
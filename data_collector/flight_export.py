@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+import os
+import zlib
+from mysql.connector import Error
+from db import get_connection
+from flights_writer import FLIGHT_COLUMNS
+
+# Righe lette dal cursore per volta: la memoria dell'export non dipende dal totale.
+EXPORT_BATCH_ROWS = int(os.getenv("FLIGHTS_EXPORT_BATCH_ROWS", "5000"))
+# Un client lento non deve far chiudere a MySQL la connessione in streaming.
+EXPORT_NET_WRITE_TIMEOUT = int(os.getenv("FLIGHTS_EXPORT_NET_WRITE_TIMEOUT", "600"))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def open_export(conditions, params):
+    """
+    Esegue la query di export su una connessione dedicata con cursore non
+    bufferizzato: le righe restano sul server finché non vengono lette.
+    Gli errori (pool esaurito, query) emergono qui, prima della risposta.
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute("SET SESSION net_write_timeout = %s", (EXPORT_NET_WRITE_TIMEOUT,))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(f"SELECT {', '.join(FLIGHT_COLUMNS)} FROM flights {where}", params)
+    except Error:
+        conn.close()
+        raise
+    return conn, cursor
+
+
+def iter_batches(conn, cursor):
+    """Blocchi di righe dal cursore; la connessione viene sempre restituita al pool."""
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_ROWS)
+            if not rows:
+                break
+            yield rows
+    except Error as e:
+        # a risposta iniziata non si può più cambiare lo status HTTP: il body resta troncato
+        print(f"Errore database durante l'export dei voli: {e}")
+    finally:
+        try:
+            cursor.close()
+        except Error:
+            pass
+        # se il client ha interrotto lo stream restano righe non lette: il pool
+        # non riesce a fare rollback e scarta la connessione invece di riusarla
+        conn.close()
+
+
+def _value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def ndjson_chunks(batches):
+    for rows in batches:
+        yield "".join(
+            json.dumps({column: _value(value) for column, value in zip(FLIGHT_COLUMNS, row)}) + "\n"
+            for row in rows
+        ).encode("utf-8")
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FLIGHT_COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    for rows in batches:
+        writer.writerows([_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(conn, cursor, fmt, compress=False):
+    batches = iter_batches(conn, cursor)
+    chunks = ndjson_chunks(batches) if fmt == "ndjson" else csv_chunks(batches)
+    return gzip_chunks(chunks) if compress else chunks
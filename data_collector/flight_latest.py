@@ -0,0 +1,100 @@
+import threading
+from datetime import datetime
+from flights_writer import add_commit_listener
+
+LATEST_DIRECTIONS = {
+    # direzione -> (colonna aeroporto, colonna orario) nelle righe di flights
+    "arrival": ("arrival_airport", "date_time_arrival"),
+    "departure": ("departure_airport", "date_time_departure"),
+}
+
+
+def _flight_dict(row):
+    return {
+        "flight_id": row.flight_id,
+        "departure_airport": row.departure_airport,
+        "arrival_airport": row.arrival_airport,
+        "date_time_arrival": datetime.fromtimestamp(row.arrival_ts),
+        "date_time_departure": datetime.fromtimestamp(row.departure_ts),
+    }
+
+
+class LatestFlightCache:
+    """
+    Ultimo arrivo e ultima partenza per aeroporto, aggiornati dal writer a
+    ogni commit: una voce avanza solo se arriva un volo più recente.
+
+    Una voce è completa ("warm") dopo la prima lettura da MySQL; i voli
+    confermati nel frattempo vengono fusi per orario, quindi non si perdono.
+    Come la finestra in memoria, risponde solo per gli aeroporti ingeriti da
+    questa replica (owned_fn) e rilegge quelli con flights_changed_at
+    successivo alla lettura (backfill o replay fuori da questo writer).
+    """
+
+    def __init__(self, owned_fn=None):
+        self.owned_fn = owned_fn
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.warm = {}     # aeroporto -> NOW() del database alla lettura da MySQL
+        self.hits = 0
+        self.misses = 0
+
+    def _advance(self, airport, direction, flight):
+        time_column = LATEST_DIRECTIONS[direction][1]
+        entry = self.entries.setdefault(airport, {"arrival": None, "departure": None})
+        current = entry[direction]
+        if current is None or flight[time_column] > current[time_column]:
+            entry[direction] = flight
+
+    def add_rows(self, rows):
+        """Listener del writer: FlightRow appena confermati su MySQL."""
+        with self.lock:
+            for row in rows:
+                flight = _flight_dict(row)
+                self._advance(row.arrival_airport, "arrival", flight)
+                self._advance(row.departure_airport, "departure", flight)
+
+    def get(self, airport, changed_at=None):
+        """{"arrival": ..., "departure": ...} dalla memoria, oppure None se va letto da MySQL."""
+        if self.owned_fn is not None and airport not in self.owned_fn():
+            self.misses += 1
+            return None
+        with self.lock:
+            warmed_at = self.warm.get(airport)
+            if warmed_at is None or (changed_at is not None and changed_at >= warmed_at):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(self.entries[airport])
+
+    def fill(self, airport, latest, checked_at):
+        """
+        Completa la voce con l'ultimo volo per direzione letto da MySQL (o None);
+        checked_at è NOW() del database preso prima della lettura.
+        """
+        with self.lock:
+            for direction, flight in latest.items():
+                if flight is not None:
+                    self._advance(airport, direction, flight)
+            entry = self.entries.setdefault(airport, {"arrival": None, "departure": None})
+            if self.owned_fn is None or airport in self.owned_fn():
+                self.warm[airport] = checked_at
+            return dict(entry)
+
+    def retain(self, owned):
+        """Le voci degli aeroporti passati ad altre repliche vanno rilette da MySQL."""
+        with self.lock:
+            self.warm = {airport: at for airport, at in self.warm.items() if airport in owned}
+
+    def stats(self):
+        with self.lock:
+            return {
+                "airports": len(self.warm),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+latest_cache = LatestFlightCache()
+
+add_commit_listener(latest_cache.add_rows)
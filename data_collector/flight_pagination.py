@@ -0,0 +1,141 @@
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+# Righe massime per pagina di GET /flights.
+FLIGHTS_PAGE_MAX_LIMIT = int(os.getenv("FLIGHTS_PAGE_MAX_LIMIT", "1000"))
+# Validità dei totali calcolati con COUNT(*) per una combinazione di filtri.
+FLIGHTS_TOTAL_CACHE_SECONDS = int(os.getenv("FLIGHTS_TOTAL_CACHE_SECONDS", "60"))
+
+DIRECTIONS = ("arrival", "departure", "any")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(row):
+    """Token opaco con la primary key dell'ultima riga restituita."""
+    key = [row["flight_id"], row["date_time_departure"].isoformat()]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        flight_id, departure = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return str(flight_id), datetime.fromisoformat(departure)
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise InvalidCursor(f"cursor non valido: {e}")
+
+
+def parse_time(value):
+    """Epoch in secondi oppure data/ora ISO 8601; ValueError se non valida o fuori intervallo."""
+    if value is None:
+        return None
+    try:
+        epoch = int(value)
+    except ValueError:
+        return datetime.fromisoformat(value)
+    try:
+        return datetime.fromtimestamp(epoch)
+    except (OverflowError, OSError) as e:
+        # epoch oltre i limiti della piattaforma o di datetime
+        raise ValueError(f"epoch fuori intervallo: {value}") from e
+
+
+def build_filters(airport=None, direction="any", since=None, until=None):
+    """Condizioni WHERE e parametri per i filtri di /flights (orari su date_time_departure)."""
+    conditions = []
+    params = []
+    if airport:
+        if direction == "arrival":
+            conditions.append("arrival_airport = %s")
+            params.append(airport)
+        elif direction == "departure":
+            conditions.append("departure_airport = %s")
+            params.append(airport)
+        else:
+            conditions.append("(arrival_airport = %s OR departure_airport = %s)")
+            params += [airport, airport]
+    # filtrare sull'orario di partenza consente il pruning delle partizioni
+    if since is not None:
+        conditions.append("date_time_departure >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("date_time_departure < %s")
+        params.append(until)
+    return conditions, params
+
+
+def page_query(conditions, params, after, limit):
+    """
+    Pagina successiva in ordine di primary key (flight_id, date_time_departure).
+
+    Il cursore diventa una condizione di intervallo sulla primary key, così
+    ogni pagina legge solo le proprie righe, qualunque sia la sua posizione.
+    Si chiede una riga in più per sapere se esiste una pagina successiva.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if after is not None:
+        flight_id, departure = after
+        conditions.append("(flight_id > %s OR (flight_id = %s AND date_time_departure > %s))")
+        params += [flight_id, flight_id, departure]
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT *
+        FROM flights
+        {where}
+        ORDER BY flight_id, date_time_departure
+        LIMIT %s
+    """
+    return query, params + [limit + 1]
+
+
+class TotalCache:
+    """
+    Totale delle righe per combinazione di filtri, ricalcolato al più ogni
+    ttl secondi. Senza filtri usa la stima di information_schema, che non
+    richiede di scorrere la tabella.
+    """
+
+    def __init__(self, ttl=FLIGHTS_TOTAL_CACHE_SECONDS):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, cursor, conditions, params):
+        key = (tuple(conditions), tuple(str(p) for p in params))
+        now = time.monotonic()
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached and now - cached[0] < self.ttl:
+                return cached[1], cached[2]
+
+        if conditions:
+            cursor.execute(f"SELECT COUNT(*) AS total FROM flights WHERE {' AND '.join(conditions)}", params)
+            total, estimate = cursor.fetchone()["total"], False
+        else:
+            cursor.execute(
+                """
+                SELECT table_rows AS total
+                FROM information_schema.tables
+                WHERE table_schema = DATABASE() AND table_name = 'flights'
+                """
+            )
+            row = cursor.fetchone()
+            total, estimate = (int(row["total"] or 0) if row else 0), True
+
+        with self.lock:
+            # le combinazioni di filtri sono potenzialmente infinite: tengo solo quelle valide
+            self.entries = {k: v for k, v in self.entries.items() if now - v[0] < self.ttl}
+            self.entries[key] = (now, total, estimate)
+        return total, estimate
+
+
+total_cache = TotalCache()
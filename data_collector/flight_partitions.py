@@ -0,0 +1,144 @@
+import os
+from datetime import date, datetime, timedelta
+from mysql.connector import Error
+
+# Giorni di voli conservati in flights (0 = nessuna retention).
+FLIGHTS_RETENTION_DAYS = int(os.getenv("FLIGHTS_RETENTION_DAYS", "365"))
+# "drop" elimina le partizioni scadute, "archive" le sposta in tabelle flights_archive_pYYYYMMDD.
+FLIGHTS_RETENTION_MODE = os.getenv("FLIGHTS_RETENTION_MODE", "drop").lower()
+# Partizioni giornaliere create in anticipo oltre la data odierna.
+FLIGHTS_PARTITION_AHEAD_DAYS = int(os.getenv("FLIGHTS_PARTITION_AHEAD_DAYS", "7"))
+# Giorni con una partizione propria alla prima conversione; i dati più vecchi vanno in phistory.
+FLIGHTS_PARTITION_INITIAL_DAYS = 31
+PARTITION_MAINTENANCE_HOURS = int(os.getenv("FLIGHTS_PARTITION_MAINTENANCE_HOURS", "6"))
+
+HISTORY_PARTITION = "phistory"
+FUTURE_PARTITION = "pfuture"
+MAINTENANCE_LOCK_NAME = "data_collector.flights_partitions"
+
+
+def partition_name(day):
+    return f"p{day:%Y%m%d}"
+
+
+def _day_partition(day):
+    return f"PARTITION {partition_name(day)} VALUES LESS THAN ('{day + timedelta(days=1)}')"
+
+
+def _future_partition():
+    return f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)"
+
+
+def load_partitions(cursor, table="flights"):
+    """[(nome, limite superiore come date oppure None per MAXVALUE)] in ordine."""
+    cursor.execute(
+        """
+        SELECT partition_name, partition_description
+        FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position
+        """,
+        (table,)
+    )
+    partitions = []
+    for name, description in cursor.fetchall():
+        if description == "MAXVALUE":
+            partitions.append((name, None))
+        else:
+            # RANGE COLUMNS su DATETIME: '2026-10-18 00:00:00'
+            partitions.append((name, datetime.fromisoformat(description.strip("'")).date()))
+    return partitions
+
+
+def partition_flights(cursor, today=None):
+    """
+    Converte flights in tabella partizionata per giorno di partenza.
+
+    Una partizione per ciascuno degli ultimi FLIGHTS_PARTITION_INITIAL_DAYS
+    giorni e dei prossimi FLIGHTS_PARTITION_AHEAD_DAYS, phistory per i dati
+    più vecchi e pfuture (MAXVALUE) per quelli oltre l'ultima partizione.
+    La primary key contiene già date_time_departure, come richiesto da MySQL.
+    """
+    if load_partitions(cursor):
+        return
+
+    today = today or date.today()
+    first = today - timedelta(days=FLIGHTS_PARTITION_INITIAL_DAYS)
+    days = [first + timedelta(days=i) for i in range(FLIGHTS_PARTITION_INITIAL_DAYS + FLIGHTS_PARTITION_AHEAD_DAYS + 1)]
+
+    partitions = [f"PARTITION {HISTORY_PARTITION} VALUES LESS THAN ('{first}')"]
+    partitions += [_day_partition(day) for day in days]
+    partitions.append(_future_partition())
+
+    # il ripartizionamento ricopia la tabella: MySQL non lo consente in place
+    cursor.execute(
+        f"ALTER TABLE flights PARTITION BY RANGE COLUMNS(date_time_departure) ({', '.join(partitions)})"
+    )
+
+
+def _archive_partition(cursor, name):
+    archive = f"flights_archive_{name}"
+    cursor.execute("SHOW TABLES LIKE %s", (archive,))
+    if cursor.fetchone():
+        print(f"Tabella {archive} già presente: partizione {name} lasciata al suo posto")
+        return False
+    cursor.execute(f"CREATE TABLE {archive} LIKE flights")
+    cursor.execute(f"ALTER TABLE {archive} REMOVE PARTITIONING")
+    # scambio di metadati: i dati passano nella tabella d'archivio senza essere copiati
+    cursor.execute(f"ALTER TABLE flights EXCHANGE PARTITION {name} WITH TABLE {archive}")
+    return True
+
+
+def maintain_flight_partitions(conn, today=None):
+    """
+    Manutenzione di flights: crea le partizioni dei prossimi giorni dividendo
+    pfuture e rimuove (o archivia) quelle interamente più vecchie della
+    retention. Con più repliche la esegue una sola alla volta; le altre
+    saltano il giro.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, 0)", (MAINTENANCE_LOCK_NAME,))
+    if cursor.fetchone()[0] != 1:
+        return
+
+    try:
+        partitions = load_partitions(cursor)
+        if not partitions:
+            print("flights non è partizionata: manutenzione saltata")
+            return
+
+        today = today or date.today()
+        bounds = [upper for _, upper in partitions if upper is not None]
+        next_day = max(bounds) if bounds else today
+        horizon = today + timedelta(days=FLIGHTS_PARTITION_AHEAD_DAYS)
+
+        new_days = []
+        while next_day <= horizon:
+            new_days.append(next_day)
+            next_day += timedelta(days=1)
+        if new_days:
+            clauses = [_day_partition(day) for day in new_days] + [_future_partition()]
+            cursor.execute(
+                f"ALTER TABLE flights REORGANIZE PARTITION {FUTURE_PARTITION} INTO ({', '.join(clauses)})"
+            )
+            print(f"Create {len(new_days)} partizioni di flights fino al {new_days[-1]}")
+
+        if FLIGHTS_RETENTION_DAYS <= 0:
+            return
+
+        cutoff = today - timedelta(days=FLIGHTS_RETENTION_DAYS)
+        expired = [name for name, upper in partitions if upper is not None and upper <= cutoff]
+        for name in expired:
+            if FLIGHTS_RETENTION_MODE == "archive" and not _archive_partition(cursor, name):
+                continue
+            cursor.execute(f"ALTER TABLE flights DROP PARTITION {name}")
+        if expired:
+            print(f"Retention flights ({FLIGHTS_RETENTION_DAYS} giorni, {FLIGHTS_RETENTION_MODE}): "
+                  f"rimosse {len(expired)} partizioni")
+
+    except Error as e:
+        print(f"Errore database nella manutenzione delle partizioni di flights: {e}")
+
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MAINTENANCE_LOCK_NAME,))
+        cursor.fetchone()
@@ -0,0 +1,157 @@
+import os
+from datetime import datetime, timedelta
+from mysql.connector import Error
+from db import db_connection
+
+# Durata massima di un volo considerata per il pruning delle partizioni.
+MAX_FLIGHT_DAYS = 1
+# Aeroporti ricontati da una singola INSERT ... SELECT del rollup.
+ROLLUP_AIRPORTS_PER_STATEMENT = max(1, int(os.getenv("FLIGHTS_ROLLUP_AIRPORTS_PER_STATEMENT", "500")))
+
+FLIGHT_DIRECTIONS = {
+    # direzione -> (colonna aeroporto, colonna orario) in flights
+    "arrival": ("arrival_airport", "date_time_arrival"),
+    "departure": ("departure_airport", "date_time_departure"),
+}
+
+
+def hour_start(ts):
+    """Inizio dell'ora (ora locale, come le DATETIME di flights) di un epoch."""
+    return datetime.fromtimestamp(ts).replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_keys(rows):
+    """Bucket (airport, direction, hour_start) toccati da un blocco di FlightRow."""
+    keys = set()
+    for row in rows:
+        keys.add((row.arrival_airport, "arrival", hour_start(row.arrival_ts)))
+        keys.add((row.departure_airport, "departure", hour_start(row.departure_ts)))
+    return keys
+
+
+def _rollup_query(direction, where):
+    airport_col, time_col = FLIGHT_DIRECTIONS[direction]
+    return f"""
+        INSERT INTO flight_counts_hourly (airport, direction, hour_start, flights)
+        SELECT {airport_col}, '{direction}', DATE({time_col}) + INTERVAL HOUR({time_col}) HOUR AS bucket, COUNT(*)
+        FROM flights
+        WHERE {where}
+        GROUP BY {airport_col}, bucket
+        ON DUPLICATE KEY UPDATE flights = VALUES(flights)
+    """
+
+
+def refresh_buckets(cursor, buckets):
+    """
+    Ricalcola dalla tabella flights i bucket orari toccati.
+
+    Per ogni direzione si ricontano le ore tra il primo e l'ultimo bucket
+    toccato di tutti gli aeroporti coinvolti, a blocchi di
+    ROLLUP_AIRPORTS_PER_STATEMENT aeroporti: una manciata di INSERT ... SELECT
+    per ciclo anche quando i voli di un hub toccano centinaia di aeroporti
+    esteri. Il ricalcolo è idempotente, quindi i voli ignorati da INSERT
+    IGNORE o scritti due volte non alterano i conteggi; gli aeroporti in
+    ordine fisso prendono i lock sempre nello stesso ordine.
+    """
+    ranges = {}
+    for airport, direction, start in buckets:
+        airports, low, high = ranges.get(direction, (set(), start, start))
+        airports.add(airport)
+        ranges[direction] = (airports, min(low, start), max(high, start))
+
+    for direction, (airports, low, high) in ranges.items():
+        airport_col, time_col = FLIGHT_DIRECTIONS[direction]
+        airports = sorted(airports)
+        for i in range(0, len(airports), ROLLUP_AIRPORTS_PER_STATEMENT):
+            chunk = airports[i:i + ROLLUP_AIRPORTS_PER_STATEMENT]
+            where = (f"{airport_col} IN ({', '.join(['%s'] * len(chunk))}) "
+                     f"AND {time_col} >= %s AND {time_col} < %s")
+            params = [*chunk, low, high + timedelta(hours=1)]
+            if direction == "arrival":
+                # flights è partizionata per partenza: un volo parte al più un giorno
+                # prima di atterrare, così MySQL legge solo le partizioni interessate
+                where += " AND date_time_departure >= %s AND date_time_departure < %s"
+                params += [low - timedelta(days=MAX_FLIGHT_DAYS), high + timedelta(hours=1)]
+            cursor.execute(_rollup_query(direction, where), params)
+
+
+def window_counts(cursor, airports, since, until):
+    """{airport: (arrivi, partenze)} nei bucket orari [since, until) degli aeroporti dati."""
+    counts = {airport: [0, 0] for airport in airports}
+    if not counts:
+        return {}
+    placeholders = ", ".join(["%s"] * len(counts))
+    cursor.execute(
+        f"""
+        SELECT airport, direction, SUM(flights)
+        FROM flight_counts_hourly
+        WHERE airport IN ({placeholders})
+          AND hour_start >= %s AND hour_start < %s
+        GROUP BY airport, direction
+        """,
+        (*counts, since, until)
+    )
+    for airport, direction, flights in cursor.fetchall():
+        counts[airport][0 if direction == "arrival" else 1] = int(flights)
+    return {airport: tuple(pair) for airport, pair in counts.items()}
+
+
+def rebuild_rollup(only_if_empty=True):
+    """Popolamento iniziale (o ricostruzione completa) del rollup dalla tabella flights."""
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            if only_if_empty:
+                cursor.execute("SELECT 1 FROM flight_counts_hourly LIMIT 1")
+                if cursor.fetchone():
+                    return False
+            for direction, (airport_col, time_col) in FLIGHT_DIRECTIONS.items():
+                cursor.execute(_rollup_query(direction, f"{airport_col} IS NOT NULL AND {time_col} IS NOT NULL"))
+            conn.commit()
+            print("Rollup orario dei voli popolato dalla tabella flights.")
+            return True
+    except Error as e:
+        print(f"Errore database nel popolamento del rollup dei voli: {e}")
+        return False
+
+
+def load_hourly(cursor, airport, days):
+    """Bucket orari dell'aeroporto negli ultimi `days` giorni e l'istante NOW() del database."""
+    cursor.execute("SELECT NOW()")
+    now = cursor.fetchone()[0]
+    cursor.execute(
+        """
+        SELECT direction, hour_start, flights
+        FROM flight_counts_hourly
+        WHERE airport = %s
+          AND hour_start >= %s
+        """,
+        (airport, now - timedelta(days=days))
+    )
+    return now, cursor.fetchall()
+
+
+def summarize(hourly, now, days):
+    """
+    Totali, giorno e ora più trafficati in una finestra di `days` giorni,
+    calcolati dai bucket orari (O(days x 24) righe, con granularità oraria).
+    """
+    since = now - timedelta(days=days)
+    totals = {"arrival": 0, "departure": 0}
+    by_day = {}
+    by_hour = {}
+
+    for direction, start, flights in hourly:
+        if start < since:
+            continue
+        totals[direction] += flights
+        day = str(start.date())
+        by_day[day] = by_day.get(day, 0) + flights
+        by_hour[start.hour] = by_hour.get(start.hour, 0) + flights
+
+    return {
+        "arrivals": totals["arrival"],
+        "departures": totals["departure"],
+        "busiest_day": max(by_day.items(), key=lambda x: x[1]) if by_day else None,
+        "busiest_hour": max(by_hour.items(), key=lambda x: x[1]) if by_hour else None,
+    }
@@ -0,0 +1,196 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from mysql.connector import Error
+from db import db_connection
+from flights_writer import FLIGHT_COLUMNS, add_commit_listener
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:
+    # dipendenza opzionale: senza pyarrow gli snapshot sono disattivati
+    pa = None
+
+# Cartella degli snapshot Arrow giornalieri (vuota = snapshot disattivati).
+SNAPSHOT_DIR = os.getenv("FLIGHTS_SNAPSHOT_DIR", "")
+# Giorni di cui creare lo snapshot all'avvio se manca.
+SNAPSHOT_INITIAL_DAYS = int(os.getenv("FLIGHTS_SNAPSHOT_INITIAL_DAYS", "30"))
+
+ARROW_FILE_MIMETYPE = "application/vnd.apache.arrow.file"
+ARROW_STREAM_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+DICTIONARY_COLUMNS = ("departure_airport", "arrival_airport")
+TIMESTAMP_COLUMNS = ("date_time_arrival", "date_time_departure")
+
+
+def snapshots_available():
+    return pa is not None and bool(SNAPSHOT_DIR)
+
+
+def snapshot_path(day):
+    return os.path.join(SNAPSHOT_DIR, f"flights-{day.isoformat()}.arrow")
+
+
+def list_snapshots():
+    if not snapshots_available() or not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    snapshots = []
+    for name in sorted(os.listdir(SNAPSHOT_DIR)):
+        if not (name.startswith("flights-") and name.endswith(".arrow")):
+            continue
+        path = os.path.join(SNAPSHOT_DIR, name)
+        stat = os.stat(path)
+        snapshots.append({
+            "day": name[len("flights-"):-len(".arrow")],
+            "bytes": stat.st_size,
+            "updated_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        })
+    return snapshots
+
+
+def _load_day(day):
+    begin = datetime.combine(day, datetime.min.time())
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        # una sola partizione di flights: il giorno di partenza
+        cursor.execute(
+            f"""
+            SELECT {', '.join(FLIGHT_COLUMNS)}
+            FROM flights
+            WHERE date_time_departure >= %s AND date_time_departure < %s
+            ORDER BY date_time_departure, flight_id
+            """,
+            (begin, begin + timedelta(days=1))
+        )
+        return cursor.fetchall()
+
+
+def _build_table(rows):
+    columns = list(zip(*rows)) if rows else [[] for _ in FLIGHT_COLUMNS]
+    arrays = []
+    for name, values in zip(FLIGHT_COLUMNS, columns):
+        if name in TIMESTAMP_COLUMNS:
+            arrays.append(pa.array(values, type=pa.timestamp("s")))
+        elif name in DICTIONARY_COLUMNS:
+            # pochi codici ICAO ripetuti: indici interi più un dizionario per colonna
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=list(FLIGHT_COLUMNS))
+
+
+def write_day_snapshot(day):
+    """Riscrive lo snapshot del giorno; il rename atomico non disturba chi lo sta leggendo."""
+    if not snapshots_available():
+        return False
+    try:
+        rows = _load_day(day)
+    except Error as e:
+        print(f"Errore database nello snapshot dei voli del {day}: {e}")
+        return False
+
+    table = _build_table(rows)
+    path = snapshot_path(day)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return True
+
+
+def read_snapshot(day, airport=None):
+    """
+    Tabella del giorno letta via memory map: i buffer Arrow puntano
+    direttamente alle pagine del file, senza copie né accessi a MySQL.
+    """
+    with pa.memory_map(snapshot_path(day), "r") as source:
+        table = ipc.open_file(source).read_all()
+    if airport:
+        mask = pc.or_(
+            pc.equal(table["departure_airport"].cast(pa.string()), airport),
+            pc.equal(table["arrival_airport"].cast(pa.string()), airport),
+        )
+        table = table.filter(mask)
+    return table
+
+
+def table_to_stream(table):
+    sink = pa.BufferOutputStream()
+    with ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+class SnapshotScheduler:
+    """
+    Aggiorna gli snapshot in un thread dedicato, fuori dal ciclo di ingestion.
+    I giorni richiesti mentre un aggiornamento è in corso vengono accorpati.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flights-snapshot")
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.running = False
+        self.written = 0
+        self.errors = 0
+
+    def schedule(self, days):
+        if not snapshots_available() or not days:
+            return
+        with self.lock:
+            self.pending.update(days)
+            if self.running:
+                return
+            self.running = True
+        self.executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    return
+                day = min(self.pending)
+                self.pending.discard(day)
+            try:
+                if write_day_snapshot(day):
+                    self.written += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Errore nella scrittura dello snapshot del {day}: {e}")
+
+    def schedule_missing(self, days=SNAPSHOT_INITIAL_DAYS, today=None):
+        if not snapshots_available():
+            return
+        today = today or date.today()
+        missing = [
+            today - timedelta(days=i) for i in range(1, days + 1)
+            if not os.path.exists(snapshot_path(today - timedelta(days=i)))
+        ]
+        self.schedule(missing)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": snapshots_available(),
+                "pyarrow": pa is not None,
+                "pending_days": len(self.pending),
+                "written": self.written,
+                "errors": self.errors,
+            }
+
+
+snapshot_scheduler = SnapshotScheduler()
+
+
+def _on_flights_committed(rows):
+    snapshot_scheduler.schedule({datetime.fromtimestamp(row.departure_ts).date() for row in rows})
+
+
+add_commit_listener(_on_flights_committed)
@@ -0,0 +1,119 @@
+import codecs
+import json
+import os
+
+from flights_writer import flight_row
+
+# Byte letti dal socket per volta durante il parsing in streaming.
+STREAM_CHUNK_BYTES = int(os.getenv("OPENSKY_STREAM_CHUNK_BYTES", str(64 * 1024)))
+
+_WHITESPACE = " \t\n\r"
+
+
+class _TextBuffer:
+    """Testo decodificato in attesa di parsing, alimentato a blocchi."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Aggiunge il blocco successivo; False se lo stream è finito."""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.text += self.decoder.decode(b"", final=True)
+            self.eof = True
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        # scarto la parte già consumata, così il buffer resta grande quanto un blocco
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """Primo carattere significativo, senza consumarlo (None a fine stream)."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return None
+
+
+def iter_json_array(chunks, decoder=None):
+    """
+    Decodifica un array JSON elemento per elemento da un iterabile di blocchi.
+
+    Usa json.JSONDecoder.raw_decode sul buffer corrente: se un elemento è
+    spezzato tra due blocchi il decode fallisce e si legge il blocco
+    successivo. In memoria resta solo l'elemento in corso, non l'intero corpo.
+    """
+    decoder = decoder or json.JSONDecoder()
+    buf = _TextBuffer(chunks)
+
+    if buf.next_char() != "[":
+        raise ValueError("Risposta JSON non è un array")
+    buf.pos += 1
+
+    # dopo "[" e dopo "," serve un valore; dopo un valore solo "," o "]"
+    expect_value = True
+    empty = True
+    while True:
+        char = buf.next_char()
+        if char is None:
+            raise ValueError("Array JSON troncato")
+        if char == "]":
+            if expect_value and not empty:
+                raise ValueError("Virgola finale nell'array JSON")
+            buf.pos += 1
+            if buf.next_char() is not None:
+                raise ValueError("Dati dopo la fine dell'array JSON")
+            return
+        if char == ",":
+            if expect_value:
+                raise ValueError("Valore mancante nell'array JSON")
+            buf.pos += 1
+            expect_value = True
+            continue
+        if not expect_value:
+            raise ValueError("Separatore mancante tra due valori dell'array JSON")
+
+        try:
+            value, end = decoder.raw_decode(buf.text, buf.pos)
+        except json.JSONDecodeError:
+            if not buf.fill():
+                raise
+            continue
+
+        # un numero spezzato ("1." + "5") viene decodificato a metà: un valore
+        # scalare è completo solo se è seguito da "," o "]"
+        if not isinstance(value, (dict, list)):
+            rest = buf.text[end:].lstrip(_WHITESPACE)
+            if (not rest or rest[0] not in ",]") and buf.fill():
+                continue
+
+        buf.pos = end
+        expect_value = False
+        empty = False
+        yield value
+
+
+def iter_flight_rows(chunks, keep=None):
+    """
+    FlightRow di una risposta OpenSky letta in streaming (blocchi di byte,
+    ad esempio response.iter_content(STREAM_CHUNK_BYTES)).
+
+    keep, se presente, filtra i record durante il parsing (usato dallo sweep
+    /flights/all per tenere solo gli aeroporti monitorati).
+    """
+    for flight in iter_json_array(chunks):
+        row = flight_row(flight)
+        if keep is None or keep(row):
+            yield row
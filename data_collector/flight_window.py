@@ -0,0 +1,324 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from mysql.connector import Error
+from db import db_connection
+from flights_writer import add_commit_listener
+from flight_rollup import MAX_FLIGHT_DAYS
+from migrations import CALLSIGN_MAX_LENGTH
+
+try:
+    import numpy as np
+except ImportError:
+    # dipendenza opzionale: senza numpy le statistiche restano su MySQL
+    np = None
+
+# Giorni di voli tenuti in memoria per /flights/avg, /flights/stats e /flights/latest (0 = disattivata).
+HOT_WINDOW_DAYS = int(os.getenv("FLIGHTS_HOT_WINDOW_DAYS", "7"))
+
+DAY_SECONDS = 86400
+# Bucket di un quarto d'ora: allineati all'ora locale con qualunque fuso orario.
+BUCKET_SECONDS = 900
+INITIAL_CAPACITY = 4096
+
+
+def _key_hash(flight_id, departure_ts):
+    digest = hashlib.blake2b(f"{flight_id}|{departure_ts}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _window_start(now, days):
+    """Epoch del primo bucket orario del rollup compreso in [now - days, ...)."""
+    since = now - timedelta(days=days)
+    start = since.replace(minute=0, second=0, microsecond=0)
+    if start < since:
+        start += timedelta(hours=1)
+    return int(start.timestamp())
+
+
+class HotWindow:
+    """
+    Ultimi `days` giorni di voli in array NumPy colonnari: indice del codice
+    ICAO di partenza/arrivo ed epoch di partenza/arrivo.
+
+    Le righe arrivano da MySQL (all'avvio, o al primo uso di un aeroporto) e
+    dal writer dei voli dopo ogni commit; un hash a 64 bit della primary key
+    (flight_id, partenza) scarta i duplicati, compresi quelli ignorati da
+    INSERT IGNORE, con un confronto vettoriale.
+
+    Un aeroporto è servito dalla memoria solo se questa replica lo ingerisce
+    (owned_fn). I voli scritti fuori dal suo writer (backfill su un'altra
+    replica, replay del journal) aggiornano airport_leases.flights_changed_at:
+    se è successivo al caricamento, l'aeroporto viene riletto da MySQL.
+    """
+
+    def __init__(self, days=HOT_WINDOW_DAYS, owned_fn=None):
+        self.days = days
+        self.owned_fn = owned_fn
+        self.lock = threading.Lock()
+        self.codes = {}
+        self.code_list = []
+        self.loaded = {}           # aeroporto -> NOW() del database all'ultimo caricamento
+        self.clock_offset = 0.0    # NOW() del database - time.time()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        if self.enabled():
+            self._allocate(INITIAL_CAPACITY)
+
+    def enabled(self):
+        return np is not None and self.days > 0
+
+    def _allocate(self, capacity):
+        self.key_hash = np.empty(capacity, dtype=np.int64)
+        self.flight_id = np.empty(capacity, dtype=f"U{CALLSIGN_MAX_LENGTH}")
+        self.departure_idx = np.empty(capacity, dtype=np.int32)
+        self.arrival_idx = np.empty(capacity, dtype=np.int32)
+        self.departure_ts = np.empty(capacity, dtype=np.int64)
+        self.arrival_ts = np.empty(capacity, dtype=np.int64)
+
+    def _columns(self):
+        return ("key_hash", "flight_id", "departure_idx", "arrival_idx", "departure_ts", "arrival_ts")
+
+    def _cutoff(self, now):
+        # una partenza fino a un giorno prima può ancora atterrare dentro la finestra
+        return int(now) - (self.days + MAX_FLIGHT_DAYS) * DAY_SECONDS
+
+    def _code_index(self, code):
+        idx = self.codes.get(code)
+        if idx is None:
+            idx = self.codes[code] = len(self.code_list)
+            self.code_list.append(code)
+        return idx
+
+    def _compact(self, cutoff):
+        n = self.size
+        keep = self.departure_ts[:n] >= cutoff
+        if keep.all():
+            return
+        for name in self._columns():
+            column = getattr(self, name)
+            kept = column[:n][keep]
+            column[:len(kept)] = kept
+        self.size = int(keep.sum())
+
+    def _reserve(self, extra, cutoff):
+        capacity = len(self.departure_ts)
+        if self.size + extra <= capacity:
+            return
+        # prima di crescere libero le righe uscite dalla finestra
+        self._compact(cutoff)
+        if self.size + extra <= capacity:
+            return
+        while capacity < self.size + extra:
+            capacity *= 2
+        for name in self._columns():
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def _append(self, rows, now):
+        """rows: tuple (flight_id, departure_airport, arrival_airport, arrival_ts, departure_ts)."""
+        cutoff = self._cutoff(now)
+        rows = [row for row in rows if row[4] >= cutoff]
+        if not rows:
+            return 0
+
+        hashes = np.fromiter((_key_hash(row[0], row[4]) for row in rows), dtype=np.int64, count=len(rows))
+        # primo volo per chiave nel blocco, poi solo le chiavi non ancora in memoria
+        hashes, first = np.unique(hashes, return_index=True)
+        new = ~np.isin(hashes, self.key_hash[:self.size])
+        hashes, first = hashes[new], first[new]
+        if not len(first):
+            return 0
+
+        fresh = [rows[i] for i in first.tolist()]
+        self._reserve(len(fresh), cutoff)
+        start, end = self.size, self.size + len(fresh)
+        self.key_hash[start:end] = hashes
+        self.flight_id[start:end] = [row[0] for row in fresh]
+        self.departure_idx[start:end] = [self._code_index(row[1]) for row in fresh]
+        self.arrival_idx[start:end] = [self._code_index(row[2]) for row in fresh]
+        self.arrival_ts[start:end] = [row[3] for row in fresh]
+        self.departure_ts[start:end] = [row[4] for row in fresh]
+        self.size = end
+        return len(fresh)
+
+    def add_rows(self, rows):
+        """Listener del writer: FlightRow appena confermati su MySQL."""
+        with self.lock:
+            self._append(rows, self._now())
+
+    def _now(self):
+        return time.time() + self.clock_offset
+
+    def _load_airport(self, airport):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # le finestre si misurano sull'orologio del database, come il rollup
+            cursor.execute("SELECT NOW()")
+            loaded_at = cursor.fetchone()[0]
+            now = loaded_at.timestamp()
+            with self.lock:
+                self.clock_offset = now - time.time()
+            since = datetime.fromtimestamp(self._cutoff(now))
+            # due letture sugli indici aeroporto/orario, limitate alle partizioni recenti
+            cursor.execute(
+                """
+                SELECT flight_id, departure_airport, arrival_airport, date_time_arrival, date_time_departure
+                FROM flights
+                WHERE departure_airport = %s AND date_time_departure >= %s
+                UNION
+                SELECT flight_id, departure_airport, arrival_airport, date_time_arrival, date_time_departure
+                FROM flights
+                WHERE arrival_airport = %s AND date_time_departure >= %s
+                """,
+                (airport, since, airport, since)
+            )
+            rows = cursor.fetchall()
+        # DATETIME scritte con datetime.fromtimestamp: timestamp() ne è l'inversa
+        return loaded_at, now, [
+            (flight_id, departure, arrival, int(arrival_at.timestamp()), int(departure_at.timestamp()))
+            for flight_id, departure, arrival, arrival_at, departure_at in rows
+            if departure and arrival and arrival_at
+        ]
+
+    def load(self, airports):
+        """Carica da MySQL gli aeroporti indicati (es. quelli della replica all'avvio)."""
+        if not self.enabled():
+            return
+        for airport in sorted(airports):
+            self._ensure_loaded(airport)
+        print(f"Finestra in memoria dei voli: {self.size} voli, {len(self.loaded)} aeroporti, "
+              f"ultimi {self.days} giorni.")
+
+    def _ensure_loaded(self, airport, changed_at=None):
+        with self.lock:
+            loaded_at = self.loaded.get(airport)
+        if loaded_at is not None and (changed_at is None or changed_at < loaded_at):
+            return True
+        try:
+            loaded_at, now, rows = self._load_airport(airport)
+        except Error as e:
+            print(f"Errore database nel caricamento in memoria dei voli di {airport}: {e}")
+            return False
+        with self.lock:
+            # i commit avvenuti durante la lettura sono già arrivati dal listener;
+            # una rilettura aggiunge solo i voli che mancavano
+            self._append(rows, now)
+            self.loaded[airport] = loaded_at
+        return True
+
+    def retain(self, owned):
+        """Dimentica gli aeroporti non più ingeriti da questa replica (da ricaricare se tornano)."""
+        with self.lock:
+            self.loaded = {airport: at for airport, at in self.loaded.items() if airport in owned}
+
+    def _serves(self, airport, days, changed_at):
+        if not self.enabled() or any(d < 0 or d > self.days for d in days):
+            return False
+        if self.owned_fn is not None and airport not in self.owned_fn():
+            return False
+        return self._ensure_loaded(airport, changed_at)
+
+    def summaries(self, airport, windows, changed_at=None):
+        """
+        Stesso risultato di flight_rollup.summarize per ogni finestra, calcolato
+        con conteggi vettoriali sugli array; None se l'aeroporto non è in memoria.
+
+        Come il rollup, una finestra parte dal primo inizio d'ora non precedente
+        a NOW() - days (l'ora parziale iniziale è esclusa).
+        """
+        if not self._serves(airport, windows, changed_at):
+            self.misses += 1
+            return None
+
+        with self.lock:
+            now = datetime.fromtimestamp(self._now())
+        starts = [_window_start(now, days) for days in windows]
+        since = min(starts)
+        with self.lock:
+            idx = self.codes.get(airport, -1)
+            n = self.size
+            arrivals = self.arrival_ts[:n][(self.arrival_idx[:n] == idx) & (self.arrival_ts[:n] >= since)]
+            departures = self.departure_ts[:n][(self.departure_idx[:n] == idx) & (self.departure_ts[:n] >= since)]
+        self.hits += 1
+
+        results = []
+        for window_since in starts:
+            arrival_window = arrivals[arrivals >= window_since]
+            departure_window = departures[departures >= window_since]
+            buckets, counts = np.unique(
+                np.concatenate((arrival_window, departure_window)) // BUCKET_SECONDS, return_counts=True
+            )
+            # pochi bucket distinti: giorno e ora locali si calcolano solo per quelli
+            by_day = {}
+            by_hour = {}
+            for bucket, count in zip(buckets.tolist(), counts.tolist()):
+                start = datetime.fromtimestamp(bucket * BUCKET_SECONDS)
+                day = str(start.date())
+                by_day[day] = by_day.get(day, 0) + count
+                by_hour[start.hour] = by_hour.get(start.hour, 0) + count
+            results.append({
+                "arrivals": int(len(arrival_window)),
+                "departures": int(len(departure_window)),
+                "busiest_day": max(by_day.items(), key=lambda x: x[1]) if by_day else None,
+                "busiest_hour": max(by_hour.items(), key=lambda x: x[1]) if by_hour else None,
+            })
+        return results
+
+    def _row(self, position):
+        return {
+            "flight_id": str(self.flight_id[position]),
+            "departure_airport": self.code_list[self.departure_idx[position]],
+            "arrival_airport": self.code_list[self.arrival_idx[position]],
+            "date_time_arrival": datetime.fromtimestamp(int(self.arrival_ts[position])),
+            "date_time_departure": datetime.fromtimestamp(int(self.departure_ts[position])),
+        }
+
+    def latest(self, airport, changed_at=None):
+        """
+        Ultimo arrivo e ultima partenza dell'aeroporto nella finestra, nello
+        stesso formato di SELECT * su flights. None se l'aeroporto non è in
+        memoria; una direzione senza voli nella finestra vale None e va
+        cercata su MySQL.
+        """
+        if not self._serves(airport, [0], changed_at):
+            self.misses += 1
+            return None
+
+        with self.lock:
+            idx = self.codes.get(airport, -1)
+            n = self.size
+            result = {}
+            for direction, airports, times in (
+                    ("arrival", self.arrival_idx[:n], self.arrival_ts[:n]),
+                    ("departure", self.departure_idx[:n], self.departure_ts[:n]),
+            ):
+                positions = np.flatnonzero(airports == idx)
+                result[direction] = (
+                    self._row(positions[np.argmax(times[positions])]) if len(positions) else None
+                )
+        self.hits += 1
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled(),
+                "days": self.days,
+                "flights": self.size,
+                "capacity": len(self.departure_ts) if self.enabled() else 0,
+                "airports_loaded": len(self.loaded),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+hot_window = HotWindow()
+
+if hot_window.enabled():
+    add_commit_listener(hot_window.add_rows)
@@ -0,0 +1,252 @@
+import os
+from collections import namedtuple
+from itertools import islice
+from datetime import datetime
+from mysql.connector import Error
+from db import get_connection
+from migrations import ICAO_CODE_LENGTH, CALLSIGN_MAX_LENGTH
+from flight_dedup import FlightDeduplicator, recent_flights
+from flight_rollup import bucket_keys, refresh_buckets
+
+# Righe per singola INSERT multi-riga: tiene il pacchetto ben sotto max_allowed_packet.
+INSERT_CHUNK_SIZE = max(1, int(os.getenv("FLIGHTS_INSERT_CHUNK_SIZE", "500")))
+
+FLIGHT_COLUMNS = (
+    "flight_id",
+    "departure_airport",
+    "arrival_airport",
+    "date_time_arrival",
+    "date_time_departure",
+)
+
+FlightRow = namedtuple(
+    "FlightRow",
+    ["flight_id", "departure_airport", "arrival_airport", "arrival_ts", "departure_ts"],
+)
+
+# Funzioni chiamate con i FlightRow di ogni transazione confermata.
+_commit_listeners = []
+
+
+def add_commit_listener(listener):
+    """Registra listener(rows), chiamato dopo ogni commit riuscito del writer."""
+    _commit_listeners.append(listener)
+
+
+def flight_row(flight):
+    """
+    Record compatto di un volo OpenSky, anche se incompleto: i campi mancanti
+    restano None, così il numero di record coincide con quello dei voli ricevuti.
+    """
+    return FlightRow(
+        (flight.get("callsign") or "").strip() or None,
+        flight.get("estDepartureAirport"),
+        flight.get("estArrivalAirport"),
+        flight.get("lastSeen"),
+        flight.get("firstSeen"),
+    )
+
+
+def normalize_flight(flight):
+    """Converte un volo OpenSky (dict o FlightRow) in FlightRow, oppure None se incompleto."""
+    row = flight if isinstance(flight, FlightRow) else flight_row(flight)
+
+    if (
+            not row.flight_id or
+            not row.departure_airport or
+            not row.arrival_airport or
+            # colonne a larghezza fissa: un valore fuori formato farebbe fallire l'intero blocco
+            len(row.flight_id) > CALLSIGN_MAX_LENGTH or
+            len(row.departure_airport) != ICAO_CODE_LENGTH or
+            len(row.arrival_airport) != ICAO_CODE_LENGTH or
+            not isinstance(row.arrival_ts, int) or
+            not isinstance(row.departure_ts, int)
+    ):
+        return None
+
+    return row
+
+
+def normalize_flights(flights_data):
+    """Genera i FlightRow completi, senza materializzare il batch."""
+    for flight in flights_data or []:
+        row = normalize_flight(flight)
+        if row is not None:
+            yield row
+
+
+# executemany di mysql-connector riscrive questa INSERT (IGNORE compreso) in
+# un'unica istruzione multi-riga per blocco: un solo round trip per chunk.
+INSERT_QUERY = (
+    f"INSERT IGNORE INTO flights ({', '.join(FLIGHT_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(FLIGHT_COLUMNS))})"
+)
+
+
+def _row_values(row):
+    return (
+        row.flight_id,
+        row.departure_airport,
+        row.arrival_airport,
+        datetime.fromtimestamp(row.arrival_ts),
+        datetime.fromtimestamp(row.departure_ts),
+    )
+
+
+class FlightsWriter:
+    """
+    Scrittura bulk dei voli di un intero ciclo di ingestion.
+
+    Usa una sola connessione, presa dal pool solo alla prima scrittura (non
+    durante le richieste a OpenSky), e una sola transazione: write() consuma il
+    batch (lista o generatore) a blocchi di chunk_size righe e li inserisce
+    con INSERT IGNORE multi-riga, il commit avviene all'uscita dal blocco with.
+    I duplicati del ciclo e i voli già salvati di recente (history) vengono
+    scartati prima della INSERT; history=None li manda tutti al database.
+    Un errore di scrittura annulla l'intera transazione (InnoDB, ad esempio
+    per un deadlock, potrebbe averla già annullata): il writer resta "failed",
+    le write successive vengono ignorate e il commit non registra nulla.
+    Prima di ogni commit ricalcola, nella stessa transazione, i bucket del
+    rollup orario toccati dalle righe scritte. Dopo il commit passa le righe
+    scritte ai listener registrati con add_commit_listener().
+    """
+
+    def __init__(self, chunk_size=INSERT_CHUNK_SIZE, history=recent_flights):
+        self.chunk_size = chunk_size
+        self.dedup = FlightDeduplicator(history)
+        self.rollup_buckets = set()
+        self.committed_rows = []     # righe della transazione aperta, per i listener
+        self.conn = None
+        self.cursor = None
+        self.pending_count = 0
+        self.inserted_count = 0
+        self.errors = 0
+        self.failed = False
+
+    def __enter__(self):
+        return self
+
+    def transaction_cursor(self):
+        """Cursore della transazione del ciclo (es. per i checkpoint), aperta al primo uso."""
+        if self.conn is None:
+            self.conn = get_connection()
+            self.cursor = self.conn.cursor()
+        return self.cursor
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.conn is None:
+            # nessuna scrittura: nessuna connessione da chiudere
+            self.dedup.rolled_back()
+            return False
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self._discard()
+                self.conn.rollback()
+        except Error as e:
+            print(f"Errore database durante la chiusura della transazione voli: {e}")
+        finally:
+            self.conn.close()
+            self.conn = None
+            self.cursor = None
+        return False
+
+    def _discard(self):
+        """Dimentica tutto ciò che la transazione aperta aveva scritto."""
+        self.pending_count = 0
+        self.dedup.rolled_back()
+        self.rollup_buckets = set()
+        self.committed_rows = []
+
+    def fail(self, chunk=()):
+        """Annulla la transazione aperta e marca il writer come fallito."""
+        self.errors += 1
+        self.failed = True
+        self.dedup.forget(chunk)
+        self._discard()
+        if self.conn is None:
+            return
+        try:
+            self.conn.rollback()
+        except Error as e:
+            print(f"Errore database nel rollback della transazione voli: {e}")
+
+    def write(self, flights_data):
+        """Accoda il batch nella transazione corrente; restituisce le righe nuove."""
+        if self.failed:
+            return 0
+        rows = self.dedup.fresh(normalize_flights(flights_data))
+
+        written = 0
+        chunk = []
+        try:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                cursor = self.transaction_cursor()
+                cursor.executemany(INSERT_QUERY, [_row_values(row) for row in chunk])
+                # Con INSERT IGNORE rowcount conta solo le righe effettivamente inserite
+                written += cursor.rowcount
+                self.dedup.written(chunk)
+                self.rollup_buckets.update(bucket_keys(chunk))
+                if _commit_listeners:
+                    self.committed_rows.extend(chunk)
+        except Error as e:
+            # le righe dei blocchi precedenti non sono più garantite: si annulla tutto
+            print(f"Errore database durante il salvataggio dei voli, transazione annullata: {e}")
+            self.fail(chunk)
+            return 0
+
+        self.pending_count += written
+        return written
+
+    def commit(self):
+        if self.failed or self.conn is None:
+            return
+        if self.rollup_buckets:
+            try:
+                refresh_buckets(self.cursor, self.rollup_buckets)
+            except Error as e:
+                # un deadlock o un lock wait timeout può aver già annullato voli e
+                # checkpoint del ciclo: committare ora salverebbe una transazione vuota
+                print(f"Errore database nell'aggiornamento del rollup orario, transazione annullata: {e}")
+                self.fail()
+                return
+            self.rollup_buckets = set()
+        try:
+            self.conn.commit()
+        except Error as e:
+            print(f"Errore database durante il commit dei voli: {e}")
+            self.fail()
+            return
+        self.inserted_count += self.pending_count
+        self.pending_count = 0
+        self.dedup.committed()
+        self._notify_listeners()
+
+    def _notify_listeners(self):
+        rows, self.committed_rows = self.committed_rows, []
+        if not rows:
+            return
+        for listener in _commit_listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                # i voli sono già salvati: un listener non deve far fallire la scrittura
+                print(f"Errore in un listener dei voli salvati: {e}")
+
+
+def save_flights_to_db(flights_data):
+    """Salvataggio one-shot di un batch in una transazione dedicata."""
+    if not flights_data:
+        return 0
+
+    try:
+        with FlightsWriter() as writer:
+            writer.write(flights_data)
+    except Error as e:
+        print(f"Errore database durante il salvataggio dei voli: {e}")
+        return 0
+    return writer.inserted_count
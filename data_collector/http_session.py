@@ -0,0 +1,52 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENSKY_API_HOST = "https://opensky-network.org"
+OPENSKY_AUTH_HOST = "https://auth.opensky-network.org"
+
+# Connessioni keep-alive tenute per host: di default quante le fetch concorrenti.
+API_POOL_MAXSIZE = int(os.getenv(
+    "OPENSKY_HTTP_POOL_SIZE", os.getenv("OPENSKY_FETCH_CONCURRENCY", "8")
+))
+# Il token endpoint viene chiamato di rado, bastano poche connessioni.
+AUTH_POOL_MAXSIZE = int(os.getenv("OPENSKY_AUTH_POOL_SIZE", "2"))
+
+DEFAULT_HEADERS = {
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+# Gli adapter (e quindi i pool urllib3, thread-safe) sono condivisi da tutti i
+# thread: con pool_block=True un host non supera mai pool_maxsize connessioni.
+_adapters = {
+    OPENSKY_API_HOST: HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_MAXSIZE, pool_block=True),
+    OPENSKY_AUTH_HOST: HTTPAdapter(pool_connections=1, pool_maxsize=AUTH_POOL_MAXSIZE, pool_block=True),
+}
+
+_local = threading.local()
+
+
+def _build_session():
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    for prefix, adapter in _adapters.items():
+        session.mount(prefix, adapter)
+    return session
+
+
+def get_session():
+    """
+    Sessione HTTP del thread corrente.
+
+    requests.Session non è garantita thread-safe (cookie, header), quindi ogni
+    thread ha la propria; le connessioni TCP/TLS invece stanno negli adapter
+    condivisi, così il keep-alive vale per tutti i thread di fetch.
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _build_session()
+        _local.session = session
+    return session
@@ -0,0 +1,295 @@
+import argparse
+from datetime import date, datetime, timedelta
+from mysql.connector import Error
+from db import db_connection
+from open_sky_token import get_token
+from fetch_engine import (
+    fetch_flights, choose_strategy, sweep_eligible, AirportFetch, FetchTask, FLIGHT_TYPES, FETCH_CONCURRENCY,
+)
+from ingestion_checkpoints import (
+    ingestion_horizon, load_checkpoints, pending_windows, save_checkpoint, covered_airports, DAY_SECONDS,
+)
+from flight_rollup import hour_start, window_counts
+from flights_writer import FlightsWriter
+from flight_stream import iter_flight_rows
+from kafka_producer import publish_flights_update, flush_producer
+from response_journal import journal, iter_journal_file, SWEEP_ENDPOINT
+from work_leases import mark_flights_changed
+
+
+def get_interests():
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT DISTINCT airport FROM interests")
+
+            unique_airports = [row[0] for row in cursor.fetchall()]
+            return unique_airports
+    except Error as e:
+        print(f"Errore database nel recuperare interessi unici: {e}")
+        return []
+
+
+def build_fetch_plan(airports, horizon):
+    """FetchTask per le finestre non ancora coperte di ogni aeroporto/direzione."""
+    checkpoints = load_checkpoints(airports)
+    tasks = []
+    for airport_icao in airports:
+        for flight_type in FLIGHT_TYPES:
+            covered_until = checkpoints.get((airport_icao, flight_type))
+            for begin, end in pending_windows(covered_until, horizon):
+                tasks.append(FetchTask(airport_icao, flight_type, begin, end))
+    return tasks
+
+
+def rolling_counts(airports, horizon):
+    """
+    {airport: (arrivi, partenze)} delle 24 ore che terminano all'ultima ora
+    intera prima di `horizon`, letti dal rollup orario.
+
+    Solo per gli aeroporti con entrambe le direzioni già scaricate su tutta la
+    finestra: alert_system confronta la somma con soglie giornaliere, e un
+    conteggio parziale genererebbe false allerte LOW_THRESHOLD.
+    """
+    until = hour_start(horizon)
+    since = until - timedelta(days=1)
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            covered = covered_airports(cursor, airports, int(since.timestamp()), int(until.timestamp()))
+            return window_counts(cursor, sorted(covered), since, until)
+    except Error as e:
+        print(f"Errore database nel calcolo dei conteggi delle ultime 24 ore: {e}")
+        return {}
+
+
+def plans_sweep(airports, monitored):
+    """True se il piano degli aeroporti dati verrebbe scaricato con /flights/all."""
+    if not sweep_eligible(monitored):
+        return False
+    tasks = build_fetch_plan(airports, ingestion_horizon())
+    return choose_strategy(tasks, monitored) == "sweep"
+
+
+def refresh_airports(airports, monitored=None):
+    """
+    Scarica, salva e pubblica su Kafka i voli mancanti degli aeroporti dati.
+
+    `monitored` è il numero di aeroporti ingeriti dalla replica, usato per la
+    scelta della strategia quando gli aeroporti dati sono solo un batch.
+    Restituisce {airport: (arrivals, departures)} delle ultime 24 ore coperte
+    (vedi rolling_counts) per tutti gli aeroporti dati, anche quelli già
+    aggiornati; su Kafka vanno solo quelli con voli nuovi in questo ciclo.
+    """
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    horizon = ingestion_horizon()
+    tasks = build_fetch_plan(airports, horizon)
+    airports_to_fetch = {task.airport for task in tasks}
+    up_to_date = len(airports) - len(airports_to_fetch)
+
+    if not tasks:
+        print("Tutti gli aeroporti sono già aggiornati.")
+        return rolling_counts(airports, horizon)
+
+    access_token = get_token()
+    if not access_token:
+        print("Impossibile ottenere il token.")
+        return rolling_counts(airports, horizon)
+
+    print(f"  > Richiesta dati per {len(airports_to_fetch)} aeroporti d'interesse "
+          f"({len(tasks)} finestre, {up_to_date} già aggiornati, strategia {choose_strategy(tasks, monitored)}, "
+          f"concorrenza {FETCH_CONCURRENCY})...")
+
+    writer = FlightsWriter()
+    committed = False
+    try:
+        with writer:
+            for result in fetch_flights(tasks, access_token, monitored=monitored):
+                airport_icao = result.airport
+                flights_arr = result.arrivals
+                flights_dep = result.departures
+                if not flights_arr and not flights_dep:
+                    print(f"    > Nessun volo trovato per {airport_icao}.")
+
+                writer.write(flights_arr)
+                writer.write(flights_dep)
+                if writer.failed:
+                    # transazione annullata: nessun checkpoint deve avanzare in questo ciclo
+                    continue
+
+                for flight_type in FLIGHT_TYPES:
+                    covered = result.covered_range(flight_type)
+                    if not covered:
+                        continue
+                    try:
+                        save_checkpoint(writer.transaction_cursor(), airport_icao, flight_type, *covered)
+                    except Error as e:
+                        print(f"Errore database nel salvare il checkpoint {flight_type} per {airport_icao}: {e}")
+                        # un errore (es. deadlock) può aver annullato la transazione intera
+                        writer.fail()
+                        break
+        committed = not writer.failed
+    except Error as e:
+        print(f"Errore database durante il ciclo di ingestion: {e}")
+
+    counts = rolling_counts(airports, horizon)
+    if committed:
+        # solo dopo il commit: un ciclo annullato verrà riscaricato e ripubblicato
+        # al giro successivo, e gli utenti riceverebbero allerte doppie.
+        # Un aeroporto con una direzione fallita non è in counts: niente totale parziale.
+        for airport_icao in sorted(airports_to_fetch & counts.keys()):
+            arrivals, departures = counts[airport_icao]
+            publish_flights_update({
+                "airport": airport_icao,
+                "arrivals": arrivals,
+                "departures": departures,
+                "timestamp": timestamp
+            })
+
+    # flush UNA volta sola
+    flush_producer(5)
+
+    print(f"[{timestamp}] Elaborazione completata. Totale nuovi voli: {writer.inserted_count} "
+          f"(duplicati scartati prima del database: {writer.dedup.cycle_duplicates} nel ciclo, "
+          f"{writer.dedup.history_duplicates} già salvati).")
+    return counts
+
+
+def _journal_day_results(day, airports):
+    """
+    AirportFetch di un giorno ricostruiti dal journal, senza accesso alla rete,
+    più i voli dello sweep che cadono fuori dal giorno.
+    """
+    results = {}
+    routed = {}            # (airport, flight_type) -> voli dello sweep nel giorno
+    spill = []
+    begin = int(datetime.combine(day, datetime.min.time()).timestamp())
+    end = begin + DAY_SECONDS
+
+    def result_for(airport):
+        if airport not in results:
+            results[airport] = AirportFetch(airport)
+        return results[airport]
+
+    for path in journal.files(day, airports):
+        for meta, body in iter_journal_file(path):
+            rows = list(iter_flight_rows([body]))
+            if meta["endpoint"] != SWEEP_ENDPOINT:
+                task = FetchTask(meta["airport"], meta["endpoint"], meta["begin"], meta["end"])
+                result_for(task.airport).add(task, rows)
+                continue
+
+            # sweep /flights/all: ogni volo va alla finestra del giorno degli aeroporti
+            # monitorati; quelli che cadono fuori dal giorno vengono solo salvati
+            for row in rows:
+                for airport, flight_type, ts in ((row.departure_airport, "departure", row.departure_ts),
+                                                 (row.arrival_airport, "arrival", row.arrival_ts)):
+                    if airport not in airports:
+                        continue
+                    if ts is not None and begin <= ts < end:
+                        routed.setdefault((airport, flight_type), []).append(row)
+                    else:
+                        spill.append(row)
+
+    for (airport, flight_type), flights in routed.items():
+        result_for(airport).add(FetchTask(airport, flight_type, begin, end), flights)
+
+    return results, spill
+
+
+def _day_counts(day, airports):
+    since = datetime.combine(day, datetime.min.time())
+    try:
+        with db_connection() as conn:
+            return window_counts(conn.cursor(), airports, since, since + timedelta(days=1))
+    except Error as e:
+        print(f"Errore database nel calcolo dei conteggi del {day.isoformat()}: {e}")
+        return {}
+
+
+def replay_journal(airports=None, since=None, until=None):
+    """
+    Ricostruisce flights e ripubblica gli aggiornamenti Kafka dal journal
+    delle risposte OpenSky, giorno per giorno, senza consumare crediti API.
+
+    I checkpoint non vengono toccati: il replay rielabora dati già coperti.
+    Restituisce il numero di voli nuovi inseriti.
+    """
+    if not journal.enabled:
+        print("Journal OpenSky disattivato (OPENSKY_JOURNAL_DIR non impostato).")
+        return 0
+
+    airports = set(airports or get_interests())
+    if not airports:
+        print("Nessun aeroporto di interesse.")
+        return 0
+
+    inserted = 0
+    for day in journal.days(since, until):
+        timestamp = datetime.combine(day, datetime.min.time()).strftime("%Y-%m-%d %H:%M:%S")
+        results, spill = _journal_day_results(day, airports)
+        # un writer (e una transazione) per giorno: un replay lungo non tiene aperta
+        # un'unica transazione enorme, e il set dei voli visti riparte da zero.
+        # Il replay deve poter ricostruire una tabella svuotata: niente storia recente.
+        writer = FlightsWriter(history=None)
+        try:
+            with writer:
+                for airport_icao, result in sorted(results.items()):
+                    writer.write(result.arrivals)
+                    writer.write(result.departures)
+                writer.write(spill)
+        except Error as e:
+            print(f"Errore database durante il replay del {day.isoformat()}: {e}")
+            writer.failed = True
+
+        if writer.failed:
+            print(f"  > Replay {day.isoformat()} fallito: nessun volo salvato.")
+            continue
+        # conteggi dell'intero giorno dal rollup, solo per gli aeroporti con
+        # entrambe le direzioni nel journal: alert_system somma le due
+        complete = sorted(
+            airport for airport, result in results.items()
+            if all(result.fetched(flight_type) for flight_type in FLIGHT_TYPES)
+        )
+        for airport_icao, (arrivals, departures) in _day_counts(day, complete).items():
+            publish_flights_update({
+                "airport": airport_icao,
+                "arrivals": arrivals,
+                "departures": departures,
+                "timestamp": timestamp
+            })
+        inserted += writer.inserted_count
+        # il replay gira fuori dalle repliche: le loro cache vanno rilette
+        mark_flights_changed(airports)
+        print(f"  > Replay {day.isoformat()} completato ({writer.inserted_count} nuovi voli).")
+
+    flush_producer(5)
+    print(f"Replay del journal completato. Totale nuovi voli: {inserted}.")
+    return inserted
+
+
+def get_open_sky_data(replay=False, since=None, until=None):
+    if replay:
+        replay_journal(since=since, until=until)
+        return
+
+    airports_to_monitor = get_interests()
+
+    if not airports_to_monitor:
+        print("Nessun aeroporto di interesse.")
+        return
+
+    refresh_airports(airports_to_monitor)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingestion dei voli OpenSky")
+    parser.add_argument("--replay", action="store_true",
+                        help="ricostruisce flights e i messaggi Kafka dal journal, senza rete")
+    parser.add_argument("--since", type=date.fromisoformat, help="primo giorno del replay (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, help="ultimo giorno del replay (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    get_open_sky_data(replay=args.replay, since=args.since, until=args.until)
@@ -0,0 +1,106 @@
+import os
+from datetime import datetime, date, time, timedelta
+from mysql.connector import Error
+from db import db_connection
+
+DAY_SECONDS = 24 * 3600
+
+# Quanto indietro recuperare al massimo dopo un fermo del servizio.
+INGESTION_LOOKBACK_DAYS = int(os.getenv("INGESTION_LOOKBACK_DAYS", "7"))
+# Se impostato, l'orizzonte è "adesso - lag" invece della mezzanotte di oggi
+# (OpenSky pubblica arrivi/partenze con un batch notturno). Su Kafka vanno
+# comunque i totali delle 24 ore precedenti all'orizzonte, non della finestra.
+INGESTION_LAG_HOURS = os.getenv("INGESTION_LAG_HOURS")
+# Ampiezza massima di una singola richiesta arrival/departure.
+INGESTION_WINDOW_SECONDS = int(os.getenv("INGESTION_WINDOW_SECONDS", str(DAY_SECONDS)))
+
+
+def ingestion_horizon(now=None):
+    """Istante fino a cui i dati OpenSky sono considerati definitivi."""
+    now = now or datetime.now()
+    if INGESTION_LAG_HOURS:
+        return int((now - timedelta(hours=float(INGESTION_LAG_HOURS))).timestamp())
+    return int(datetime.combine(now.date(), time.min).timestamp())
+
+
+def default_start(horizon):
+    # Per un aeroporto mai scaricato si parte, come prima, dal giorno precedente
+    day = date.fromtimestamp(horizon - 1)
+    return int(datetime.combine(day, time.min).timestamp())
+
+
+def split_window(begin, end, max_span=INGESTION_WINDOW_SECONDS):
+    """Divide [begin, end) in finestre consecutive di al massimo max_span secondi."""
+    windows = []
+    start = begin
+    while start < end:
+        stop = min(start + max_span, end)
+        windows.append((start, stop))
+        start = stop
+    return windows
+
+
+def pending_windows(covered_until, horizon):
+    """Finestre ancora da scaricare per una coppia aeroporto/direzione."""
+    floor = horizon - INGESTION_LOOKBACK_DAYS * DAY_SECONDS
+    begin = covered_until if covered_until is not None else default_start(horizon)
+    begin = max(begin, floor)
+    if begin >= horizon:
+        return []
+    return split_window(begin, horizon)
+
+
+def load_checkpoints(airports):
+    """Restituisce {(airport, direction): covered_until} per gli aeroporti dati."""
+    if not airports:
+        return {}
+
+    placeholders = ", ".join(["%s"] * len(airports))
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT airport, direction, covered_until FROM ingestion_checkpoints "
+                f"WHERE airport IN ({placeholders})",
+                tuple(airports)
+            )
+            return {(airport, direction): covered_until for airport, direction, covered_until in cursor.fetchall()}
+    except Error as e:
+        print(f"Errore database nel leggere i checkpoint di ingestion: {e}")
+        return {}
+
+
+def save_checkpoint(cursor, airport, direction, begin, end):
+    """
+    Registra [begin, end) come scaricato. Va eseguito nella stessa transazione
+    dei voli, così il checkpoint avanza solo se i voli sono stati salvati.
+    """
+    cursor.execute(
+        """
+        INSERT INTO ingestion_checkpoints (airport, direction, covered_from, covered_until)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            covered_from = LEAST(covered_from, VALUES(covered_from)),
+            covered_until = GREATEST(covered_until, VALUES(covered_until))
+        """,
+        (airport, direction, begin, end)
+    )
+
+
+def covered_airports(cursor, airports, begin, end):
+    """Aeroporti con entrambe le direzioni già scaricate su tutto [begin, end)."""
+    if not airports:
+        return set()
+
+    placeholders = ", ".join(["%s"] * len(airports))
+    cursor.execute(
+        f"""
+        SELECT airport FROM ingestion_checkpoints
+        WHERE airport IN ({placeholders})
+          AND covered_from <= %s AND covered_until >= %s
+        GROUP BY airport
+        HAVING COUNT(*) = 2
+        """,
+        (*airports, begin, end)
+    )
+    return {row[0] for row in cursor.fetchall()}
@@ -0,0 +1,237 @@
+import os
+from collections import namedtuple
+from mysql.connector import Error
+from flight_partitions import partition_flights
+
+# Attesa massima del lock che serializza le migrazioni tra più repliche.
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("SCHEMA_MIGRATION_LOCK_TIMEOUT", "300"))
+MIGRATION_LOCK_NAME = "data_collector.schema_migrations"
+
+# Errori MySQL di ALTER non eseguibile con l'algoritmo/lock richiesti.
+ALTER_NOT_SUPPORTED = (1845, 1846)
+
+# Codici ICAO e callsign a larghezza fissa.
+ICAO_CODE_LENGTH = 4
+CALLSIGN_MAX_LENGTH = 8
+
+Migration = namedtuple("Migration", ["version", "name", "apply"])
+
+
+class MigrationError(Error):
+    pass
+
+
+BASELINE_TABLES = [
+    """ CREATE TABLE IF NOT EXISTS interests (
+            email VARCHAR(255),
+            airport VARCHAR(255),
+            high_value INT NULL,
+            low_value INT NULL,
+            PRIMARY KEY (email, airport)
+        ) """,
+
+    """ CREATE TABLE IF NOT EXISTS flights (
+            flight_id VARCHAR(255) NOT NULL,
+            departure_airport VARCHAR(255),
+            arrival_airport VARCHAR(255),
+            date_time_arrival DATETIME,
+            date_time_departure DATETIME NOT NULL,
+            PRIMARY KEY (flight_id, date_time_departure)
+        ) """,
+
+    # Intervalli [covered_from, covered_until) già scaricati, in epoch secondi
+    """ CREATE TABLE IF NOT EXISTS ingestion_checkpoints (
+            airport VARCHAR(255) NOT NULL,
+            direction VARCHAR(16) NOT NULL,
+            covered_from BIGINT NOT NULL,
+            covered_until BIGINT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (airport, direction)
+        ) """,
+
+    # Ripartizione degli aeroporti tra le repliche di data_collector
+    """ CREATE TABLE IF NOT EXISTS collector_replicas (
+            replica_id VARCHAR(255) NOT NULL PRIMARY KEY,
+            heartbeat_at DATETIME NOT NULL
+        ) """,
+
+    """ CREATE TABLE IF NOT EXISTS airport_leases (
+            airport VARCHAR(255) NOT NULL PRIMARY KEY,
+            owner VARCHAR(255) NULL,
+            lease_expires DATETIME NULL,
+            INDEX idx_airport_leases_owner (owner)
+        ) """,
+
+    # Stato dei circuit breaker condiviso tra le repliche (CB_SHARED_STATE=mysql)
+    """ CREATE TABLE IF NOT EXISTS circuit_breaker_state (
+            name VARCHAR(255) NOT NULL PRIMARY KEY,
+            state VARCHAR(16) NOT NULL,
+            opened_at DOUBLE NULL,
+            probe_owner VARCHAR(255) NULL,
+            probe_expires DOUBLE NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) """,
+
+    # Conteggi orari per aeroporto e direzione, mantenuti dal writer dei voli
+    """ CREATE TABLE IF NOT EXISTS flight_counts_hourly (
+            airport VARCHAR(255) NOT NULL,
+            direction VARCHAR(16) NOT NULL,
+            hour_start DATETIME NOT NULL,
+            flights INT NOT NULL,
+            PRIMARY KEY (airport, direction, hour_start)
+        ) """,
+]
+
+
+def alter_online(cursor, table, changes):
+    """
+    ALTER TABLE senza bloccare letture e scritture quando MySQL lo consente
+    (ALGORITHM=INPLACE, LOCK=NONE); altrimenti, ad esempio per un cambio di
+    tipo, ricopia la tabella lasciandola leggibile (LOCK=SHARED).
+    """
+    try:
+        cursor.execute(f"ALTER TABLE {table} {changes}, ALGORITHM=INPLACE, LOCK=NONE")
+    except Error as e:
+        if e.errno not in ALTER_NOT_SUPPORTED:
+            raise
+        print(f"  ALTER online non supportato su {table}, copia della tabella con LOCK=SHARED")
+        cursor.execute(f"ALTER TABLE {table} {changes}, ALGORITHM=COPY, LOCK=SHARED")
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+        """,
+        (table, index)
+    )
+    return cursor.fetchone() is not None
+
+
+def _baseline(cursor):
+    for statement in BASELINE_TABLES:
+        cursor.execute(statement)
+
+
+def _add_indexes(cursor):
+    # Gli indici secondari InnoDB contengono anche la primary key (flight_id,
+    # date_time_departure): con le colonne aggiunte coprono /flights/latest
+    # senza tornare alla tabella.
+    indexes = [
+        ("flights", "idx_flights_arrival",
+         "(arrival_airport, date_time_arrival, departure_airport)"),
+        ("flights", "idx_flights_departure",
+         "(departure_airport, date_time_departure, arrival_airport, date_time_arrival)"),
+        # alert_system e scheduler leggono email e soglie per aeroporto
+        ("interests", "idx_interests_airport", "(airport, high_value, low_value)"),
+    ]
+    for table, index, columns in indexes:
+        if not _index_exists(cursor, table, index):
+            alter_online(cursor, table, f"ADD INDEX {index} {columns}")
+
+
+def _check_fits(cursor, table, columns):
+    conditions = " OR ".join(
+        f"CHAR_LENGTH({column}) > {length} OR CHAR_LENGTH({column}) <> LENGTH({column})"
+        for column, length in columns
+    )
+    cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {conditions}")
+    too_long = cursor.fetchone()[0]
+    if too_long:
+        raise MigrationError(
+            msg=f"{too_long} righe di {table} non rientrano nelle colonne a larghezza fissa: correggerle e riavviare"
+        )
+
+
+def _compact_columns(cursor):
+    icao = f"CHAR({ICAO_CODE_LENGTH}) CHARACTER SET ascii"
+    callsign = f"CHAR({CALLSIGN_MAX_LENGTH}) CHARACTER SET ascii"
+
+    _check_fits(cursor, "flights", [("flight_id", CALLSIGN_MAX_LENGTH),
+                                    ("departure_airport", ICAO_CODE_LENGTH),
+                                    ("arrival_airport", ICAO_CODE_LENGTH)])
+    _check_fits(cursor, "interests", [("airport", ICAO_CODE_LENGTH)])
+    _check_fits(cursor, "flight_counts_hourly", [("airport", ICAO_CODE_LENGTH)])
+
+    alter_online(cursor, "flights",
+                 f"MODIFY flight_id {callsign} NOT NULL, "
+                 f"MODIFY departure_airport {icao} NULL, "
+                 f"MODIFY arrival_airport {icao} NULL")
+    alter_online(cursor, "interests", f"MODIFY airport {icao} NOT NULL")
+    alter_online(cursor, "flight_counts_hourly", f"MODIFY airport {icao} NOT NULL")
+
+
+def _flights_changed_marker(cursor):
+    # backfill e replay scrivono voli senza passare dal writer della replica
+    # proprietaria dell'aeroporto: questa colonna le dice di rileggerli
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'airport_leases' AND column_name = 'flights_changed_at'
+        """
+    )
+    if cursor.fetchone() is None:
+        alter_online(cursor, "airport_leases", "ADD COLUMN flights_changed_at DATETIME NULL")
+
+
+def _opensky_credits(cursor):
+    # crediti OpenSky spesi per giorno UTC da tutte le repliche (credit_ledger)
+    cursor.execute(
+        """ CREATE TABLE IF NOT EXISTS opensky_credits (
+                day DATE NOT NULL PRIMARY KEY,
+                credits_used INT NOT NULL
+            ) """
+    )
+
+
+MIGRATIONS = [
+    Migration(1, "baseline", _baseline),
+    Migration(2, "indici aeroporto/orario su flights e interests", _add_indexes),
+    Migration(3, "colonne ICAO e callsign a larghezza fissa", _compact_columns),
+    Migration(4, "flights partizionata per giorno di partenza", partition_flights),
+    Migration(5, "airport_leases.flights_changed_at per le cache dei voli", _flights_changed_marker),
+    Migration(6, "opensky_credits condivisi tra le repliche", _opensky_credits),
+]
+
+
+def migrate(conn):
+    """
+    Applica in ordine le migrazioni non ancora registrate in schema_migrations.
+
+    Un lock di MySQL (GET_LOCK) impedisce a due repliche di migrare insieme;
+    ogni migrazione è registrata solo dopo essere andata a buon fine, così
+    un avvio interrotto riparte da quella fallita.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK_NAME, MIGRATION_LOCK_TIMEOUT))
+    if cursor.fetchone()[0] != 1:
+        raise MigrationError(msg="Lock delle migrazioni non ottenuto: un'altra replica sta migrando")
+
+    try:
+        cursor.execute(
+            """ CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT NOT NULL PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) """
+        )
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        for migration in MIGRATIONS:
+            if migration.version in applied:
+                continue
+            print(f"Migrazione schema v{migration.version}: {migration.name}...")
+            migration.apply(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (migration.version, migration.name)
+            )
+            conn.commit()
+
+        print(f"Schema del database alla versione {MIGRATIONS[-1].version}.\n")
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+        cursor.fetchone()
@@ -1,24 +1,37 @@
 import os
+import threading
 import time
 import requests
-from circuit_breaker import CircuitBreaker, CircuitBreakerOpenException
+from circuit_breaker import CircuitBreakerOpenException, RetryPolicy, registry
+from breaker_state import shared_breaker_state
+from work_leases import REPLICA_ID
+from http_session import get_session, OPENSKY_AUTH_HOST
 
-TOKEN_URL = "https://auth.opensky-network.org/auth/realms/opensky-network/protocol/openid-connect/token"
+TOKEN_URL = f"{OPENSKY_AUTH_HOST}/auth/realms/opensky-network/protocol/openid-connect/token"
 CLIENT_ID = os.getenv("OPEN_SKY_CLIENT_ID")
 CLIENT_SECRET = os.getenv("OPEN_SKY_CLIENT_SECRET")
 
-CACHED_TOKEN = None
-TOKEN_EXPIRATION_TIME = 0
+# Il token viene rinnovato in background quando mancano TOKEN_REFRESH_AHEAD secondi alla scadenza.
+TOKEN_REFRESH_AHEAD = int(os.getenv("OPEN_SKY_TOKEN_REFRESH_AHEAD", "300"))
+# Attesa prima di ritentare un rinnovo fallito.
+TOKEN_RETRY_SECONDS = int(os.getenv("OPEN_SKY_TOKEN_RETRY_SECONDS", "30"))
 
-token_circuit_breaker = CircuitBreaker(
+# Timeout della richiesta del token (secondi).
+TOKEN_REQUEST_TIMEOUT = 10
+
+_token_retry_policy = RetryPolicy(max_attempts=3, retry_on=requests.exceptions.RequestException)
+
+token_circuit_breaker = registry.get(
+    "opensky.token",
     failure_threshold=3,
     recovery_timeout=60,
     expected_exception=requests.exceptions.RequestException,
+    retry_policy=_token_retry_policy,
+    shared_state=shared_breaker_state,
+    shared_owner=REPLICA_ID,
+    shared_probe_ttl=_token_retry_policy.max_duration(TOKEN_REQUEST_TIMEOUT),
 )
 
-def is_token_expired():
-    return CACHED_TOKEN is None or time.time() >= (TOKEN_EXPIRATION_TIME - 60)
-
 def get_opensky_token():
     if not CLIENT_ID or not CLIENT_SECRET:
         raise ValueError("CLIENT_ID o CLIENT_SECRET non impostati")
@@ -30,11 +43,11 @@ def get_opensky_token():
     }
 
     def _do_request():
-        r = requests.post(
+        r = get_session().post(
             TOKEN_URL,
             data=payload,
             headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=10
+            timeout=TOKEN_REQUEST_TIMEOUT
         )
         r.raise_for_status()
         return r
@@ -51,14 +64,91 @@ def get_opensky_token():
         print(f"Errore nella richiesta del token: {e}")
         return None
 
-def get_token():
-    global CACHED_TOKEN, TOKEN_EXPIRATION_TIME
+class TokenManager:
+    """
+    Cache del token OpenSky con rinnovo proattivo.
+
+    Il percorso caldo (get_token) legge una tupla immutabile (token, scadenza)
+    senza lock. Quando il token è assente o scaduto i thread che lo chiedono
+    insieme vengono coalizzati: uno solo chiama il token endpoint, gli altri
+    aspettano sul lock e trovano il token nuovo. Un thread in background lo
+    rinnova prima della scadenza, così il refresh di norma non capita mai sul
+    percorso di chi chiama.
+    """
+
+    def __init__(self, fetch=get_opensky_token, refresh_ahead=TOKEN_REFRESH_AHEAD):
+        self._fetch = fetch
+        self.refresh_ahead = refresh_ahead
+        self._state = (None, 0.0)            # (token, scadenza epoch): sostituita in blocco
+        self._refresh_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def _valid(self, state):
+        token, expires_at = state
+        return token is not None and time.time() < expires_at - 60
+
+    def get_token(self):
+        state = self._state
+        if self._valid(state):
+            return state[0]
+        return self.refresh(stale=state)
+
+    def refresh(self, stale=None):
+        with self._refresh_lock:
+            state = self._state
+            # un altro thread ha già rinnovato mentre aspettavamo il lock
+            if stale is not None and state is not stale and self._valid(state):
+                return state[0]
 
-    if is_token_expired():
-        token_data = get_opensky_token()
-        if token_data and "access_token" in token_data:
-            CACHED_TOKEN = token_data["access_token"]
-            TOKEN_EXPIRATION_TIME = time.time() + token_data.get("expires_in", 1800)
-            print("Token aggiornato!")
+            token_data = self._fetch()
+            if token_data and "access_token" in token_data:
+                state = (token_data["access_token"], time.time() + token_data.get("expires_in", 1800))
+                self._state = state
+                self.refreshes += 1
+                print("Token aggiornato!")
+            else:
+                self.failures += 1
 
-    return CACHED_TOKEN
\ No newline at end of file
+            self._start_background()
+            return state[0] if self._valid(state) else None
+
+    def _start_background(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="opensky-token-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            _, expires_at = self._state
+            self._wakeup.wait(max(expires_at - self.refresh_ahead - time.time(), 0))
+            self._wakeup.clear()
+
+            token, expires_at = self._state
+            if token is None or time.time() >= expires_at - self.refresh_ahead:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Errore nel rinnovo in background del token: {e}")
+                if self._state[0] is None or time.time() >= self._state[1] - self.refresh_ahead:
+                    # rinnovo fallito: riprovo più tardi senza martellare il token endpoint
+                    self._wakeup.wait(TOKEN_RETRY_SECONDS)
+
+    def stats(self):
+        token, expires_at = self._state
+        return {
+            "has_token": token is not None,
+            "expires_in": max(int(expires_at - time.time()), 0) if token else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "background_refresh": self._thread is not None,
+        }
+
+
+token_manager = TokenManager()
+
+
+def get_token():
+    return token_manager.get_token()
@@ -0,0 +1,158 @@
+import os
+import requests
+from datetime import datetime, date, timedelta, time
+from circuit_breaker import CircuitBreakerOpenException, RetryPolicy, registry
+from http_session import get_session, OPENSKY_API_HOST
+from breaker_state import shared_breaker_state
+from work_leases import REPLICA_ID
+from rate_limiter import opensky_rate_limiter, window_credits, RateLimitExceeded, OPENSKY_RATE_MAX_WAIT
+from flight_stream import iter_flight_rows, STREAM_CHUNK_BYTES
+from response_journal import journal, SWEEP_AIRPORT, SWEEP_ENDPOINT
+
+API_ROOT_URL = f"{OPENSKY_API_HOST}/api"
+
+# Con CB_PER_AIRPORT=true ogni aeroporto ha il proprio breaker per direzione,
+# così un aeroporto che risponde male non blocca gli altri.
+CB_PER_AIRPORT = os.getenv("CB_PER_AIRPORT", "false").lower() == "true"
+
+_flights_retry_policy = RetryPolicy(
+    max_attempts=int(os.getenv("OPENSKY_RETRY_ATTEMPTS", "3")),
+    base_delay=float(os.getenv("OPENSKY_RETRY_BASE_DELAY", "1")),
+    max_delay=float(os.getenv("OPENSKY_RETRY_MAX_DELAY", "30")),
+    retry_on=requests.exceptions.RequestException,
+)
+
+# Timeout di connessione e di lettura delle richieste /flights (secondi).
+REQUEST_TIMEOUT = 15
+# Durata massima di una sonda half-open: tentativi, attese tra i tentativi e
+# attese del rate limiter (una per tentativo). Il lease della sonda condivisa
+# deve durare almeno tanto, altrimenti due repliche sondano insieme.
+PROBE_LEASE_SECONDS = (_flights_retry_policy.max_duration(REQUEST_TIMEOUT)
+                       + _flights_retry_policy.max_attempts * OPENSKY_RATE_MAX_WAIT)
+
+
+def flights_circuit_breaker(flight_type, airport_icao):
+    """Breaker dell'endpoint /flights/<flight_type> (eventualmente per aeroporto)."""
+    name = f"opensky.flights.{flight_type}"
+    if CB_PER_AIRPORT:
+        name = f"{name}.{airport_icao}"
+    return registry.get(
+        name,
+        failure_threshold=5,
+        recovery_timeout=60,
+        expected_exception=requests.exceptions.RequestException,
+        # i timeout e i 429/5xx transitori vengono ritentati: al breaker arriva solo l'esito finale
+        retry_policy=_flights_retry_policy,
+        shared_state=shared_breaker_state,
+        shared_owner=REPLICA_ID,
+        shared_probe_ttl=PROBE_LEASE_SECONDS,
+    )
+
+
+def get_flights(airport_icao, access_token, flight_type, begin_time=None, end_time=None):
+    """
+    flight_type: 'arrival' oppure 'departure'
+    begin_time/end_time: epoch in secondi, di default l'intera giornata di ieri.
+    Restituisce una lista di FlightRow, oppure None se la richiesta fallisce,
+    così il chiamante non confonde un errore con una finestra senza voli.
+    """
+    if begin_time is None or end_time is None:
+        yesterday = date.today() - timedelta(days=1)
+        begin_time = int(datetime.combine(yesterday, time.min).timestamp())
+        end_time = int(datetime.combine(yesterday, time.max).timestamp())
+
+    params = {
+        "airport": airport_icao,
+        "begin": begin_time,
+        "end": end_time
+    }
+    return _request_flights(
+        f"flights/{flight_type}",
+        params,
+        flights_circuit_breaker(flight_type, airport_icao),
+        access_token,
+        f"{flight_type} per {airport_icao}",
+        journal_key=(flight_type, airport_icao),
+    )
+
+
+def get_all_flights(access_token, begin_time, end_time, keep=None):
+    """
+    Tutti i voli osservati da OpenSky in [begin_time, end_time].
+    L'endpoint accetta intervalli di al massimo due ore; stessa convenzione
+    di get_flights: None se la richiesta fallisce, [] se non ci sono voli.
+    keep filtra i FlightRow durante il parsing, prima che finiscano in memoria.
+    """
+    params = {"begin": begin_time, "end": end_time}
+    breaker = registry.get(
+        "opensky.flights.all",
+        failure_threshold=5,
+        recovery_timeout=60,
+        expected_exception=requests.exceptions.RequestException,
+        retry_policy=_flights_retry_policy,
+        shared_state=shared_breaker_state,
+        shared_owner=REPLICA_ID,
+        shared_probe_ttl=PROBE_LEASE_SECONDS,
+    )
+    return _request_flights("flights/all", params, breaker, access_token,
+                            f"all {begin_time}-{end_time}", keep,
+                            journal_key=(SWEEP_ENDPOINT, SWEEP_AIRPORT))
+
+
+def _request_flights(endpoint, params, breaker, access_token, label, keep=None, journal_key=None):
+    url = f"{API_ROOT_URL}/{endpoint}"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    credits = window_credits(params["begin"], params["end"])
+
+    def _do_request():
+        # anche i retry consumano un token del limiter condiviso
+        if not opensky_rate_limiter.acquire(credits=credits, timeout=OPENSKY_RATE_MAX_WAIT):
+            raise RateLimitExceeded("budget OpenSky esaurito")
+        recorder = journal.recorder(*journal_key, params["begin"], params["end"]) if journal_key else None
+        # il corpo viene decodificato in streaming dentro la chiamata protetta:
+        # una connessione che cade a metà risposta viene ritentata come le altre
+        with get_session().get(
+            url,
+            params=params,
+            headers=headers,
+            timeout=REQUEST_TIMEOUT,
+            stream=True
+        ) as r:
+            # OpenSky risponde 404 quando nella finestra non ci sono voli:
+            # non è un guasto e non deve pesare sul circuit breaker.
+            if r.status_code in (204, 404):
+                if recorder:
+                    recorder.commit(r.status_code)
+                return []
+            r.raise_for_status()
+
+            chunks = r.iter_content(chunk_size=STREAM_CHUNK_BYTES)
+            if recorder:
+                chunks = recorder.tee(chunks, r.status_code)
+            # si evita il testo completo della risposta, non le righe: i FlightRow
+            # restano in memoria fino al writer del ciclo, che gira sul thread dello
+            # scheduler dopo che la risposta è stata letta e accettata per intero
+            rows = list(iter_flight_rows(chunks, keep))
+            if recorder:
+                # la risposta è stata letta tutta: ora può entrare nel journal
+                recorder.commit()
+            return rows
+
+    try:
+        return breaker.call(_do_request)
+
+    except CircuitBreakerOpenException:
+        print(f"Circuit breaker OPEN: richiesta {label} bloccata")
+        return None
+
+    except RateLimitExceeded:
+        print(f"Rate limit OpenSky: richiesta {label} rinviata (budget esaurito)")
+        return None
+
+    except requests.exceptions.RequestException as e:
+        print(f"Errore nella richiesta {label}: {e}")
+        return None
+
+    except ValueError as e:
+        print(f"Risposta non valida per la richiesta {label}: {e}")
+        return None
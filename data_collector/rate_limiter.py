@@ -0,0 +1,152 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from credit_ledger import credit_ledger
+
+# Richieste OpenSky al secondo a regime e burst massimo.
+OPENSKY_RATE_PER_SECOND = float(os.getenv("OPENSKY_RATE_PER_SECOND", "2"))
+OPENSKY_BURST = float(os.getenv("OPENSKY_BURST", "10"))
+# Crediti API giornalieri dell'account (0 = nessun limite), condivisi tra le repliche
+# (vedi credit_ledger); si azzerano a mezzanotte UTC come su OpenSky.
+OPENSKY_DAILY_CREDITS = int(os.getenv("OPENSKY_DAILY_CREDITS", "4000"))
+# Crediti spesi per ogni giorno (o frazione) coperto da una richiesta arrival/departure.
+OPENSKY_CREDITS_PER_DAY = int(os.getenv("OPENSKY_CREDITS_PER_DAY", "1"))
+# Attesa massima in coda prima di rinunciare alla richiesta.
+OPENSKY_RATE_MAX_WAIT = float(os.getenv("OPENSKY_RATE_MAX_WAIT", "300"))
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot get a token within the allowed wait."""
+    pass
+
+
+def _utc_day():
+    return datetime.now(timezone.utc).date()
+
+
+class TokenBucket:
+    """
+    Token bucket con contabilità dei crediti giornalieri.
+
+    acquire() non fallisce quando il bucket è vuoto: prenota il token (il
+    saldo può andare in negativo) e dorme il tempo necessario, così le
+    richieste vengono servite in ordine di arrivo al ritmo configurato.
+    Rifiuta solo se l'attesa supererebbe il timeout o se i crediti del
+    giorno sono finiti.
+
+    Con un ledger condiviso (es. MySQLCreditLedger) i crediti sono contati
+    per tutto il cluster; se il ledger non risponde si ripiega sul conteggio
+    locale di questa replica.
+    """
+
+    def __init__(self, rate_per_second, capacity, daily_credits=0, ledger=None):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.daily_credits = daily_credits
+        self.ledger = ledger
+
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.credits_day = _utc_day()
+        self.credits_used = 0
+
+        self.granted = 0
+        self.waits = 0
+        self.total_wait_seconds = 0.0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _roll_day(self):
+        today = _utc_day()
+        if today != self.credits_day:
+            self.credits_day = today
+            self.credits_used = 0
+
+    def _charge_shared(self, credits):
+        """True/False dal ledger condiviso, None se non c'è o non risponde."""
+        if self.ledger is None or not self.daily_credits or not credits:
+            return None
+        try:
+            return self.ledger.charge(credits, self.daily_credits)
+        except Exception as e:
+            print(f"Ledger dei crediti OpenSky non disponibile, conteggio locale: {e}")
+            return None
+
+    def acquire(self, tokens=1, credits=0, timeout=None):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._roll_day()
+
+            missing = tokens - self.tokens
+            wait = missing / self.rate if missing > 0 and self.rate > 0 else 0.0
+            if timeout is not None and wait > timeout:
+                self.rejected += 1
+                return False
+            # token prenotato prima dell'addebito, che può essere una query
+            self.tokens -= tokens
+
+        shared = self._charge_shared(credits)
+
+        with self.lock:
+            self._roll_day()
+            if shared is None:
+                granted = not self.daily_credits or self.credits_used + credits <= self.daily_credits
+            else:
+                granted = shared
+            if not granted:
+                # crediti finiti: il token prenotato torna nel bucket
+                self.tokens += tokens
+                self.rejected += 1
+                return False
+
+            self.credits_used += credits
+            self.granted += 1
+            if wait > 0:
+                self.waits += 1
+                self.total_wait_seconds += wait
+
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def stats(self):
+        cluster_used = None
+        if self.ledger is not None:
+            try:
+                cluster_used = self.ledger.used()
+            except Exception as e:
+                print(f"Ledger dei crediti OpenSky non disponibile: {e}")
+        with self.lock:
+            self._refill(time.monotonic())
+            self._roll_day()
+            used = self.credits_used if cluster_used is None else cluster_used
+            return {
+                "rate_per_second": self.rate,
+                "capacity": self.capacity,
+                "tokens": round(self.tokens, 3),
+                "queued": max(0, math.ceil(-self.tokens)),
+                "daily_credits": self.daily_credits or None,
+                "credits_shared": self.ledger is not None,
+                "credits_used": used,
+                "credits_used_by_replica": self.credits_used,
+                "credits_remaining": (self.daily_credits - used) if self.daily_credits else None,
+                "granted": self.granted,
+                "waits": self.waits,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+                "rejected": self.rejected,
+            }
+
+
+def window_credits(begin_time, end_time):
+    days = max(1, math.ceil((end_time - begin_time) / 86400))
+    return days * OPENSKY_CREDITS_PER_DAY
+
+
+opensky_rate_limiter = TokenBucket(OPENSKY_RATE_PER_SECOND, OPENSKY_BURST, OPENSKY_DAILY_CREDITS, ledger=credit_ledger)
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import date
+
+# Cartella del journal delle risposte OpenSky (vuota = journal disattivato).
+JOURNAL_DIR = os.getenv("OPENSKY_JOURNAL_DIR", "")
+JOURNAL_COMPRESS_LEVEL = int(os.getenv("OPENSKY_JOURNAL_COMPRESS_LEVEL", "6"))
+JOURNAL_READ_BYTES = 1024 * 1024
+
+# Chiave usata per le risposte di /flights/all, che non riguardano un solo aeroporto.
+SWEEP_AIRPORT = "ALL"
+SWEEP_ENDPOINT = "all"
+
+
+def _gzip_compressor():
+    return zlib.compressobj(JOURNAL_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+
+
+class JournalRecorder:
+    """
+    Copia compressa di una singola risposta, scritta nel journal solo a
+    risposta completa: un tentativo fallito o ritentato non lascia tracce.
+    """
+
+    def __init__(self, journal, endpoint, airport, begin, end):
+        self.journal = journal
+        self.meta = {"endpoint": endpoint, "airport": airport, "begin": begin, "end": end}
+        self.compressor = None
+        self.parts = []
+
+    def _start(self, status):
+        self.meta["status"] = status
+        self.meta["fetched_at"] = int(time.time())
+        self.compressor = _gzip_compressor()
+        header = (json.dumps(self.meta) + "\n").encode("utf-8")
+        self.parts.append(self.compressor.compress(header))
+
+    def tee(self, chunks, status=200):
+        """Inoltra i blocchi della risposta al parser comprimendone una copia."""
+        self._start(status)
+        for chunk in chunks:
+            self.parts.append(self.compressor.compress(chunk))
+            yield chunk
+
+    def commit(self, status=None):
+        """Aggiunge il record al journal; senza tee() registra una finestra vuota."""
+        if self.compressor is None:
+            self._start(status)
+            self.parts.append(self.compressor.compress(b"[]"))
+        self.parts.append(self.compressor.flush())
+        self.journal.append(self.meta, b"".join(self.parts))
+        self.parts = []
+
+
+class ResponseJournal:
+    """
+    Journal append-only delle risposte OpenSky grezze.
+
+    Ogni risposta è un membro gzip a sé (riga JSON di intestazione con
+    endpoint, aeroporto e finestra, seguita dal corpo così come è arrivato)
+    accodato al file {giorno}/{aeroporto}.{direzione}.gz del giorno di inizio
+    finestra. I membri vengono riletti uno per uno, così i confini tra le
+    risposte si conservano anche se il file è un'unica sequenza gzip.
+    """
+
+    def __init__(self, root=JOURNAL_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.records = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def recorder(self, endpoint, airport, begin, end):
+        if not self.enabled:
+            return None
+        return JournalRecorder(self, endpoint, airport, begin, end)
+
+    def _path(self, meta):
+        day = date.fromtimestamp(meta["begin"]).isoformat()
+        return os.path.join(self.root, day, f"{meta['airport']}.{meta['endpoint']}.gz")
+
+    def append(self, meta, member):
+        path = self._path(meta)
+        try:
+            with self.lock:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "ab") as f:
+                    f.write(member)
+                self.records += 1
+                self.bytes_written += len(member)
+        except OSError as e:
+            # il journal è un supporto al replay: non deve fermare l'ingestion
+            self.errors += 1
+            print(f"Errore nella scrittura del journal {path}: {e}")
+
+    def days(self, since=None, until=None):
+        """Giorni presenti nel journal, in ordine, eventualmente filtrati."""
+        if not self.enabled or not os.path.isdir(self.root):
+            return []
+        days = []
+        for name in sorted(os.listdir(self.root)):
+            try:
+                day = date.fromisoformat(name)
+            except ValueError:
+                continue
+            if (since is None or day >= since) and (until is None or day <= until):
+                days.append(day)
+        return days
+
+    def files(self, day, airports=None):
+        """File di un giorno: per aeroporto (filtrati) più quelli dello sweep."""
+        folder = os.path.join(self.root, day.isoformat())
+        paths = []
+        for name in sorted(os.listdir(folder)):
+            airport = name.split(".", 1)[0]
+            if airport == SWEEP_AIRPORT or airports is None or airport in airports:
+                paths.append(os.path.join(folder, name))
+        return paths
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "root": self.root or None,
+                "records": self.records,
+                "bytes_written": self.bytes_written,
+                "errors": self.errors,
+            }
+
+
+def iter_journal_file(path):
+    """Genera (meta, corpo) per ogni risposta registrata in un file del journal."""
+    with open(path, "rb") as f:
+        pending = b""
+        while True:
+            decompressor = zlib.decompressobj(31)
+            parts = []
+            while not decompressor.eof:
+                data = pending or f.read(JOURNAL_READ_BYTES)
+                pending = b""
+                if not data:
+                    if parts or decompressor.unconsumed_tail:
+                        print(f"Record troncato in coda al journal {path}: ignorato")
+                    return
+                try:
+                    parts.append(decompressor.decompress(data))
+                except zlib.error as e:
+                    # scrittura interrotta (ad esempio un crash): il resto del file non è leggibile
+                    print(f"Journal {path} danneggiato, lettura interrotta: {e}")
+                    return
+            pending = decompressor.unused_data
+
+            record = b"".join(parts)
+            header, _, body = record.partition(b"\n")
+            yield json.loads(header), body
+
+
+journal = ResponseJournal()
@@ -0,0 +1,187 @@
+import threading
+import unittest
+from unittest import mock
+
+from circuit_breaker import CircuitBreaker, CircuitBreakerOpenException, InMemoryBreakerState, RetryPolicy
+
+
+class HTTPError(Exception):
+    """Stand-in for requests.HTTPError: carries a response with status and headers."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        headers = {"Retry-After": retry_after} if retry_after is not None else {}
+        self.response = mock.Mock(status_code=status_code, headers=headers)
+
+
+def failing(exc):
+    def func():
+        raise exc
+    return func
+
+
+def replicas(state, count=2, **kwargs):
+    settings = dict(failure_threshold=2, recovery_timeout=30, shared_cache_ttl=0)
+    settings.update(kwargs)
+    return [
+        CircuitBreaker(name="opensky", shared_state=state, shared_owner=f"replica-{i}", **settings)
+        for i in range(count)
+    ]
+
+
+def expire_open(state, name="opensky", seconds=3600):
+    # move the opening back instead of waiting for recovery_timeout
+    state._records[name]["opened_at"] -= seconds
+
+
+class SharedStateTest(unittest.TestCase):
+
+    def test_one_replica_opening_opens_both(self):
+        state = InMemoryBreakerState()
+        first, second = replicas(state)
+
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                first.call(failing(RuntimeError("down")))
+        self.assertEqual(first.state, "OPEN")
+        self.assertEqual(state.get("opensky")["state"], "OPEN")
+
+        called = []
+        with self.assertRaises(CircuitBreakerOpenException):
+            second.call(lambda: called.append(True))
+        self.assertEqual(called, [])
+        self.assertEqual(second.state, "OPEN")
+        self.assertEqual(second.stats()["rejected"], 1)
+
+    def test_fallback_is_used_when_open_elsewhere(self):
+        state = InMemoryBreakerState()
+        state.open("opensky")
+        breaker, = replicas(state, count=1, fallback=lambda: "fallback")
+        self.assertEqual(breaker.call(lambda: "live"), "fallback")
+
+    def test_single_probe_owner_across_replicas(self):
+        state = InMemoryBreakerState()
+        first, second = replicas(state)
+        state.open("opensky")
+        expire_open(state)
+
+        probing = threading.Event()
+        release = threading.Event()
+
+        def slow_probe():
+            probing.set()
+            release.wait(5)
+            return "ok"
+
+        results = []
+        probe = threading.Thread(target=lambda: results.append(first.call(slow_probe)))
+        probe.start()
+        self.assertTrue(probing.wait(5))
+
+        self.assertEqual(state.get("opensky")["probe_owner"], "replica-0")
+        with self.assertRaises(CircuitBreakerOpenException):
+            second.call(lambda: "ok")
+
+        release.set()
+        probe.join(5)
+        self.assertEqual(results, ["ok"])
+        self.assertEqual(state.get("opensky")["state"], "CLOSED")
+        self.assertEqual(second.call(lambda: "ok"), "ok")
+
+    def test_failed_probe_reopens_for_everyone(self):
+        state = InMemoryBreakerState()
+        first, second = replicas(state)
+        state.open("opensky")
+        expire_open(state)
+
+        with self.assertRaises(RuntimeError):
+            first.call(failing(RuntimeError("still down")))
+
+        record = state.get("opensky")
+        self.assertEqual(record["state"], "OPEN")
+        self.assertIsNone(record["probe_owner"])
+        self.assertLess(record["open_for"], first.recovery_timeout)
+        with self.assertRaises(CircuitBreakerOpenException):
+            second.call(lambda: "ok")
+
+    def test_expired_probe_lease_can_be_taken_over(self):
+        state = InMemoryBreakerState()
+        state.open("opensky")
+        self.assertTrue(state.try_acquire_probe("opensky", "replica-0", 60))
+        self.assertFalse(state.try_acquire_probe("opensky", "replica-1", 60))
+
+        state._records["opensky"]["probe_expires"] -= 120
+        self.assertTrue(state.try_acquire_probe("opensky", "replica-1", 60))
+
+        state.release_probe("opensky", "replica-0")
+        self.assertEqual(state.get("opensky")["probe_owner"], "replica-1")
+
+
+@mock.patch("circuit_breaker.time.sleep")
+class RetryInsideBreakerTest(unittest.TestCase):
+
+    def breaker(self, **policy):
+        settings = dict(max_attempts=3, base_delay=1.0, max_delay=30.0, jitter=False)
+        settings.update(policy)
+        return CircuitBreaker(name="opensky", failure_threshold=2, retry_policy=RetryPolicy(**settings))
+
+    def test_retry_after_is_honored_and_success_is_not_a_failure(self, sleep):
+        attempts = iter([HTTPError(429, retry_after="7"), HTTPError(503, retry_after="2")])
+
+        def flaky():
+            exc = next(attempts, None)
+            if exc is not None:
+                raise exc
+            return "ok"
+
+        breaker = self.breaker()
+        self.assertEqual(breaker.call(flaky), "ok")
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [7.0, 2.0])
+        stats = breaker.stats()
+        self.assertEqual((stats["calls"], stats["successes"], stats["failures"]), (1, 1, 0))
+        self.assertEqual(breaker.failure_count, 0)
+
+    def test_retry_after_is_capped(self, sleep):
+        breaker = self.breaker(max_attempts=2, max_retry_after=60.0)
+        with self.assertRaises(HTTPError):
+            breaker.call(failing(HTTPError(429, retry_after="3600")))
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [60.0])
+
+    def test_only_the_final_failure_counts(self, sleep):
+        breaker = self.breaker()
+        calls = []
+
+        def down():
+            calls.append(True)
+            raise HTTPError(503)
+
+        with self.assertRaises(HTTPError):
+            breaker.call(down)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [1.0, 2.0])
+        self.assertEqual((breaker.failures, breaker.failure_count, breaker.state), (1, 1, "CLOSED"))
+
+        with self.assertRaises(HTTPError):
+            breaker.call(down)
+        self.assertEqual((breaker.failures, breaker.state), (2, "OPEN"))
+
+    def test_non_retryable_status_fails_at_once(self, sleep):
+        breaker = self.breaker()
+        calls = []
+
+        def not_found():
+            calls.append(True)
+            raise HTTPError(401)
+
+        with self.assertRaises(HTTPError):
+            breaker.call(not_found)
+        self.assertEqual(len(calls), 1)
+        sleep.assert_not_called()
+
+    def test_max_duration_covers_retries_and_waits(self, sleep):
+        policy = RetryPolicy(max_attempts=3, max_delay=30.0, max_retry_after=60.0)
+        self.assertEqual(policy.max_duration(15), 3 * 15 + 2 * 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
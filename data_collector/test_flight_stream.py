@@ -0,0 +1,61 @@
+import json
+import unittest
+
+from flight_stream import iter_flight_rows, iter_json_array
+
+
+def split(text, size):
+    data = text.encode("utf-8")
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+FLIGHTS = [
+    {"callsign": "AZA123  ", "estDepartureAirport": "LIRF", "estArrivalAirport": "LIMC",
+     "firstSeen": 1700000000, "lastSeen": 1700003600},
+    {"callsign": None, "estDepartureAirport": "EGLL", "estArrivalAirport": None,
+     "firstSeen": 1700000100, "lastSeen": 1700007300},
+    {"callsign": "DLH4XY", "estDepartureAirport": "EDDF", "estArrivalAirport": "LIRF",
+     "firstSeen": 1.5e9, "lastSeen": -12},
+]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    def test_every_split_size_matches_json_loads(self):
+        text = json.dumps([1.5e3, -0.25, "città ✈", True, None, {"a": [1, {"b": "]"}]}, [], 12345678901234])
+        for size in range(1, len(text.encode("utf-8")) + 1):
+            with self.subTest(size=size):
+                self.assertEqual(list(iter_json_array(split(text, size))), json.loads(text))
+
+    def test_whitespace_and_empty_array(self):
+        self.assertEqual(list(iter_json_array([b" \n[ ", b" ]\n"])), [])
+        self.assertEqual(list(iter_json_array([b"[ 1 ,\n 2 ]"])), [1, 2])
+
+    def test_malformed_input_is_rejected(self):
+        for text in ("[1 2]", "[1,]", "[,1]", "[1,,2]", "[1", "[1,", "{}", "", "[1] 2", '["a" "b"]', "[tru]"):
+            with self.subTest(text=text):
+                for size in (1, 2, len(text) or 1):
+                    with self.assertRaises(ValueError):
+                        list(iter_json_array(split(text, size)))
+
+
+class IterFlightRowsTest(unittest.TestCase):
+
+    def test_rows_from_split_chunks(self):
+        text = json.dumps(FLIGHTS)
+        for size in (1, 7, 64, len(text)):
+            with self.subTest(size=size):
+                rows = list(iter_flight_rows(split(text, size)))
+                self.assertEqual(len(rows), len(FLIGHTS))
+                self.assertEqual(rows[0].flight_id, "AZA123")
+                self.assertIsNone(rows[1].flight_id)
+                self.assertEqual(rows[2].departure_ts, 1.5e9)
+
+    def test_keep_filters_during_parsing(self):
+        rows = list(iter_flight_rows(split(json.dumps(FLIGHTS), 5),
+                                     keep=lambda row: row.departure_airport == "EGLL"))
+        self.assertEqual([row.departure_airport for row in rows], ["EGLL"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import math
+import os
+import socket
+import threading
+from mysql.connector import Error
+from db import db_connection
+
+# Identità della replica: di default l'hostname del container.
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Una replica (e i suoi lease) è considerata morta se non batte da LEASE_TTL_SECONDS.
+LEASE_TTL_SECONDS = int(os.getenv("LEASE_TTL_SECONDS", "90"))
+LEASE_HEARTBEAT_SECONDS = int(os.getenv("LEASE_HEARTBEAT_SECONDS", "30"))
+
+
+class LeaseManager:
+    """
+    Ripartisce gli aeroporti da ingerire tra le repliche di data_collector.
+
+    Ogni aeroporto ha una riga in airport_leases con proprietario e scadenza;
+    a ogni heartbeat la replica rinnova i propri lease, rilascia quelli oltre
+    la sua quota equa (aeroporti / repliche vive) e reclama quelli liberi o
+    scaduti. Tutti i confronti temporali usano NOW() di MySQL, così gli
+    orologi delle repliche non contano.
+    """
+
+    def __init__(self, replica_id=REPLICA_ID, ttl=LEASE_TTL_SECONDS):
+        self.replica_id = replica_id
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.owned = set()
+        self.live_replicas = 0
+        self.total_airports = 0
+        self.fair_share = 0
+
+    def heartbeat(self):
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                me, ttl = self.replica_id, self.ttl
+
+                cursor.execute(
+                    """
+                    INSERT INTO collector_replicas (replica_id, heartbeat_at) VALUES (%s, NOW())
+                    ON DUPLICATE KEY UPDATE heartbeat_at = NOW()
+                    """,
+                    (me,)
+                )
+                cursor.execute(
+                    "DELETE FROM collector_replicas WHERE heartbeat_at < NOW() - INTERVAL %s SECOND",
+                    (ttl,)
+                )
+                cursor.execute("SELECT COUNT(*) FROM collector_replicas")
+                live_replicas = max(1, cursor.fetchone()[0])
+
+                # allineo le righe di lease agli aeroporti di interesse
+                cursor.execute("INSERT IGNORE INTO airport_leases (airport) SELECT DISTINCT airport FROM interests")
+                cursor.execute(
+                    "DELETE FROM airport_leases WHERE airport NOT IN (SELECT DISTINCT airport FROM interests)"
+                )
+                cursor.execute("SELECT COUNT(*) FROM airport_leases")
+                total_airports = cursor.fetchone()[0]
+                fair_share = math.ceil(total_airports / live_replicas)
+
+                cursor.execute(
+                    "UPDATE airport_leases SET lease_expires = NOW() + INTERVAL %s SECOND WHERE owner = %s",
+                    (ttl, me)
+                )
+                cursor.execute("SELECT COUNT(*) FROM airport_leases WHERE owner = %s", (me,))
+                owned_count = cursor.fetchone()[0]
+
+                if owned_count > fair_share:
+                    # è entrata una nuova replica: cedo l'eccedenza
+                    cursor.execute(
+                        """
+                        UPDATE airport_leases SET owner = NULL, lease_expires = NULL
+                        WHERE owner = %s ORDER BY airport DESC LIMIT %s
+                        """,
+                        (me, owned_count - fair_share)
+                    )
+                elif owned_count < fair_share:
+                    # lease liberi o di repliche morte
+                    cursor.execute(
+                        """
+                        UPDATE airport_leases
+                        SET owner = %s, lease_expires = NOW() + INTERVAL %s SECOND
+                        WHERE owner IS NULL OR lease_expires IS NULL OR lease_expires < NOW()
+                        ORDER BY airport LIMIT %s
+                        """,
+                        (me, ttl, fair_share - owned_count)
+                    )
+
+                conn.commit()
+
+                cursor.execute("SELECT airport FROM airport_leases WHERE owner = %s", (me,))
+                owned = {row[0] for row in cursor.fetchall()}
+
+        except Error as e:
+            # senza heartbeat i lease scadono e vengono ripresi dalle altre repliche
+            print(f"Errore database durante l'heartbeat dei lease: {e}")
+            with self.lock:
+                self.owned = set()
+            return
+
+        with self.lock:
+            self.owned = owned
+            self.live_replicas = live_replicas
+            self.total_airports = total_airports
+            self.fair_share = fair_share
+
+    def owned_airports(self):
+        with self.lock:
+            return set(self.owned)
+
+    def release_all(self):
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "UPDATE airport_leases SET owner = NULL, lease_expires = NULL WHERE owner = %s",
+                    (self.replica_id,)
+                )
+                cursor.execute("DELETE FROM collector_replicas WHERE replica_id = %s", (self.replica_id,))
+                conn.commit()
+        except Error as e:
+            print(f"Errore database nel rilascio dei lease: {e}")
+        with self.lock:
+            self.owned = set()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "replica_id": self.replica_id,
+                "live_replicas": self.live_replicas,
+                "total_airports": self.total_airports,
+                "fair_share": self.fair_share,
+                "owned_airports": sorted(self.owned),
+            }
+
+
+def mark_flights_changed(airports):
+    """
+    Segnala che i voli degli aeroporti sono cambiati fuori dal writer della
+    replica che li ingerisce (backfill, replay): le sue cache li rileggeranno.
+    """
+    airports = sorted(set(airports))
+    if not airports:
+        return
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE airport_leases SET flights_changed_at = NOW() "
+                f"WHERE airport IN ({', '.join(['%s'] * len(airports))})",
+                airports
+            )
+            conn.commit()
+    except Error as e:
+        print(f"Errore database nel segnalare i voli aggiornati di {', '.join(airports)}: {e}")